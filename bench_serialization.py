@@ -0,0 +1,148 @@
+"""
+Micro-benchmark for message serialization: the legacy path vs the DTO + dump_json path.
+
+Legacy: the original getattr-fallback format_message, then FastAPI's jsonable_encoder and
+JSONResponse's json.dumps (REST), or json.dumps with json_serializer (SSE).
+Current: format_message (MessageDTO) then dump_json for both.
+
+Usage: python bench_serialization.py [--messages 500] [--rounds 200]
+"""
+
+import os
+import json
+import time
+import argparse
+from datetime import datetime, timezone
+from typing import Any, Dict
+
+# telegram_api reads its credentials at import time; none are used here
+os.environ.setdefault("TELEGRAM_API_ID", "0")
+os.environ.setdefault("TELEGRAM_API_HASH", "bench")
+
+from fastapi.encoders import jsonable_encoder
+from telethon.tl.custom.message import Message
+from telethon.tl.types import (
+    Channel, ChatPhotoEmpty, MessageMediaPhoto, MessageReplyHeader, PeerChannel, PeerUser, PhotoEmpty, User,
+)
+
+import telegram_api
+from telegram_api import dump_json, format_message, json_serializer
+
+
+def legacy_format_message(message) -> Dict[str, Any]:
+    """format_message as it was before MessageDTO."""
+    result = {
+        "id": message.id,
+        "date": message.date.isoformat() if message.date else None,
+        "text": message.message,
+        "out": message.out,
+    }
+    sender_name = "Unknown"
+    sender_id = None
+    if hasattr(message, 'sender') and message.sender:
+        sender = message.sender
+        sender_id = getattr(sender, 'id', None)
+        if hasattr(sender, 'first_name'):
+            first = getattr(sender, 'first_name', '') or ''
+            last = getattr(sender, 'last_name', '') or ''
+            sender_name = f"{first} {last}".strip()
+        elif hasattr(sender, 'title'):
+            sender_name = sender.title
+        elif hasattr(sender, 'username'):
+            sender_name = f"@{sender.username}"
+    if sender_name == "Unknown" and hasattr(message, 'from_id'):
+        from_id = message.from_id
+        if hasattr(from_id, 'user_id'):
+            sender_id = from_id.user_id
+    if sender_name == "Unknown" and hasattr(message, 'peer_id'):
+        peer_id = message.peer_id
+        if hasattr(peer_id, 'user_id'):
+            sender_id = peer_id.user_id
+            sender_name = f"User {sender_id}"
+        elif hasattr(peer_id, 'channel_id'):
+            sender_name = f"Channel {peer_id.channel_id}"
+    result["sender_name"] = sender_name if sender_name else "Unknown"
+    result["sender_id"] = sender_id
+    if message.reply_to and message.reply_to.reply_to_msg_id:
+        result["reply_to_msg_id"] = message.reply_to.reply_to_msg_id
+    if message.media:
+        result["has_media"] = True
+        result["media_type"] = type(message.media).__name__
+    else:
+        result["has_media"] = False
+    return result
+
+
+def make_messages(count: int):
+    """A mix of private, channel, reply and media messages, with and without sender entities."""
+    date = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    user = User(id=5, first_name="Alice", last_name="Smith", username="alice")
+    channel = Channel(id=9, title="News", photo=ChatPhotoEmpty(), date=date)
+    messages = []
+    for i in range(count):
+        kind = i % 4
+        message = Message(
+            id=i + 1,
+            peer_id=PeerUser(5) if kind < 2 else PeerChannel(9),
+            message=f"Message number {i} with some ordinary text — and a little unicode ✓",
+            date=date,
+            from_id=PeerUser(5) if kind != 3 else None,
+            reply_to=MessageReplyHeader(reply_to_msg_id=i) if kind == 1 and i else None,
+            media=MessageMediaPhoto(photo=PhotoEmpty(id=i)) if kind == 2 else None,
+        )
+        if kind == 0:
+            message._sender = user
+        elif kind == 3:
+            message._sender = channel
+        messages.append(message)
+    return messages
+
+
+def fastapi_json(content) -> bytes:
+    # What JSONResponse does with the encoded result
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+def legacy_rest(messages):
+    return fastapi_json(jsonable_encoder({"messages": [legacy_format_message(m) for m in messages]}))
+
+
+def current_rest(messages):
+    return dump_json({"messages": [format_message(m) for m in messages]})
+
+
+def legacy_sse(messages):
+    return [json.dumps(legacy_format_message(m), default=json_serializer) for m in messages]
+
+
+def current_sse(messages):
+    return [dump_json(format_message(m)).decode() for m in messages]
+
+
+def measure(fn, messages, rounds: int) -> float:
+    fn(messages)  # warm-up
+    started = time.perf_counter()
+    for _ in range(rounds):
+        fn(messages)
+    return len(messages) * rounds / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=500, help="messages per page")
+    parser.add_argument("--rounds", type=int, default=200, help="pages serialized per measurement")
+    args = parser.parse_args()
+
+    messages = make_messages(args.messages)
+    assert [legacy_format_message(m) for m in messages] == [format_message(m) for m in messages]
+
+    encoder = "orjson" if telegram_api.orjson is not None else "json"
+    print(f"{args.messages} messages x {args.rounds} rounds, encoder: {encoder}")
+    for name, legacy, current in (("REST page", legacy_rest, current_rest), ("SSE events", legacy_sse, current_sse)):
+        before = measure(legacy, messages, args.rounds)
+        after = measure(current, messages, args.rounds)
+        print(f"{name:<11} legacy {before:>12,.0f} msg/s   current {after:>12,.0f} msg/s   x{after / before:.1f}")
+
+
+if __name__ == "__main__":
+    main()
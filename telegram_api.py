@@ -4,181 +4,4065 @@ Exposes the existing Telethon client via REST API for the TypeScript agent.
 """
 
 import os
+import sys
+import abc
+import copy
 import json
+import base64
+import time
 import asyncio
-from datetime import datetime
-from typing import List, Dict, Optional, Union, Any
+import bisect
+import itertools
+import sqlite3
+import hashlib
+import logging
+import queue
+import random
+import functools
+import inspect
+import gzip
+import shutil
+import signal
+import socket
+import stat
+import struct
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import List, Dict, Optional, Union, Any, Tuple, AsyncIterator
 from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from urllib.parse import quote
 
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, Query, UploadFile, File, Form
+from fastapi.encoders import jsonable_encoder
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from telethon import TelegramClient, functions
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from fastapi.routing import APIRoute
+from pydantic import BaseModel, ValidationError, create_model
+from starlette.datastructures import Headers, UploadFile as StarletteUploadFile
+from starlette.requests import Request
+from telethon import TelegramClient, functions, helpers, types, utils
+from telethon.errors import (
+    FileIdInvalidError, FileReferenceExpiredError, FileReferenceInvalidError, FloodWaitError,
+    MediaEmptyError, MediaInvalidError, UsernameInvalidError, UsernameNotOccupiedError,
+)
 from telethon.sessions import StringSession
 from telethon.tl.types import User, Chat, Channel
 
-load_dotenv()
+try:
+    import orjson
+except ImportError:  # optional: the stdlib encoder is used instead
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional: without it every response is JSON
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:  # optional: without it responses are only gzip-compressed
+    brotli = None
+
+load_dotenv()
+
+TELEGRAM_API_ID = int(os.getenv("TELEGRAM_API_ID"))
+TELEGRAM_API_HASH = os.getenv("TELEGRAM_API_HASH")
+TELEGRAM_SESSION_NAME = os.getenv("TELEGRAM_SESSION_NAME")
+SESSION_STRING = os.getenv("TELEGRAM_SESSION_STRING")
+# More accounts to spread chats over, comma-separated: "name:STRING_SESSION" or a session file name
+TELEGRAM_EXTRA_SESSIONS = os.getenv("TELEGRAM_EXTRA_SESSIONS", "")
+
+# Entity resolution cache settings
+ENTITY_CACHE_SIZE = int(os.getenv("ENTITY_CACHE_SIZE", "4096"))
+ENTITY_CACHE_TTL = float(os.getenv("ENTITY_CACHE_TTL", "3600"))
+ENTITY_NEGATIVE_TTL = float(os.getenv("ENTITY_NEGATIVE_TTL", "300"))
+
+# RPC scheduler settings
+RPC_CONCURRENCY = int(os.getenv("RPC_CONCURRENCY", "8"))
+RPC_MAX_FLOOD_WAIT = float(os.getenv("RPC_MAX_FLOOD_WAIT", "300"))
+RPC_DEFAULT_RATE = float(os.getenv("RPC_DEFAULT_RATE", "20"))
+RPC_DEFAULT_BURST = float(os.getenv("RPC_DEFAULT_BURST", "40"))
+RPC_PEER_RATE = float(os.getenv("RPC_PEER_RATE", "1"))
+RPC_PEER_BURST = float(os.getenv("RPC_PEER_BURST", "3"))
+# Per-method overrides, e.g. "send_message=20:30,get_messages=10:20" (rate per second:burst)
+RPC_METHOD_LIMITS = os.getenv("RPC_METHOD_LIMITS", "")
+
+# Identical concurrent reads share one upstream call; the result is reused this many
+# seconds after it completes (0 disables the micro-cache, not the coalescing)
+COALESCE_CACHE_TTL = float(os.getenv("COALESCE_CACHE_TTL", "1.0"))
+
+# Presence: how long a user's last known status is served without asking Telegram,
+# and the most users one bulk status request may ask for
+PRESENCE_CACHE_TTL = float(os.getenv("PRESENCE_CACHE_TTL", "300"))
+PRESENCE_MAX_USERS = int(os.getenv("PRESENCE_MAX_USERS", "5000"))
+
+# Read acknowledgements: at most one is sent per chat per this many seconds; the rest are merged
+READ_ACK_INTERVAL = float(os.getenv("READ_ACK_INTERVAL", "1.0"))
+
+# Local message store (empty path disables it)
+MESSAGE_STORE_PATH = os.getenv("MESSAGE_STORE_PATH", "messages.db")
+
+# Dialog index: full reload interval to correct drift from missed updates
+DIALOG_INDEX_TTL = float(os.getenv("DIALOG_INDEX_TTL", "900"))
+
+# Contact list: seconds between background refreshes (cheap when nothing changed)
+CONTACTS_REFRESH_INTERVAL = float(os.getenv("CONTACTS_REFRESH_INTERVAL", "60"))
+
+# Upload settings
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(2000 * 1024 * 1024)))
+UPLOAD_PARALLEL_PARTS = int(os.getenv("UPLOAD_PARALLEL_PARTS", "4"))
+# Content-hash -> uploaded media cache (empty path disables it)
+UPLOAD_CACHE_PATH = os.getenv("UPLOAD_CACHE_PATH", "uploads.db")
+UPLOAD_CACHE_SIZE = int(os.getenv("UPLOAD_CACHE_SIZE", "5000"))
+# Let streamed uploads name their content with X-Content-SHA256 and reuse cached media unverified
+UPLOAD_TRUST_CLIENT_SHA256 = os.getenv("UPLOAD_TRUST_CLIENT_SHA256", "false").lower() in ("1", "true", "yes")
+
+# Media downloads: on-disk cache (empty dir disables it), its total size, and bytes per Telegram request
+MEDIA_CACHE_DIR = os.getenv("MEDIA_CACHE_DIR", "media_cache")
+MEDIA_CACHE_MAX_BYTES = int(os.getenv("MEDIA_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+MEDIA_REQUEST_SIZE = int(os.getenv("MEDIA_REQUEST_SIZE", str(128 * 1024)))
+
+# Bulk send settings
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", "16"))
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", "5000"))
+
+# Batch endpoint settings
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "16"))
+BATCH_MAX_OPERATIONS = int(os.getenv("BATCH_MAX_OPERATIONS", "200"))
+
+# Watch broker settings
+WATCH_BUFFER_SIZE = int(os.getenv("WATCH_BUFFER_SIZE", "256"))
+WATCH_SLOW_CONSUMER_POLICY = os.getenv("WATCH_SLOW_CONSUMER_POLICY", "drop_oldest")
+WATCH_REPLAY_SIZE = int(os.getenv("WATCH_REPLAY_SIZE", "1000"))
+WATCH_RETENTION_SECONDS = float(os.getenv("WATCH_RETENTION_SECONDS", "300"))
+WS_BATCH_SIZE = int(os.getenv("WS_BATCH_SIZE", "100"))
+WS_BATCH_LINGER_MS = int(os.getenv("WS_BATCH_LINGER_MS", "20"))
+
+# Responses at least this large are gzip/brotli compressed when the client accepts it
+RESPONSE_COMPRESS_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESS_MIN_BYTES", "1024"))
+
+# Logging: level, "text" or "json" lines on stdout, records buffered for the writer thread (more are
+# dropped rather than blocking), and the share of per-message debug lines kept
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
+
+# Multi-process mode: with BRIDGE_WORKERS > 1, `python telegram_api.py` starts one owner process
+# holding the Telegram session plus that many HTTP worker processes talking to it over BRIDGE_SOCKET
+BRIDGE_WORKERS = int(os.getenv("BRIDGE_WORKERS", "1"))
+BRIDGE_SOCKET = os.getenv("BRIDGE_SOCKET", "telegram_bridge.sock")
+# Set by the launcher for the processes it starts: "owner" or "worker" (empty = single process)
+BRIDGE_ROLE = os.getenv("BRIDGE_ROLE", "")
+
+# Bridge endpoints: the owner's server in the owner process, the link to it in a worker
+bridge_server: Optional["BridgeServer"] = None
+bridge: Optional["BridgeClient"] = None
+
+# Global storage for watched chats
+watched_chats: Dict[str, "ChatTopic"] = {}
+
+# Reaper of idle watched chats, started in lifespan
+reaper: Optional[asyncio.Task] = None
+
+# Local message store, upload dedupe cache and media cache, opened in lifespan
+message_store: Optional["MessageStore"] = None
+upload_cache: Optional["UploadCache"] = None
+media_cache: Optional["MediaCache"] = None
+
+
+def json_serializer(obj):
+    """Helper function to convert non-serializable objects for JSON serialization."""
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    if isinstance(obj, bytes):
+        return obj.decode("utf-8", errors="replace")
+    raise TypeError(f"Object of type {type(obj)} is not JSON serializable")
+
+
+# One JSON encoder for REST responses, SSE and NDJSON streams: orjson when installed
+if orjson is not None:
+    def dump_json(obj, default=json_serializer) -> bytes:
+        """Encode to compact UTF-8 JSON."""
+        return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS)
+
+    load_json = orjson.loads
+else:
+    def dump_json(obj, default=json_serializer) -> bytes:
+        """Encode to compact UTF-8 JSON."""
+        return json.dumps(obj, default=default, ensure_ascii=False, separators=(",", ":")).encode()
+
+    load_json = json.loads
+
+
+def json_line(obj) -> bytes:
+    """Encode one NDJSON line."""
+    return dump_json(obj) + b"\n"
+
+
+def format_entity(entity) -> Dict[str, Any]:
+    """Format entity information consistently."""
+    result = {"id": entity.id}
+    if isinstance(entity, User):
+        result["type"] = "user"
+        result["first_name"] = getattr(entity, "first_name", None)
+        result["last_name"] = getattr(entity, "last_name", None)
+        result["username"] = getattr(entity, "username", None)
+        result["phone"] = getattr(entity, "phone", None)
+    elif isinstance(entity, Chat):
+        result["type"] = "chat"
+        result["title"] = getattr(entity, "title", None)
+    elif isinstance(entity, Channel):
+        result["type"] = "channel"
+        result["title"] = getattr(entity, "title", None)
+        result["username"] = getattr(entity, "username", None)
+    return result
+
+
+class MessageDTO:
+    """Compact, JSON-ready view of a message, extracted in a single pass.
+
+    This is the only place Telethon messages are converted; everything else (REST, SSE,
+    the message store) works with the dict from `to_dict`.
+    """
+
+    __slots__ = ("id", "date", "text", "out", "sender_name", "sender_id", "reply_to_msg_id", "media_type")
+
+    # Keys of the formatted dict, in output order; `fields=` projections choose from these
+    FIELDS = ("id", "date", "text", "out", "sender_name", "sender_id", "reply_to_msg_id", "has_media", "media_type")
+
+    def __init__(self, id: int, date: Optional[str], text: Optional[str], out: bool, sender_name: str,
+                 sender_id: Optional[int], reply_to_msg_id: Optional[int], media_type: Optional[str]):
+        self.id = id
+        self.date = date
+        self.text = text
+        self.out = out
+        self.sender_name = sender_name
+        self.sender_id = sender_id
+        self.reply_to_msg_id = reply_to_msg_id
+        self.media_type = media_type
+
+    @classmethod
+    def from_message(cls, message) -> "MessageDTO":
+        # Sender name: the sender entity when Telethon has it, else what the peer ids say
+        sender = getattr(message, "sender", None)
+        sender_name = None
+        sender_id = None
+        if sender:
+            sender_id = getattr(sender, "id", None)
+            if isinstance(sender, User):
+                sender_name = f"{sender.first_name or ''} {sender.last_name or ''}".strip()
+            elif hasattr(sender, "title"):
+                sender_name = sender.title
+            elif getattr(sender, "username", None):
+                sender_name = f"@{sender.username}"
+        if sender_name is None:
+            from_id = message.from_id
+            if isinstance(from_id, types.PeerUser):
+                sender_id = from_id.user_id
+            peer_id = message.peer_id
+            if isinstance(peer_id, types.PeerUser):
+                sender_id = peer_id.user_id
+                sender_name = f"User {sender_id}"
+            elif isinstance(peer_id, types.PeerChannel):
+                sender_name = f"Channel {peer_id.channel_id}"
+        
+        date = message.date
+        media = message.media
+        return cls(
+            message.id,
+            date.isoformat() if date else None,
+            message.message,
+            message.out,  # True if sent by us
+            sender_name or "Unknown",
+            sender_id,
+            getattr(message.reply_to, "reply_to_msg_id", None),
+            type(media).__name__ if media else None,
+        )
+
+    def to_dict(self, fields: Optional[Tuple[str, ...]] = None) -> Dict[str, Any]:
+        """Build the message dict, or only the given fields of it."""
+        if fields is not None:
+            # Same keys and omissions as the full dict, without building it first
+            result = {}
+            for name in fields:
+                if name == "has_media":
+                    result[name] = self.media_type is not None
+                elif name == "reply_to_msg_id":
+                    if self.reply_to_msg_id:
+                        result[name] = self.reply_to_msg_id
+                elif name == "media_type":
+                    if self.media_type is not None:
+                        result[name] = self.media_type
+                else:
+                    result[name] = getattr(self, name)
+            return result
+        result = {
+            "id": self.id,
+            "date": self.date,
+            "text": self.text,
+            "out": self.out,
+            "sender_name": self.sender_name,
+            "sender_id": self.sender_id,
+        }
+        if self.reply_to_msg_id:
+            result["reply_to_msg_id"] = self.reply_to_msg_id
+        if self.media_type is not None:
+            result["has_media"] = True
+            result["media_type"] = self.media_type
+        else:
+            result["has_media"] = False
+        return result
+
+
+def format_message(message, fields: Optional[Tuple[str, ...]] = None) -> Dict[str, Any]:
+    """Format message information consistently."""
+    return MessageDTO.from_message(message).to_dict(fields)
+
+
+def format_messages(messages, fields: Optional[Tuple[str, ...]] = None,
+                    full: bool = False) -> Tuple[List[Dict[str, Any]], Optional[List[Dict[str, Any]]]]:
+    """Format messages for a response, projected to `fields` as they are built.
+
+    With `full`, also returns the complete dicts (for the message store), reusing the
+    response dicts when there is no projection.
+    """
+    dtos = [MessageDTO.from_message(message) for message in messages]
+    formatted = [dto.to_dict(fields) for dto in dtos]
+    if not full:
+        return formatted, None
+    return formatted, formatted if fields is None else [dto.to_dict() for dto in dtos]
+
+
+def parse_fields(fields: Optional[str]) -> Optional[Tuple[str, ...]]:
+    """Parse a comma-separated `fields` parameter; None selects every field."""
+    if not fields:
+        return None
+    selected = tuple(dict.fromkeys(name for name in (f.strip() for f in fields.split(",")) if name))
+    unknown = [name for name in selected if name not in MessageDTO.FIELDS]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(MessageDTO.FIELDS)}"
+        )
+    return selected or None
+
+
+def project_messages(messages: List[Dict[str, Any]], fields: Optional[Tuple[str, ...]]) -> List[Dict[str, Any]]:
+    """Project already formatted messages (e.g. from the store) to `fields`."""
+    if fields is None:
+        return messages
+    return [{name: message[name] for name in fields if name in message} for message in messages]
+
+
+# ============= LOGGING =============
+
+log = logging.getLogger("telegram_bridge")
+# Per-message debug lines; only a LOG_SAMPLE_RATE share of them is kept
+event_log = logging.getLogger("telegram_bridge.events")
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return self.rate >= 1.0 or random.random() < self.rate
+
+
+event_log.addFilter(SamplingFilter(LOG_SAMPLE_RATE))
+
+# LogRecord attributes; anything else on a record came from `extra=` and is output as a field
+LOG_RECORD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+def record_fields(record: logging.LogRecord) -> Dict[str, Any]:
+    return {key: value for key, value in vars(record).items() if key not in LOG_RECORD_ATTRIBUTES}
+
+
+# `extra=` values the writer thread can format as they are
+IMMUTABLE_LOG_VALUES = (str, int, float, bool, bytes, datetime, type(None))
+
+
+def snapshot_log_value(value):
+    """Copy of a mutable `extra=` value as it is now; the caller may change it before the writer runs."""
+    if isinstance(value, (list, tuple, set, frozenset, dict)):
+        try:
+            return copy.deepcopy(value)
+        except Exception:
+            pass
+    return str(value)
+
+
+def log_json_default(obj):
+    """JSON fallback for log fields: what json_serializer can't encode is logged as str()."""
+    try:
+        return json_serializer(obj)
+    except TypeError:
+        return str(obj)
+
+
+class TextFormatter(logging.Formatter):
+    """Human-readable lines: time, level, logger, message, then `extra=` fields as key=value."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s%(fields)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        record.fields = "".join(f" {key}={value}" for key, value in record_fields(record).items())
+        return super().format(record)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, `extra=` fields included as keys."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **record_fields(record),
+        }
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return dump_json(entry, default=log_json_default).decode()
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Enqueues records for the writer thread, dropping them when the queue is full."""
+
+    def __init__(self, records: "queue.Queue[logging.LogRecord]"):
+        super().__init__(records)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Resolve only what can't wait (arguments, the traceback); formatting is the writer's job
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        for key, value in record_fields(record).items():
+            if not isinstance(value, IMMUTABLE_LOG_VALUES):
+                setattr(record, key, snapshot_log_value(value))
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogWriter(QueueListener):
+    def enqueue_sentinel(self):
+        # Shutdown only: wait for room rather than lose the sentinel
+        self.queue.put(self._sentinel)
+
+
+class LogPipeline:
+    """Moves log output off the event loop.
+
+    Logging calls only put the record on a bounded queue; a writer thread formats it
+    (text or JSON) and writes it to stdout. If the writer falls behind, e.g. behind
+    a log collector applying backpressure, records are dropped and counted instead
+    of blocking the loop.
+    """
+
+    def __init__(self, size: int):
+        self.queue: "queue.Queue[logging.LogRecord]" = queue.Queue(size)
+        self.handler = DroppingQueueHandler(self.queue)
+        self._writer: Optional[LogWriter] = None
+
+    def start(self):
+        if self._writer is not None:
+            return
+        output = logging.StreamHandler(sys.stdout)
+        output.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+        self._writer = LogWriter(self.queue, output)
+        self._writer.start()
+        log.setLevel(LOG_LEVEL)
+        log.addHandler(self.handler)
+        log.propagate = False
+
+    def stop(self):
+        """Write out what is queued and stop the writer thread."""
+        if self._writer is None:
+            return
+        log.removeHandler(self.handler)
+        self._writer.stop()
+        self._writer = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._writer is not None,
+            "queued": self.queue.qsize(),
+            "capacity": self.queue.maxsize,
+            "dropped": self.handler.dropped,
+        }
+
+
+log_pipeline = LogPipeline(LOG_QUEUE_SIZE)
+
+
+# ============= METRICS =============
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+FLOOD_WAIT_BUCKETS = (1.0, 5.0, 15.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+
+def label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def metric_line(name: str, labels: Dict[str, Any], value) -> str:
+    """One sample in the Prometheus text format."""
+    if not labels:
+        return f"{name} {value}"
+    pairs = ",".join(f'{key}="{label_value(label)}"' for key, label in labels.items())
+    return f"{name}{{{pairs}}} {value}"
+
+
+def render_family(lines: List[str], name: str, kind: str, help_text: str, samples: List[Tuple[Dict[str, Any], Any]]):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+    lines.extend(metric_line(name, labels, value) for labels, value in samples)
+
+
+class Histogram:
+    """Latency histogram with one series per label combination, rendered for Prometheus.
+
+    Observing is a bisect and two additions; buckets are made cumulative only when scraped.
+    """
+
+    __slots__ = ("name", "help", "label_names", "buckets", "_series")
+
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...], buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        # Label values -> per-bucket counts (the last one for +Inf) followed by the sum
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def take(self) -> Dict[Tuple[str, ...], List[float]]:
+        """Remove and return everything observed so far (a worker hands it to the owner)."""
+        series, self._series = self._series, {}
+        return series
+
+    def merge(self, series):
+        """Add (label values, counts and sum) pairs taken from another process's histogram."""
+        for labels, values in series:
+            labels = tuple(labels)
+            own = self._series.get(labels)
+            if own is None:
+                self._series[labels] = list(values)
+            else:
+                for i, value in enumerate(values):
+                    own[i] += value
+
+    def render(self, lines: List[str]):
+        if not self._series:
+            return
+        lines.append(f"# HELP {self.name} {self.help}")
+        lines.append(f"# TYPE {self.name} histogram")
+        for values, series in sorted(self._series.items()):
+            labels = dict(zip(self.label_names, values))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), series):
+                cumulative += count
+                lines.append(metric_line(f"{self.name}_bucket", {**labels, "le": bound}, cumulative))
+            lines.append(metric_line(f"{self.name}_sum", labels, round(series[-1], 6)))
+            lines.append(metric_line(f"{self.name}_count", labels, cumulative))
+
+
+http_latency = Histogram(
+    "telegram_bridge_http_request_duration_seconds",
+    "Time to handle an HTTP request, until its response starts.", ("route", "method", "status")
+)
+rpc_latency = Histogram("telegram_bridge_rpc_duration_seconds", "Time a Telegram call took, excluding queueing.", ("method",))
+rpc_queue_wait = Histogram("telegram_bridge_rpc_queue_wait_seconds", "Time a Telegram call waited in the scheduler.", ("priority",))
+flood_wait_durations = Histogram(
+    "telegram_bridge_flood_wait_seconds", "Flood waits imposed by Telegram, by method.", ("method",), FLOOD_WAIT_BUCKETS
+)
+event_latency = Histogram("telegram_bridge_event_handler_duration_seconds", "Time spent handling one update.", ("event",))
+
+
+def timed_handler(event: str):
+    """Record an update handler's processing time under `event`."""
+    def decorate(handler):
+        @functools.wraps(handler)
+        async def timed(update):
+            started = time.monotonic()
+            try:
+                return await handler(update)
+            finally:
+                event_latency.observe((event,), time.monotonic() - started)
+        return timed
+    return decorate
+
+
+def render_metrics() -> str:
+    """Everything /metrics reports, in the Prometheus text format.
+
+    In multi-process mode this runs in the owner; the HTTP histogram holds what the
+    workers handed over (see BridgeClient.send_observations).
+    """
+    lines: List[str] = []
+    for histogram in (http_latency, rpc_latency, rpc_queue_wait, flood_wait_durations, event_latency):
+        histogram.render(lines)
+
+    account_stats = [(account.name, account.scheduler.stats(), account) for account in accounts.accounts]
+    render_family(lines, "telegram_bridge_account_connected", "gauge", "Whether the account's client is connected.", [
+        ({"account": name}, int(account.client is not None and account.client.is_connected()))
+        for name, _, account in account_stats
+    ])
+    render_family(lines, "telegram_bridge_account_requests_total", "counter", "Requests routed to the account.", [
+        ({"account": name}, account.requests) for name, _, account in account_stats
+    ])
+    render_family(lines, "telegram_bridge_account_failovers_total", "counter",
+                  "Requests the account took over from a flood-waited one.", [
+        ({"account": name}, account.failovers) for name, _, account in account_stats
+    ])
+    render_family(lines, "telegram_bridge_rpc_in_flight", "gauge", "Telegram calls running.", [
+        ({"account": name}, stats["in_flight"]) for name, stats, _ in account_stats
+    ])
+    render_family(lines, "telegram_bridge_rpc_queue_depth", "gauge", "Telegram calls waiting in the scheduler.", [
+        ({"account": name, "priority": priority}, waiting["depth"])
+        for name, stats, _ in account_stats for priority, waiting in stats["queues"].items()
+    ])
+    render_family(lines, "telegram_bridge_rpc_calls_total", "counter", "Telegram calls finished, by outcome.", [
+        ({"account": name, "outcome": outcome}, stats[outcome])
+        for name, stats, _ in account_stats for outcome in ("completed", "failed")
+    ])
+    render_family(lines, "telegram_bridge_flood_waits_total", "counter", "Flood waits imposed on the account.", [
+        ({"account": name}, stats["flood_waits"]) for name, stats, _ in account_stats
+    ])
+    render_family(lines, "telegram_bridge_flood_wait_seconds_total", "counter", "Seconds of flood wait imposed on the account.", [
+        ({"account": name}, stats["flood_wait_seconds"]) for name, stats, _ in account_stats
+    ])
+    render_family(lines, "telegram_bridge_flood_blocked_methods", "gauge", "Methods currently blocked by a flood wait.", [
+        ({"account": name}, len(stats["blocked_methods"])) for name, stats, _ in account_stats
+    ])
+
+    topics = list(watched_chats.items())
+    render_family(lines, "telegram_bridge_watched_chats", "gauge", "Chats being watched.", [({}, len(topics))])
+    render_family(lines, "telegram_bridge_watch_subscribers", "gauge", "Subscribers of a watched chat.", [
+        ({"chat_id": chat_id}, len(topic.subscribers)) for chat_id, topic in topics
+    ])
+    render_family(lines, "telegram_bridge_watch_published_total", "counter", "Messages published to a watched chat.", [
+        ({"chat_id": chat_id}, topic.published) for chat_id, topic in topics
+    ])
+    render_family(lines, "telegram_bridge_watch_max_lag", "gauge", "Most events buffered for one subscriber of a chat.", [
+        ({"chat_id": chat_id}, max((len(s.buffer) for s in topic.subscribers), default=0)) for chat_id, topic in topics
+    ])
+
+    for direction, stats in (("upload", upload_stats), ("download", download_stats)):
+        render_family(lines, f"telegram_bridge_{direction}s_total", "counter", f"Files transferred ({direction}).",
+                      [({}, stats[f"{direction}s"])])
+        render_family(lines, f"telegram_bridge_{direction}_bytes_total", "counter", f"Bytes transferred ({direction}).",
+                      [({}, stats["bytes"])])
+        render_family(lines, f"telegram_bridge_{direction}_seconds_total", "counter",
+                      f"Seconds spent transferring ({direction}).", [({}, round(stats["seconds"], 3))])
+    render_family(lines, "telegram_bridge_log_records_dropped_total", "counter",
+                  "Log records dropped because the writer fell behind.", [({}, log_pipeline.handler.dropped)])
+    return "\n".join(lines) + "\n"
+
+
+# ============= RPC SCHEDULER =============
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_DEFAULT = 1
+PRIORITY_BACKGROUND = 2
+PRIORITY_NAMES = ("interactive", "default", "background")
+
+# Methods that write into a chat and are additionally limited per peer
+PEER_LIMITED_METHODS = {
+    "send_message", "send_file", "edit_message", "forward_messages",
+    "send_reaction", "pin_message",
+}
+
+# Calls that page through several requests. Telethon sleeps through their short flood waits
+# itself, as a retry by the scheduler would start the paging over
+PAGED_METHODS = {"get_dialogs", "get_messages", "search_messages", "send_file"}
+
+# Set while the scheduler runs any other call: its flood waits are left to the scheduler
+scheduler_handles_flood: ContextVar[bool] = ContextVar("scheduler_handles_flood", default=False)
+
+
+class FloodAwareClient(TelegramClient):
+    """TelegramClient that sleeps through short flood waits except inside calls the scheduler retries.
+
+    Everything else (paged calls, event.get_sender(), downloads) keeps Telethon's threshold.
+    """
+
+    @property
+    def flood_sleep_threshold(self):
+        return 0 if scheduler_handles_flood.get() else TelegramClient.flood_sleep_threshold.fget(self)
+
+    @flood_sleep_threshold.setter
+    def flood_sleep_threshold(self, value):
+        TelegramClient.flood_sleep_threshold.fset(self, value)
+
+
+# Built-in limits for methods the global default doesn't suit; RPC_METHOD_LIMITS overrides them
+DEFAULT_METHOD_LIMITS = {
+    # Uploads and downloads are chunked into many small parts
+    "upload_part": (200.0, 200.0),
+    "download_part": (200.0, 200.0),
+}
+
+
+def parse_method_limits(spec: str) -> Dict[str, Tuple[float, float]]:
+    """Parse "method=rate:burst,..." into a dict."""
+    limits = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        method, _, values = part.partition("=")
+        rate, _, burst = values.partition(":")
+        limits[method.strip()] = (float(rate), float(burst or rate))
+    return limits
+
+
+class TokenBucket:
+    """Classic token bucket that can also be blocked outright after a FloodWait."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token is available (0 if one is available now)."""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, now: float, seconds: float):
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = 0.0
+
+
+class RpcJob:
+    __slots__ = ("method", "peer", "factory", "priority", "future", "enqueued_at", "not_before", "flood_waits")
+
+    def __init__(self, method, peer, factory, priority, future):
+        self.method = method
+        self.peer = peer
+        self.factory = factory
+        self.priority = priority
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.not_before = 0.0
+        self.flood_waits = 0
+
+
+class RpcScheduler:
+    """Single gate between the HTTP routes and Telethon.
+
+    Jobs are dispatched by priority class, subject to per-method and per-peer token
+    buckets and a global concurrency cap. A FloodWaitError blocks the method's bucket
+    and puts the job back in its queue instead of failing the request.
+    """
+
+    # How many queued jobs per priority are inspected when looking for a runnable one
+    SCAN_LIMIT = 64
+    MAX_PEER_BUCKETS = 10000
+
+    def __init__(self, concurrency: int, max_flood_wait: float, method_limits: Dict[str, Tuple[float, float]]):
+        self.concurrency = concurrency
+        self.max_flood_wait = max_flood_wait
+        self.method_limits = method_limits
+        self.queues: List[deque] = [deque() for _ in PRIORITY_NAMES]
+        self.method_buckets: Dict[str, TokenBucket] = {}
+        self.peer_buckets: "OrderedDict[int, TokenBucket]" = OrderedDict()
+        self.in_flight = 0
+        self._wakeup = asyncio.Event()
+        self._dispatcher: Optional[asyncio.Task] = None
+        # Running jobs, referenced until they finish so they can't be garbage collected
+        self._running: set = set()
+        self.completed = 0
+        self.failed = 0
+        self.flood_waits = 0
+        self.flood_wait_seconds = 0.0
+        self.wait_total = [0.0] * len(PRIORITY_NAMES)
+        self.wait_max = [0.0] * len(PRIORITY_NAMES)
+        self.dispatched = [0] * len(PRIORITY_NAMES)
+        self.method_calls: Dict[str, int] = {}
+
+    async def call(self, method: str, factory, peer: Optional[int] = None, priority: int = PRIORITY_DEFAULT):
+        """Queue `factory()` (a coroutine factory) and return its result once it has run."""
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        job = RpcJob(method, peer if method in PEER_LIMITED_METHODS else None, factory, priority,
+                     asyncio.get_running_loop().create_future())
+        self.queues[priority].append(job)
+        self._wakeup.set()
+        return await job.future
+
+    def stop(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+
+    def _method_bucket(self, method: str) -> TokenBucket:
+        bucket = self.method_buckets.get(method)
+        if bucket is None:
+            rate, burst = self.method_limits.get(method, (RPC_DEFAULT_RATE, RPC_DEFAULT_BURST))
+            bucket = self.method_buckets[method] = TokenBucket(rate, burst)
+        return bucket
+
+    def _peer_bucket(self, peer: int) -> TokenBucket:
+        bucket = self.peer_buckets.get(peer)
+        if bucket is None:
+            bucket = self.peer_buckets[peer] = TokenBucket(RPC_PEER_RATE, RPC_PEER_BURST)
+            while len(self.peer_buckets) > self.MAX_PEER_BUCKETS:
+                self.peer_buckets.popitem(last=False)
+        else:
+            self.peer_buckets.move_to_end(peer)
+        return bucket
+
+    def _delay(self, job: RpcJob, now: float) -> float:
+        delay = max(job.not_before - now, self._method_bucket(job.method).delay(now))
+        if job.peer is not None:
+            delay = max(delay, self._peer_bucket(job.peer).delay(now))
+        return delay
+
+    def _next_runnable(self, now: float) -> Tuple[Optional[RpcJob], Optional[float]]:
+        """Find the highest-priority job that may run now, or the delay until one might."""
+        next_delay = None
+        for pending in self.queues:
+            index = 0
+            while index < len(pending) and index < self.SCAN_LIMIT:
+                job = pending[index]
+                if job.future.done():
+                    # Caller went away (e.g. HTTP client disconnected)
+                    del pending[index]
+                    continue
+                delay = self._delay(job, now)
+                if delay <= 0:
+                    del pending[index]
+                    return job, None
+                next_delay = delay if next_delay is None else min(next_delay, delay)
+                index += 1
+        return None, next_delay
+
+    async def _dispatch(self):
+        while True:
+            next_delay = None
+            if self.in_flight < self.concurrency:
+                now = time.monotonic()
+                job, next_delay = self._next_runnable(now)
+                if job is not None:
+                    self._launch(job, now)
+                    continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=next_delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def _launch(self, job: RpcJob, now: float):
+        self._method_bucket(job.method).take()
+        if job.peer is not None:
+            self._peer_bucket(job.peer).take()
+        waited = now - job.enqueued_at
+        self.wait_total[job.priority] += waited
+        self.wait_max[job.priority] = max(self.wait_max[job.priority], waited)
+        self.dispatched[job.priority] += 1
+        rpc_queue_wait.observe((PRIORITY_NAMES[job.priority],), waited)
+        self.method_calls[job.method] = self.method_calls.get(job.method, 0) + 1
+        self.in_flight += 1
+        task = asyncio.create_task(self._run(job))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, job: RpcJob):
+        # Runs in its own task, so this only affects the job's own requests
+        scheduler_handles_flood.set(job.method not in PAGED_METHODS)
+        started = time.monotonic()
+        try:
+            result = await job.factory()
+        except FloodWaitError as e:
+            now = time.monotonic()
+            self.flood_waits += 1
+            self.flood_wait_seconds += e.seconds
+            flood_wait_durations.observe((job.method,), e.seconds)
+            job.flood_waits += 1
+            self._method_bucket(job.method).block(now, e.seconds)
+            if e.seconds > self.max_flood_wait or job.future.done():
+                self.failed += 1
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                # Re-queue at the front of its class so it keeps its place once the wait is over
+                job.not_before = now + e.seconds
+                self.queues[job.priority].appendleft(job)
+        except Exception as e:
+            self.failed += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            self.completed += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            rpc_latency.observe((job.method,), time.monotonic() - started)
+            self.in_flight -= 1
+            self._wakeup.set()
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "in_flight": self.in_flight,
+            "concurrency": self.concurrency,
+            "completed": self.completed,
+            "failed": self.failed,
+            "flood_waits": self.flood_waits,
+            "flood_wait_seconds": round(self.flood_wait_seconds, 1),
+            "queues": {
+                name: {
+                    "depth": len(self.queues[i]),
+                    "dispatched": self.dispatched[i],
+                    "avg_wait_ms": round(self.wait_total[i] / self.dispatched[i] * 1000, 2) if self.dispatched[i] else 0.0,
+                    "max_wait_ms": round(self.wait_max[i] * 1000, 2),
+                }
+                for i, name in enumerate(PRIORITY_NAMES)
+            },
+            "blocked_methods": {
+                method: round(bucket.blocked_until - now, 1)
+                for method, bucket in self.method_buckets.items() if bucket.blocked_until > now
+            },
+            "method_calls": dict(self.method_calls),
+        }
+
+
+async def rpc(method: str, factory, peer=None, priority: int = PRIORITY_DEFAULT):
+    """Run a Telethon call through the scheduler. `peer` is an entity used for per-chat limits."""
+    return await scheduler.call(method, factory, utils.get_peer_id(peer) if peer is not None else None, priority)
+
+
+# ============= REQUEST COALESCING =============
+
+class SingleFlight:
+    """Runs concurrent identical calls once and shares the result among the callers.
+
+    The shared call runs in its own task, so a caller that goes away doesn't cancel it for
+    the others. With `ttl`, successful results are also reused for that many seconds after
+    completion (a micro-cache); errors are never kept.
+    """
+
+    def __init__(self, ttl: float = 0.0, maxsize: int = 4096):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._inflight: Dict[Any, asyncio.Task] = {}
+        self._recent: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+        self.calls = 0
+        self.coalesced = 0
+        self.cache_hits = 0
+
+    async def do(self, key, factory):
+        """Return factory()'s result, sharing an in-flight or just-finished call for the same key."""
+        if self.ttl > 0:
+            entry = self._recent.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self.cache_hits += 1
+                    return entry[1]
+                del self._recent[key]
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # exception() also marks errors as retrieved when every caller has gone
+        if task.cancelled() or task.exception() is not None or self.ttl <= 0:
+            return
+        self._recent[key] = (time.monotonic() + self.ttl, task.result())
+        self._recent.move_to_end(key)
+        while len(self._recent) > self.maxsize:
+            self._recent.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "cache_hits": self.cache_hits,
+            "in_flight": len(self._inflight),
+            "ttl": self.ttl,
+        }
+
+
+# ============= ENTITY RESOLUTION =============
+
+class EntityCache:
+    """Bounded LRU + TTL cache of resolved entities, keyed by numeric id and username."""
+
+    def __init__(self, maxsize: int, ttl: float, negative_ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        # key -> (expires_at, entity or None, error message for negative entries)
+        self._entries: "OrderedDict[Tuple[str, Union[int, str]], Tuple[float, Any, Optional[str]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key_for(chat_id: Union[int, str]) -> Tuple[str, Union[int, str]]:
+        """Normalize a chat/user reference into a cache key."""
+        value = str(chat_id).strip()
+        if value.lstrip('-').isdigit():
+            return ("id", int(value))
+        return ("username", value.lstrip('@').lower())
+
+    def lookup(self, key: Tuple[str, Union[int, str]]):
+        """Return the cached entity, None on a miss, or raise ValueError for a cached unknown username."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, entity, error = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        if entity is None:
+            self.negative_hits += 1
+            raise ValueError(error)
+        self.hits += 1
+        return entity
+
+    def put(self, entity, *extra_keys: Tuple[str, Union[int, str]]):
+        """Cache an entity under its marked peer id, username and any extra keys.
+
+        Not under its raw id: chats and channels share that number space with users.
+        """
+        keys = set(extra_keys)
+        try:
+            keys.add(("id", utils.get_peer_id(entity)))
+        except (TypeError, ValueError):
+            pass
+        username = getattr(entity, "username", None)
+        if username:
+            keys.add(("username", username.lower()))
+        expires_at = time.monotonic() + self.ttl
+        for key in keys:
+            self._store(key, (expires_at, entity, None))
+
+    def put_negative(self, key: Tuple[str, Union[int, str]], error: str):
+        """Remember that a reference could not be resolved."""
+        self._store(key, (time.monotonic() + self.negative_ttl, None, error))
+
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round((self.hits + self.negative_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+
+async def resolve_entity(chat_id: Union[int, str]):
+    """Resolve a chat/user id or username to an entity, going through the shared cache."""
+    key = EntityCache.key_for(chat_id)
+    entity = entity_cache.lookup(key)
+    if entity is not None:
+        return entity
+    # Concurrent misses for the same reference share one get_entity call
+    return await entity_flight.do(key, lambda: fetch_entity(key))
+
+
+async def fetch_entity(key: Tuple[str, Union[int, str]]):
+    try:
+        entity = await rpc("get_entity", lambda: client.get_entity(key[1]), priority=PRIORITY_INTERACTIVE)
+    except (ValueError, UsernameInvalidError, UsernameNotOccupiedError) as e:
+        if key[0] == "username":
+            entity_cache.put_negative(key, str(e))
+        raise
+
+    entity_cache.put(entity, key)
+    return entity
+
+
+def chat_key(entity) -> str:
+    """Key for watched chats: the marked peer id, which is what `event.chat_id` reports."""
+    return str(utils.get_peer_id(entity))
+
+
+def cache_update_entities(entities: Dict[int, Any]):
+    """Seed the resolver and presence caches with the users/chats attached to an update or result."""
+    for entity in entities.values():
+        if isinstance(entity, User) and entity.status is not None:
+            presence_cache.put(entity.id, entity.status)
+        # "min" entities carry no usable access hash, so they can't stand in for a resolved entity
+        if not getattr(entity, "min", False):
+            entity_cache.put(entity)
+
+
+async def resolve_sender(event):
+    """Make sure `event.message.sender` is populated, preferring cached entities over a network call."""
+    message = event.message
+    if message.sender is not None or event.sender_id is None:
+        return
+    try:
+        sender = entity_cache.lookup(("id", event.sender_id))
+    except ValueError:
+        sender = None
+    if sender is None:
+        sender = await event.get_sender()
+    message._sender = sender
+
+
+# ============= PRESENCE =============
+
+# Status classification; other statuses report their lowercased type name
+STATUS_NAMES = {
+    types.UserStatusOnline: "online",
+    types.UserStatusRecently: "recently",
+    types.UserStatusLastWeek: "last_week",
+    types.UserStatusLastMonth: "last_month",
+    types.UserStatusOffline: "offline",
+}
+
+# Telegram's cap on users per users.getUsers call
+GET_USERS_BATCH = 200
+
+
+def format_status(user_id: int, status) -> Dict[str, Any]:
+    if status is None:
+        return {"user_id": user_id, "status": "unknown", "raw_status": "Unknown"}
+    raw_status = type(status).__name__
+    name = STATUS_NAMES.get(type(status)) or raw_status.lower()
+    # Telegram doesn't always send the offline update once an online status expires
+    if name == "online" and status.expires and status.expires < datetime.now(status.expires.tzinfo):
+        name = "offline"
+    return {"user_id": user_id, "status": name, "raw_status": raw_status}
+
+
+class PresenceCache:
+    """Latest known status per user id, fed by UserUpdate events and any fetched user.
+
+    Entries expire after PRESENCE_CACHE_TTL; events keep refreshing the users Telegram
+    sends presence updates for (contacts and recent chats).
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries: Dict[int, Tuple[float, Any]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.updates = 0
+
+    def put(self, user_id: int, status):
+        self._entries[user_id] = (time.monotonic() + self.ttl, status)
+        self.updates += 1
+        if self.updates % 1000 == 0:
+            self.prune()
+
+    def get(self, user_id: int) -> Tuple[bool, Any]:
+        """Return (found, status); status may be None for users who hide it."""
+        entry = self._entries.get(user_id)
+        if entry is None or entry[0] < time.monotonic():
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        return True, entry[1]
+
+    def prune(self):
+        now = time.monotonic()
+        for user_id in [k for k, (expires_at, _) in self._entries.items() if expires_at < now]:
+            del self._entries[user_id]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses, "updates": self.updates}
+
+
+presence_cache = PresenceCache(PRESENCE_CACHE_TTL)
+
+
+async def input_user_for_id(user_id: int):
+    """InputUser for a user id from cached entities, without a network call."""
+    try:
+        entity = entity_cache.lookup(("id", user_id))
+    except ValueError:
+        entity = None
+    if entity is None:
+        # Telethon's session remembers access hashes of every user it has seen
+        entity = await client.get_input_entity(user_id)
+    return utils.get_input_user(entity)
+
+
+async def fetch_statuses(user_refs: List[Union[int, str]]) -> Tuple[Dict[Union[int, str], Dict[str, Any]], Dict[str, str]]:
+    """Statuses for many users: cached ones directly, the rest via users.getUsers in batches.
+
+    Returns ({reference: status}, {reference: error}).
+    """
+    statuses: Dict[Union[int, str], Dict[str, Any]] = {}
+    errors: Dict[str, str] = {}
+    refs = list(dict.fromkeys(user_refs))
+    keys = {ref: EntityCache.key_for(ref) for ref in refs}
+
+    # Usernames need resolving first (cached after the first time); do them concurrently
+    usernames = [ref for ref in refs if keys[ref][0] == "username"]
+    resolved = dict(zip(usernames, await asyncio.gather(*(resolve_entity(ref) for ref in usernames), return_exceptions=True)))
+
+    wanted: Dict[int, Any] = {}
+    refs_by_id: Dict[int, List[Union[int, str]]] = {}
+    for ref in refs:
+        try:
+            entity = resolved.get(ref)
+            if isinstance(entity, Exception):
+                raise entity
+            user_id = entity.id if entity is not None else keys[ref][1]
+            found, status = presence_cache.get(user_id)
+            if found:
+                statuses[ref] = format_status(user_id, status)
+                continue
+            if user_id not in wanted:
+                wanted[user_id] = utils.get_input_user(entity) if entity is not None else await input_user_for_id(user_id)
+        except Exception as e:
+            errors[str(ref)] = str(e)
+            continue
+        refs_by_id.setdefault(user_id, []).append(ref)
+
+    ids = list(wanted)
+    batches = [ids[i:i + GET_USERS_BATCH] for i in range(0, len(ids), GET_USERS_BATCH)]
+    results = await asyncio.gather(*(
+        rpc("get_users", lambda batch=batch: client(functions.users.GetUsersRequest([wanted[i] for i in batch])))
+        for batch in batches
+    ), return_exceptions=True)
+
+    for batch, result in zip(batches, results):
+        users = {}
+        if not isinstance(result, Exception):
+            users = {user.id: user for user in result if isinstance(user, User)}
+            cache_update_entities(users)
+            for user in users.values():
+                # Includes users who hide their status, so they aren't asked for again
+                presence_cache.put(user.id, user.status)
+        for user_id in batch:
+            user = users.get(user_id)
+            for ref in refs_by_id[user_id]:
+                if user is not None:
+                    statuses[ref] = format_status(user_id, user.status)
+                else:
+                    errors[str(ref)] = str(result) if isinstance(result, Exception) else "User not found"
+
+    return statuses, errors
+
+
+# ============= READ ACKNOWLEDGEMENTS =============
+
+class PendingAck:
+    __slots__ = ("entity", "max_id", "future", "task")
+
+    def __init__(self, entity, future: asyncio.Future):
+        self.entity = entity
+        self.max_id: Optional[int] = None
+        self.future = future
+        self.task: Optional[asyncio.Task] = None
+
+    def merge(self, max_id: Optional[int]):
+        # 0 asks Telegram to read everything, which covers any specific id
+        if not max_id:
+            self.max_id = 0
+        elif self.max_id != 0:
+            self.max_id = max(self.max_id or 0, max_id)
+
+
+class ReadAckBatcher:
+    """Debounces read acknowledgements per chat.
+
+    The first ack for a quiet chat is sent straight away. Acks arriving within
+    READ_ACK_INTERVAL of the last one sent are merged and sent once the interval is up,
+    with the highest message id asked for. Callers wait for the send covering their ack.
+    """
+
+    MAX_TRACKED_CHATS = 10000
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._pending: Dict[int, PendingAck] = {}
+        self._last_sent: Dict[int, float] = {}
+        self.requested = 0
+        self.sent = 0
+        self.failed = 0
+
+    async def ack(self, entity, max_id: Optional[int] = None) -> int:
+        """Mark messages up to `max_id` (None = all) as read; returns the max_id sent (0 = all)."""
+        peer_id = utils.get_peer_id(entity)
+        self.requested += 1
+        pending = self._pending.get(peer_id)
+        if pending is None:
+            future = asyncio.get_running_loop().create_future()
+            # Nobody may be left to await a failure if every caller went away
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            pending = self._pending[peer_id] = PendingAck(entity, future)
+            pending.task = asyncio.create_task(self._send_later(peer_id, pending))
+        pending.merge(max_id)
+        return await asyncio.shield(pending.future)
+
+    async def _send_later(self, peer_id: int, pending: PendingAck):
+        delay = self._last_sent.get(peer_id, 0.0) + self.interval - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await self._send(peer_id, pending)
+
+    async def _send(self, peer_id: int, pending: PendingAck):
+        # Acks arriving from here on start the next round
+        del self._pending[peer_id]
+        now = time.monotonic()
+        self._last_sent[peer_id] = now
+        if len(self._last_sent) > self.MAX_TRACKED_CHATS:
+            self._last_sent = {k: v for k, v in self._last_sent.items() if v + self.interval > now}
+        try:
+            await rpc(
+                "send_read_acknowledge",
+                lambda: client.send_read_acknowledge(pending.entity, max_id=pending.max_id),
+                priority=PRIORITY_INTERACTIVE
+            )
+        except Exception as e:
+            self.failed += 1
+            if not pending.future.done():
+                pending.future.set_exception(e)
+        else:
+            self.sent += 1
+            # Telethon doesn't pass the resulting read update to handlers
+            dialog_index.on_own_read(pending.entity, pending.max_id)
+            if not pending.future.done():
+                pending.future.set_result(pending.max_id)
+
+    async def flush(self):
+        """Send everything still waiting for its interval (on shutdown)."""
+        pending = list(self._pending.items())
+        for _, ack in pending:
+            ack.task.cancel()
+        await asyncio.gather(*(self._send(peer_id, ack) for peer_id, ack in pending), return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self._pending),
+            "requested": self.requested,
+            "sent": self.sent,
+            "failed": self.failed,
+            "interval": self.interval,
+        }
+
+
+# ============= WATCH BROKER =============
+
+SLOW_CONSUMER_POLICIES = ("drop_oldest", "disconnect")
+
+# SSE event ids: monotonically increasing across all chats, seeded from the clock
+# so ids keep growing across restarts of the bridge.
+_event_ids = itertools.count(int(time.time() * 1_000_000))
+
+
+class Subscriber:
+    """A single consumer of a watched chat with its own bounded ring buffer."""
+
+    def __init__(self, maxsize: int, policy: str, multiplexed: bool = False):
+        self.maxsize = maxsize
+        self.policy = policy
+        self.multiplexed = multiplexed
+        self.buffer: deque = deque()
+        self.closed = False
+        self.close_reason: Optional[str] = None
+        self.delivered = 0
+        self.dropped = 0
+        self.max_lag = 0
+        self.created_at = time.time()
+        self._wakeup = asyncio.Event()
+
+    def push(self, item) -> bool:
+        """Queue an item; returns False once the subscriber is closed."""
+        if self.closed:
+            return False
+        if len(self.buffer) >= self.maxsize:
+            if self.policy == "disconnect":
+                self.close("slow consumer")
+                return False
+            self.buffer.popleft()
+            self.dropped += 1
+        self.buffer.append(item)
+        if len(self.buffer) > self.max_lag:
+            self.max_lag = len(self.buffer)
+        self._wakeup.set()
+        return True
+
+    async def next_batch(self, timeout: float, max_items: int = 100) -> List[Any]:
+        """Wait up to `timeout` seconds and return every pending item (at most `max_items`)."""
+        if not self.buffer and not self.closed:
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                return []
+        return self.drain(max_items)
+
+    def prefill(self, items: List[Any]):
+        """Queue missed items; they bypass the slow consumer policy, being bounded by the replay log."""
+        if items:
+            self.buffer.extend(items)
+            self._wakeup.set()
+
+    def notify(self, item):
+        """Queue a control item (event id None), bypassing the slow consumer policy."""
+        if not self.closed:
+            self.buffer.append(item)
+            self._wakeup.set()
+
+    def drain(self, max_items: int = 100) -> List[Any]:
+        """Return pending items without waiting."""
+        batch = []
+        while self.buffer and len(batch) < max_items:
+            batch.append(self.buffer.popleft())
+        self.delivered += len(batch)
+        return batch
+
+    def close(self, reason: str = "closed"):
+        if not self.closed:
+            self.closed = True
+            self.close_reason = reason
+            self._wakeup.set()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "policy": self.policy,
+            "buffer_size": self.maxsize,
+            "lag": len(self.buffer),
+            "max_lag": self.max_lag,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "connected_for": round(time.time() - self.created_at, 1),
+        }
+
+
+class ChatTopic:
+    """Fan-out point for one watched chat: encodes each message once and broadcasts it.
+
+    The last WATCH_REPLAY_SIZE events are kept so reconnecting clients can resume
+    from their Last-Event-ID.
+    """
+
+    def __init__(self, chat_id: str):
+        self.chat_id = chat_id
+        self.subscribers: set = set()
+        self.published = 0
+        self.replay: deque = deque(maxlen=WATCH_REPLAY_SIZE)
+        self.idle_since: Optional[float] = None
+
+    def subscribe(
+        self,
+        maxsize: int = WATCH_BUFFER_SIZE,
+        policy: str = WATCH_SLOW_CONSUMER_POLICY,
+        last_event_id: Optional[int] = None
+    ) -> Subscriber:
+        subscriber = Subscriber(maxsize, policy)
+        self.attach(subscriber, last_event_id)
+        return subscriber
+
+    def attach(self, subscriber: Subscriber, last_event_id: Optional[int] = None):
+        """Add an existing subscriber (e.g. a multiplexed connection) to this chat."""
+        if last_event_id is not None:
+            subscriber.prefill(self.events_after(last_event_id))
+        self.subscribers.add(subscriber)
+        self.idle_since = None
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+        if not self.subscribers:
+            self.idle_since = time.monotonic()
+
+    def events_after(self, last_event_id: int) -> List[Tuple[str, int, str]]:
+        """Return retained events newer than `last_event_id`, oldest first."""
+        missed = []
+        for item in reversed(self.replay):
+            if item[1] <= last_event_id:
+                break
+            missed.append(item)
+        missed.reverse()
+        return missed
+
+    def publish(self, message_data: Dict[str, Any]):
+        self.publish_item((self.chat_id, next(_event_ids), dump_json(message_data).decode()))
+
+    def publish_item(self, item: Tuple[str, int, str]):
+        """Broadcast an already encoded and numbered event (as relayed from the owner process)."""
+        self.replay.append(item)
+        self.published += 1
+        for subscriber in list(self.subscribers):
+            if not subscriber.push(item):
+                self.subscribers.discard(subscriber)
+
+    def close(self):
+        # Multiplexed connections follow other chats too: they are told, after what is buffered
+        for subscriber in self.subscribers:
+            if subscriber.multiplexed:
+                subscriber.notify((self.chat_id, None, "unwatched"))
+            else:
+                subscriber.close("unwatched")
+        self.subscribers.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "published": self.published,
+            "replay_size": len(self.replay),
+            "last_event_id": self.replay[-1][1] if self.replay else None,
+            "subscribers": [s.stats() for s in self.subscribers],
+        }
+
+
+async def reap_idle_topics(interval: float = 30.0):
+    """Drop watched chats that have had no subscribers for WATCH_RETENTION_SECONDS."""
+    while True:
+        await asyncio.sleep(interval)
+        deadline = time.monotonic() - WATCH_RETENTION_SECONDS
+        for chat_id, topic in list(watched_chats.items()):
+            if topic.idle_since is not None and topic.idle_since < deadline:
+                del watched_chats[chat_id]
+                if message_store is not None:
+                    message_store.forget_live(int(chat_id))
+                if bridge is not None:
+                    bridge.detach(chat_id)
+                log.info("Stopped watching chat", extra={"chat_id": chat_id})
+
+
+# ============= MESSAGE STORE =============
+
+class SqliteWorker(abc.ABC):
+    """Owns one SQLite connection that is only ever used from a dedicated worker thread."""
+
+    def __init__(self, path: str, name: str):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+        self._db: Optional[sqlite3.Connection] = None
+        self._executor.submit(self._open, path).result()
+
+    def _open(self, path: str):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._init_schema(self._db)
+        self._db.commit()
+
+    @abc.abstractmethod
+    def _init_schema(self, db: sqlite3.Connection):
+        """Create the tables (called once, on the worker thread)."""
+
+    async def _call(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _submit(self, fn, *args):
+        self._executor.submit(fn, *args)
+
+    def close(self):
+        self._executor.submit(self._db.close)
+        self._executor.shutdown(wait=True)
+
+
+class MessageStore(SqliteWorker):
+    """SQLite store of every formatted message the bridge has seen, with an FTS5 text index.
+
+    `coverage` holds inclusive id ranges per chat for which every existing message is
+    stored, so reads inside a range can be answered locally. Historical ranges come from
+    fetched pages; the newest range of a watched chat is kept current by live events
+    ("live head"). Edits and deletions are applied from events while the bridge runs.
+
+    Chats are keyed by (scope, chat_id), the scope taken from the current account with
+    peer_scope(): '' for channels and the primary account, else the account name.
+
+    All database work happens on one worker thread; writes are fire-and-forget.
+    """
+
+    def __init__(self, path: str):
+        self.fts = True
+        # (scope, chat_id) -> newest id of a range kept current by live events (worker thread only)
+        self.live_heads: Dict[Tuple[str, int], int] = {}
+        # (scope, chat_id) of chats with anything stored; read from the event loop for cheap pre-checks
+        self.known_chats: set = set()
+        self.hits = 0
+        self.partial_hits = 0
+        self.misses = 0
+        self.local_searches = 0
+        super().__init__(path, "message-store")
+
+    def _init_schema(self, db: sqlite3.Connection):
+        columns = [row[1] for row in db.execute("PRAGMA table_info(messages)")]
+        if columns and "scope" not in columns:
+            # Written before chats were scoped per account; it only caches Telegram data, so start over
+            db.executescript("""
+                DROP TABLE IF EXISTS messages_fts;
+                DROP TABLE IF EXISTS messages;
+                DROP TABLE IF EXISTS coverage;
+            """)
+        db.executescript("""
+            CREATE TABLE IF NOT EXISTS messages (
+                rowid INTEGER PRIMARY KEY,
+                scope TEXT NOT NULL DEFAULT '',
+                chat_id INTEGER NOT NULL,
+                id INTEGER NOT NULL,
+                text TEXT NOT NULL DEFAULT '',
+                data TEXT NOT NULL,
+                UNIQUE (scope, chat_id, id)
+            );
+            CREATE TABLE IF NOT EXISTS coverage (
+                scope TEXT NOT NULL DEFAULT '',
+                chat_id INTEGER NOT NULL,
+                low INTEGER NOT NULL,
+                high INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS coverage_chat ON coverage (scope, chat_id, low);
+        """)
+        try:
+            db.executescript("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(text, content='messages', content_rowid='rowid');
+                CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+                    INSERT INTO messages_fts (rowid, text) VALUES (new.rowid, new.text);
+                END;
+                CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+                    INSERT INTO messages_fts (messages_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+                END;
+                CREATE TRIGGER IF NOT EXISTS messages_au AFTER UPDATE ON messages BEGIN
+                    INSERT INTO messages_fts (messages_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+                    INSERT INTO messages_fts (rowid, text) VALUES (new.rowid, new.text);
+                END;
+            """)
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5: fall back to LIKE scans
+            self.fts = False
+        self.known_chats = {tuple(row) for row in db.execute("SELECT DISTINCT scope, chat_id FROM coverage")}
+
+    @staticmethod
+    def _chat(chat_id: Optional[int]) -> Tuple[str, Optional[int]]:
+        return peer_scope(chat_id) or "", chat_id
+
+    def knows(self, chat_id: int) -> bool:
+        """Whether anything is stored for the current account's copy of a chat."""
+        return self._chat(chat_id) in self.known_chats
+
+    # --- writes ---
+
+    def _upsert(self, chat: Tuple[str, int], messages: List[Dict[str, Any]]):
+        self._db.executemany(
+            "INSERT INTO messages (scope, chat_id, id, text, data) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (scope, chat_id, id) DO UPDATE SET text = excluded.text, data = excluded.data "
+            "WHERE data != excluded.data",
+            [(*chat, m["id"], m.get("text") or "", dump_json(m).decode()) for m in messages]
+        )
+
+    def _add_coverage(self, chat: Tuple[str, int], low: int, high: int):
+        """Merge [low, high] into the chat's coverage ranges."""
+        if low > high:
+            return
+        rows = self._db.execute(
+            "SELECT rowid, low, high FROM coverage WHERE scope = ? AND chat_id = ? AND low <= ? AND high >= ?",
+            (*chat, high + 1, low - 1)
+        ).fetchall()
+        for rowid, row_low, row_high in rows:
+            low, high = min(low, row_low), max(high, row_high)
+        self._db.executemany("DELETE FROM coverage WHERE rowid = ?", [(row[0],) for row in rows])
+        self._db.execute("INSERT INTO coverage (scope, chat_id, low, high) VALUES (?, ?, ?, ?)", (*chat, low, high))
+        self.known_chats.add(chat)
+
+    def _record_page(self, chat, messages, limit, offset_id, min_id, max_id, watched):
+        self._upsert(chat, messages)
+        # Exclusive upper bound of what the request asked for; None means "newest"
+        bounds = [b for b in (offset_id, max_id) if b]
+        upper = min(bounds) - 1 if bounds else (messages[0]["id"] if messages else None)
+        if upper is not None:
+            low = messages[-1]["id"] if len(messages) >= limit else min_id + 1
+            if not bounds and watched:
+                # Newest page of a watched chat: live events keep this range current from now on
+                newest = self._db.execute(
+                    "SELECT MAX(id) FROM messages WHERE scope = ? AND chat_id = ?", chat
+                ).fetchone()[0]
+                upper = max(upper, newest or 0)
+                self.live_heads[chat] = max(upper, self.live_heads.get(chat, 0))
+            self._add_coverage(chat, low, upper)
+        self._db.commit()
+
+    def record_page(self, chat_id: int, messages: List[Dict[str, Any]], limit: int,
+                    offset_id: int = 0, min_id: int = 0, max_id: int = 0, watched: bool = False):
+        """Record a page fetched with get_messages(limit, offset_id, min_id, max_id), newest first."""
+        self._submit(
+            self._record_page, self._chat(chat_id), messages, limit, offset_id or 0, min_id or 0, max_id or 0, watched
+        )
+
+    def _record(self, chat: Tuple[str, int], messages: List[Dict[str, Any]]):
+        self._upsert(chat, messages)
+        self._db.commit()
+
+    def record(self, chat_id: int, messages: List[Dict[str, Any]]):
+        """Record messages that don't form a contiguous range (e.g. search results)."""
+        if messages:
+            self._submit(self._record, self._chat(chat_id), messages)
+
+    def _record_live(self, chat: Tuple[str, int], message: Dict[str, Any]):
+        self._upsert(chat, [message])
+        head = self.live_heads.get(chat)
+        if head is not None and message["id"] > head:
+            self._db.execute(
+                "UPDATE coverage SET high = ? WHERE scope = ? AND chat_id = ? AND high = ?", (message["id"], *chat, head)
+            )
+            self.live_heads[chat] = message["id"]
+        self._db.commit()
+
+    def record_live(self, chat_id: int, message: Dict[str, Any]):
+        """Record a message from a live event of a watched chat."""
+        self._submit(self._record_live, self._chat(chat_id), message)
+
+    def _update(self, chat: Tuple[str, int], message: Dict[str, Any]):
+        self._db.execute(
+            "UPDATE messages SET text = ?, data = ? WHERE scope = ? AND chat_id = ? AND id = ?",
+            (message.get("text") or "", dump_json(message).decode(), *chat, message["id"])
+        )
+        self._db.commit()
+
+    def update(self, chat_id: int, message: Dict[str, Any]):
+        """Apply an edit to a stored message (no-op if it isn't stored)."""
+        self._submit(self._update, self._chat(chat_id), message)
+
+    def _delete(self, chat: Tuple[str, Optional[int]], ids: List[int]):
+        marks = ",".join("?" * len(ids))
+        scope, chat_id = chat
+        if chat_id is None:
+            # Private chats and basic groups share one id space per account
+            self._db.execute(
+                f"DELETE FROM messages WHERE scope = ? AND id IN ({marks}) AND chat_id > -1000000000000", [scope, *ids]
+            )
+        else:
+            self._db.execute(f"DELETE FROM messages WHERE scope = ? AND chat_id = ? AND id IN ({marks})", [*chat, *ids])
+        self._db.commit()
+
+    def delete(self, chat_id: Optional[int], ids: List[int]):
+        if ids:
+            self._submit(self._delete, self._chat(chat_id), list(ids))
+
+    def _forget_live(self, chat_id: int):
+        for chat in [chat for chat in self.live_heads if chat[1] == chat_id]:
+            del self.live_heads[chat]
+
+    def forget_live(self, chat_id: int):
+        """Stop trusting the newest range of a chat that is no longer watched, in every scope."""
+        self._submit(self._forget_live, chat_id)
+
+    # --- reads ---
+
+    def _covering_range(self, chat: Tuple[str, int], message_id: int) -> Optional[Tuple[int, int]]:
+        return self._db.execute(
+            "SELECT low, high FROM coverage WHERE scope = ? AND chat_id = ? AND low <= ? AND high >= ?",
+            (*chat, message_id, message_id)
+        ).fetchone()
+
+    def _read_page(self, chat: Tuple[str, int], limit: int, offset_id: int) -> Tuple[List[Dict[str, Any]], bool]:
+        upper = offset_id - 1 if offset_id else self.live_heads.get(chat)
+        covering = self._covering_range(chat, upper) if upper is not None else None
+        if covering is None:
+            self.misses += 1
+            return [], False
+        rows = self._db.execute(
+            "SELECT data FROM messages WHERE scope = ? AND chat_id = ? AND id BETWEEN ? AND ? ORDER BY id DESC LIMIT ?",
+            (*chat, covering[0], upper, limit)
+        ).fetchall()
+        complete = len(rows) >= limit or covering[0] <= 1
+        if complete:
+            self.hits += 1
+        else:
+            self.partial_hits += 1
+        return [load_json(row[0]) for row in rows], complete
+
+    async def read_page(self, chat_id: int, limit: int, offset_id: int = 0) -> Tuple[List[Dict[str, Any]], bool]:
+        """Return stored messages older than offset_id (or newest), and whether they fully answer the read."""
+        return await self._call(self._read_page, self._chat(chat_id), limit, offset_id or 0)
+
+    def _search(self, chat: Tuple[str, int], query: str, limit: int, force: bool) -> Optional[List[Dict[str, Any]]]:
+        head = self.live_heads.get(chat)
+        covering = self._covering_range(chat, head) if head is not None else None
+        if not force and (covering is None or covering[0] > 1):
+            return None
+        self.local_searches += 1
+        if self.fts:
+            # Quote every term so user input can't inject FTS syntax; match term prefixes
+            match = " ".join('"' + term.replace('"', '""') + '"*' for term in query.split())
+            rows = self._db.execute(
+                "SELECT m.data FROM messages_fts JOIN messages m ON m.rowid = messages_fts.rowid "
+                "WHERE messages_fts MATCH ? AND m.scope = ? AND m.chat_id = ? ORDER BY m.id DESC LIMIT ?",
+                (match, *chat, limit)
+            ).fetchall()
+        else:
+            rows = self._db.execute(
+                "SELECT data FROM messages WHERE scope = ? AND chat_id = ? AND text LIKE ? ORDER BY id DESC LIMIT ?",
+                (*chat, f"%{query}%", limit)
+            ).fetchall()
+        return [load_json(row[0]) for row in rows]
+
+    async def search(self, chat_id: int, query: str, limit: int, force: bool = False) -> Optional[List[Dict[str, Any]]]:
+        """Search locally if the chat's whole history is stored (or `force`); None means ask Telegram."""
+        if not query.split():
+            return None
+        return await self._call(self._search, self._chat(chat_id), query, limit, force)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "fts": self.fts,
+            "known_chats": len(self.known_chats),
+            "live_chats": len(self.live_heads),
+            "hits": self.hits,
+            "partial_hits": self.partial_hits,
+            "misses": self.misses,
+            "local_searches": self.local_searches,
+        }
+
+
+async def read_messages(entity, limit: int, offset_id: int = 0, priority: int = PRIORITY_DEFAULT,
+                        fields: Optional[Tuple[str, ...]] = None) -> Tuple[List[Dict[str, Any]], str]:
+    """Read a page of messages, from the local store when it covers the range.
+
+    Only the part the store can't answer is fetched from Telegram. Returns the
+    formatted messages (projected to `fields`) and where they came from: "store",
+    "telegram" or "mixed".
+    """
+    peer_id = utils.get_peer_id(entity)
+    cached: List[Dict[str, Any]] = []
+    if message_store is not None:
+        cached, complete = await message_store.read_page(peer_id, limit, offset_id)
+        if complete:
+            return project_messages(cached, fields), "store"
+
+    remaining = limit - len(cached)
+    gap_offset = cached[-1]["id"] if cached else (offset_id or 0)
+    messages = await rpc(
+        "get_messages", lambda: client.get_messages(entity, limit=remaining, offset_id=gap_offset), priority=priority
+    )
+    fetched, stored = format_messages(messages, fields, full=message_store is not None)
+    if stored is not None:
+        message_store.record_page(peer_id, stored, remaining, gap_offset, watched=str(peer_id) in watched_chats)
+    return project_messages(cached, fields) + fetched, "mixed" if cached else "telegram"
+
+
+# Telethon never passes updates caused by this session's own requests to event handlers,
+# so the write endpoints apply their results themselves; otherwise ranges the store treats
+# as complete would miss the bridge's own messages, edits and deletions, and /chats would
+# not show the bridge's own messages as the latest
+
+def record_sent(entity, messages: List[Any]):
+    """Apply messages the bridge just sent or forwarded (not scheduled ones) to the dialog index and store."""
+    messages = [message for message in messages if message is not None]
+    for message in messages:
+        dialog_index.on_sent(entity, message)
+    if message_store is None:
+        return
+    chat_id = utils.get_peer_id(entity)
+    if message_store.knows(chat_id):
+        for message in messages:
+            message_store.record_live(chat_id, format_message(message))
+
+
+def record_edited(entity, message):
+    if message_store is not None:
+        message_store.update(utils.get_peer_id(entity), format_message(message))
+
+
+def record_deleted(entity, ids: List[int]):
+    dialog_index.on_own_delete(entity, ids)
+    if message_store is not None:
+        message_store.delete(utils.get_peer_id(entity), ids)
+
+
+# ============= UPLOADS =============
+
+class ChunkReader:
+    """Turns an async stream of arbitrary-sized chunks into exact-size reads, enforcing a size cap."""
+
+    def __init__(self, chunks: AsyncIterator[bytes], max_bytes: int = UPLOAD_MAX_BYTES):
+        self._chunks = chunks.__aiter__()
+        self._buffer = bytearray()
+        self._eof = False
+        self.max_bytes = max_bytes
+        self.total = 0
+        self.sha256 = hashlib.sha256()
+
+    async def read_exact(self, size: int) -> bytes:
+        """Read `size` bytes, or whatever is left at the end of the stream."""
+        while len(self._buffer) < size and not self._eof:
+            try:
+                chunk = await self._chunks.__anext__()
+            except StopAsyncIteration:
+                self._eof = True
+                break
+            self.total += len(chunk)
+            if self.total > self.max_bytes:
+                raise HTTPException(status_code=413, detail=f"File exceeds the {self.max_bytes} byte limit")
+            self.sha256.update(chunk)
+            self._buffer += chunk
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+async def iter_upload_file(file: UploadFile, chunk_size: int = 256 * 1024) -> AsyncIterator[bytes]:
+    while chunk := await file.read(chunk_size):
+        yield chunk
+
+
+def hash_file(fileobj, chunk_size: int = 1024 * 1024) -> str:
+    """SHA-256 of a seekable file object, leaving it rewound."""
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    while chunk := fileobj.read(chunk_size):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+# Errors meaning a cached media reference can no longer be reused
+STALE_MEDIA_ERRORS = (
+    FileReferenceExpiredError, FileReferenceInvalidError, FileIdInvalidError, MediaEmptyError, MediaInvalidError,
+)
+
+
+class UploadCache(SqliteWorker):
+    """Persistent content hash -> uploaded photo/document reference, evicted least recently used first."""
+
+    def __init__(self, path: str, capacity: int):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        super().__init__(path, "upload-cache")
+
+    def _init_schema(self, db: sqlite3.Connection):
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS uploads (
+                key TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                media_id INTEGER NOT NULL,
+                access_hash INTEGER NOT NULL,
+                file_reference BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        db.execute("CREATE INDEX IF NOT EXISTS uploads_last_used ON uploads (last_used)")
+
+    @staticmethod
+    def key_for(sha256: str, file_name: str, voice_note: bool, account: Optional[str] = None) -> str:
+        # The same bytes sent as photo, document or voice note produce different media
+        if voice_note:
+            kind = "voice"
+        elif utils.is_image(file_name):
+            kind = "photo"
+        else:
+            kind = "document"
+        # Uploaded media can only be reused by the account that uploaded it
+        return f"{sha256}:{kind}:{account}" if account else f"{sha256}:{kind}"
+
+    def _get(self, key: str):
+        row = self._db.execute(
+            "SELECT kind, media_id, access_hash, file_reference FROM uploads WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._db.execute("UPDATE uploads SET last_used = ? WHERE key = ?", (time.time(), key))
+        self._db.commit()
+        kind, media_id, access_hash, file_reference = row
+        if kind == "photo":
+            return types.InputPhoto(media_id, access_hash, file_reference)
+        return types.InputDocument(media_id, access_hash, file_reference)
+
+    async def get(self, key: str):
+        """Return an InputPhoto/InputDocument for previously uploaded content, or None."""
+        return await self._call(self._get, key)
+
+    def _put(self, key: str, media, size: int):
+        if isinstance(media, types.MessageMediaPhoto) and isinstance(media.photo, types.Photo):
+            kind, ref = "photo", media.photo
+        elif isinstance(media, types.MessageMediaDocument) and isinstance(media.document, types.Document):
+            kind, ref = "document", media.document
+        else:
+            return
+        self._db.execute(
+            "INSERT OR REPLACE INTO uploads (key, kind, media_id, access_hash, file_reference, size, last_used) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, kind, ref.id, ref.access_hash, ref.file_reference, size, time.time())
+        )
+        self._db.execute(
+            "DELETE FROM uploads WHERE key IN (SELECT key FROM uploads ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.capacity,)
+        )
+        self._db.commit()
+
+    def put(self, key: str, media, size: int):
+        """Remember the media Telegram created for an upload."""
+        self._submit(self._put, key, media, size)
+
+    def _discard(self, key: str):
+        self._db.execute("DELETE FROM uploads WHERE key = ?", (key,))
+        self._db.commit()
+
+    def discard(self, key: str):
+        self.stale += 1
+        self._submit(self._discard, key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"hits": self.hits, "misses": self.misses, "stale": self.stale, "capacity": self.capacity}
+
+
+# Cumulative upload counters (reported on /stats)
+upload_stats = {"uploads": 0, "bytes": 0, "seconds": 0.0}
+
+
+async def upload_stream(reader: ChunkReader, file_size: int, file_name: str):
+    """Upload a stream to Telegram part by part, with up to UPLOAD_PARALLEL_PARTS parts in flight.
+
+    Memory is bounded by (UPLOAD_PARALLEL_PARTS + 1) parts; returns an InputFile/InputFileBig
+    handle for send_file.
+    """
+    if file_size > UPLOAD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"File exceeds the {UPLOAD_MAX_BYTES} byte limit")
+
+    part_size = utils.get_appropriated_part_size(file_size) * 1024
+    part_count = max(1, (file_size + part_size - 1) // part_size)
+    is_big = file_size > 10 * 1024 * 1024
+    file_id = helpers.generate_random_long()
+    hash_md5 = hashlib.md5()
+    slots = asyncio.Semaphore(UPLOAD_PARALLEL_PARTS)
+    pending: set = set()
+    started = time.monotonic()
+
+    async def send_part(index: int, data: bytes):
+        try:
+            if is_big:
+                request = functions.upload.SaveBigFilePartRequest(file_id, index, part_count, data)
+            else:
+                request = functions.upload.SaveFilePartRequest(file_id, index, data)
+            if not await rpc("upload_part", lambda: client(request), priority=PRIORITY_INTERACTIVE):
+                raise RuntimeError(f"Failed to upload file part {index}")
+        finally:
+            slots.release()
+
+    try:
+        for index in range(part_count):
+            data = await reader.read_exact(part_size)
+            if len(data) != part_size and index < part_count - 1:
+                raise HTTPException(status_code=400, detail="Upload ended before the declared size")
+            if not is_big:
+                hash_md5.update(data)
+            await slots.acquire()
+            for task in [t for t in pending if t.done()]:
+                pending.discard(task)
+                task.result()
+            pending.add(asyncio.create_task(send_part(index, data)))
+        if await reader.read_exact(1):
+            raise HTTPException(status_code=400, detail="Upload is larger than the declared size")
+        await asyncio.gather(*pending)
+    except BaseException:
+        for task in pending:
+            task.cancel()
+        raise
+
+    upload_stats["uploads"] += 1
+    upload_stats["bytes"] += file_size
+    upload_stats["seconds"] += time.monotonic() - started
+
+    if is_big:
+        return types.InputFileBig(file_id, part_count, file_name)
+    return types.InputFile(file_id, part_count, file_name, hash_md5.hexdigest())
+
+
+async def send_uploaded_file(entity, reader: ChunkReader, file_size: int, file_name: str,
+                             caption: Optional[str], voice_note: bool, sha256: Optional[str] = None) -> Dict[str, Any]:
+    """Send a file, reusing previously uploaded media with the same content hash when possible.
+
+    Otherwise the stream is uploaded to Telegram; the response reports upload throughput.
+    """
+    async def send(file):
+        return await rpc(
+            "send_file",
+            lambda: client.send_file(entity, file, caption=caption, voice_note=voice_note),
+            peer=entity,
+            priority=PRIORITY_INTERACTIVE
+        )
+
+    def response(result, upload: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        record_sent(entity, [result])
+        return {
+            "success": True,
+            "message_id": result.id,
+            "date": result.date.isoformat() if result.date else None,
+            "deduplicated": upload is None,
+            "upload": upload,
+        }
+
+    account = active_account()
+    scope = None if account is accounts.primary else account.name
+    if upload_cache is not None and sha256:
+        key = UploadCache.key_for(sha256.lower(), file_name, voice_note, scope)
+        cached = await upload_cache.get(key)
+        if cached is not None:
+            try:
+                return response(await send(cached), None)
+            except STALE_MEDIA_ERRORS:
+                # Telegram no longer accepts the reference: upload the bytes again
+                upload_cache.discard(key)
+
+    started = time.monotonic()
+    input_file = await upload_stream(reader, file_size, file_name)
+    upload_seconds = time.monotonic() - started
+    result = await send(input_file)
+    digest = reader.sha256.hexdigest()
+    if upload_cache is not None:
+        upload_cache.put(UploadCache.key_for(digest, file_name, voice_note, scope), result.media, file_size)
+    return response(result, {
+        "bytes": file_size,
+        "sha256": digest,
+        "seconds": round(upload_seconds, 3),
+        "throughput_bps": round(file_size / upload_seconds) if upload_seconds > 0 else None,
+    })
+
+
+# ============= MEDIA DOWNLOADS =============
+
+# Telegram only serves parts whose size divides 1 MiB: a power of two between 4 KiB and 512 KiB
+MEDIA_PART_SIZE = min(512 * 1024, max(4096, 1 << (max(MEDIA_REQUEST_SIZE, 1).bit_length() - 1)))
+
+# Cumulative bytes pulled from Telegram for media requests (reported on /stats)
+download_stats = {"downloads": 0, "bytes": 0, "seconds": 0.0}
+
+
+class MediaFile:
+    """A downloadable file behind a message: its Telegram location plus what HTTP headers need.
+
+    Tiny thumbnails arrive inline with the message; those carry `data` and need no download.
+    """
+
+    __slots__ = ("location", "dc_id", "size", "mime_type", "file_name", "data")
+
+    def __init__(self, location, dc_id: Optional[int], size: int, mime_type: str, file_name: str,
+                 data: Optional[bytes] = None):
+        self.location = location
+        self.dc_id = dc_id
+        self.size = size
+        self.mime_type = mime_type
+        self.file_name = file_name
+        self.data = data
+
+
+def photo_size_bytes(size) -> int:
+    if isinstance(size, types.PhotoSize):
+        return size.size
+    if isinstance(size, types.PhotoSizeProgressive):
+        return max(size.sizes) if size.sizes else 0
+    if isinstance(size, (types.PhotoCachedSize, types.PhotoStrippedSize)):
+        return len(size.bytes)
+    return 0
+
+
+def media_file(message, thumb: bool = False) -> Optional[MediaFile]:
+    """Describe the file of a message's photo or document, or its thumbnail.
+
+    Thumbnails are the largest preview of a document or the smallest size of a photo.
+    Returns None when the message has nothing to download.
+    """
+    media = message.media
+    if isinstance(media, types.MessageMediaDocument) and isinstance(media.document, types.Document):
+        document = media.document
+        if not thumb:
+            file_name = next(
+                (a.file_name for a in document.attributes if isinstance(a, types.DocumentAttributeFilename)),
+                f"{document.id}{utils.get_extension(document)}"
+            )
+            location = types.InputDocumentFileLocation(document.id, document.access_hash, document.file_reference, "")
+            return MediaFile(location, document.dc_id, document.size,
+                             document.mime_type or "application/octet-stream", file_name)
+        sizes = [t for t in document.thumbs or [] if photo_size_bytes(t)]
+        if not sizes:
+            return None
+        size = max(sizes, key=photo_size_bytes)
+        media_id, make_location = document.id, types.InputDocumentFileLocation
+    elif isinstance(media, types.MessageMediaPhoto) and isinstance(media.photo, types.Photo):
+        document = media.photo
+        sizes = [s for s in document.sizes if photo_size_bytes(s)]
+        if not sizes:
+            return None
+        if thumb:
+            # Prefer a real (downloadable) size over the blurry inline preview
+            size = min(sizes, key=lambda s: (isinstance(s, (types.PhotoCachedSize, types.PhotoStrippedSize)),
+                                             photo_size_bytes(s)))
+        else:
+            size = max(sizes, key=photo_size_bytes)
+        media_id, make_location = document.id, types.InputPhotoFileLocation
+    else:
+        return None
+
+    file_name = f"{media_id}_{size.type}.jpg" if thumb else f"{media_id}.jpg"
+    if isinstance(size, types.PhotoStrippedSize):
+        data = utils.stripped_photo_to_jpg(size.bytes)
+        return MediaFile(None, None, len(data), "image/jpeg", file_name, data)
+    if isinstance(size, types.PhotoCachedSize):
+        return MediaFile(None, None, len(size.bytes), "image/jpeg", file_name, size.bytes)
+    location = make_location(document.id, document.access_hash, document.file_reference, size.type)
+    return MediaFile(location, document.dc_id, photo_size_bytes(size), "image/jpeg", file_name)
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single `bytes=` Range header into an inclusive (start, end).
+
+    None means "send the whole file": no header, a malformed one, or a multi-range request,
+    which RFC 9110 lets servers answer in full.
+    """
+    if not header or size <= 0:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        else:
+            start, end = max(0, size - int(last)), size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+class MediaStream:
+    """Sequential download of bytes [start, end] of a Telegram file, one scheduled request per part.
+
+    Telegram only serves offsets aligned to the part size, so the first part is trimmed.
+    """
+
+    def __init__(self, media: MediaFile, start: int, end: int):
+        aligned = start - start % MEDIA_PART_SIZE
+        self._skip = start - aligned
+        self.remaining = end - start + 1
+        self._parts = client.iter_download(
+            media.location,
+            offset=aligned,
+            limit=(end - aligned) // MEDIA_PART_SIZE + 1,
+            request_size=MEDIA_PART_SIZE,
+            file_size=media.size,
+            dc_id=media.dc_id,
+        )
+        self._started = False
+        self._elapsed = 0.0
+        download_stats["downloads"] += 1
+
+    async def _next_part(self):
+        # A part that failed (e.g. on a flood wait) is fetched again on the next call
+        try:
+            return await self._parts.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    async def read(self) -> bytes:
+        """Return the next piece of the range, or b"" once it has all been read."""
+        if self.remaining <= 0:
+            return b""
+        self._started = True
+        started = time.monotonic()
+        part = await rpc("download_part", self._next_part, priority=PRIORITY_INTERACTIVE)
+        self._elapsed += time.monotonic() - started
+        if not part:
+            raise RuntimeError(f"Download ended {self.remaining} bytes early")
+        if self._skip:
+            part = part[self._skip:]
+            self._skip = 0
+        part = bytes(part[:self.remaining])
+        self.remaining -= len(part)
+        download_stats["bytes"] += len(part)
+        return part
+
+    async def close(self):
+        download_stats["seconds"] += self._elapsed
+        self._elapsed = 0.0
+        if self._started:
+            # Returns the connection borrowed for files stored on another DC
+            await self._parts.close()
+
+
+class MediaCacheWriter:
+    """Tees a download into a temporary file that only enters the cache once complete."""
+
+    def __init__(self, cache: "MediaCache", key: str, meta: Dict[str, Any]):
+        self.cache = cache
+        self.key = key
+        self.meta = meta
+        self.path = os.path.join(cache.directory, f"{key}.{helpers.generate_random_long() & 0xFFFFFFFF:08x}.part")
+        self._file = None
+
+    async def write(self, data: bytes):
+        if self._file is None:
+            self._file = await asyncio.to_thread(open, self.path, "wb")
+        await asyncio.to_thread(self._file.write, data)
+
+    async def commit(self):
+        await asyncio.to_thread(self._file.close)
+        self._file = None
+        await self.cache.add(self.key, self.path, self.meta)
+
+    def _discard(self, file):
+        file.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    async def abort(self):
+        if self._file is not None:
+            file, self._file = self._file, None
+            await asyncio.to_thread(self._discard, file)
+
+
+class MediaCache:
+    """Size-bounded on-disk cache of downloaded media, evicted least recently used first.
+
+    Each entry is a data file plus a JSON sidecar with the headers needed to serve it. The
+    index lives in memory and is rebuilt from the directory (oldest access first) on startup.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, Tuple[int, Dict[str, Any]]]" = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def key_for(peer_id: int, message_id: int, thumb: bool, account: Optional[str] = None) -> str:
+        key = f"{peer_id}_{message_id}_{'thumb' if thumb else 'file'}"
+        # Outside channels, another account's message with the same id is a different message
+        return f"{key}_{quote(account, safe='')}" if account else key
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def _load(self):
+        found = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            key = name[:-len(".json")]
+            try:
+                with open(self._path(name), encoding="utf-8") as f:
+                    meta = json.load(f)
+                info = os.stat(self._path(key))
+            except (OSError, ValueError):
+                continue
+            found.append((info.st_mtime, key, info.st_size, meta))
+        for _, key, size, meta in sorted(found):
+            self.entries[key] = (size, meta)
+            self.total_bytes += size
+        # Drop partial downloads from a previous run and files without a sidecar
+        keep = set(self.entries) | {f"{key}.json" for key in self.entries}
+        for name in os.listdir(self.directory):
+            if name not in keep:
+                self._remove_files(name)
+        self._evict()
+
+    def _remove_files(self, *names: str):
+        for name in names:
+            try:
+                os.remove(self._path(name))
+            except OSError:
+                pass
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and self.entries:
+            key, (size, _) = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+            self._remove_files(key, f"{key}.json")
+
+    def get(self, key: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Return (path, meta) for a cached file and mark it recently used."""
+        entry = self.entries.get(key)
+        path = self._path(key)
+        if entry is not None:
+            try:
+                # mtime doubles as the access time the index is rebuilt from
+                os.utime(path)
+            except OSError:
+                self.discard(key)
+                entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return path, entry[1]
+
+    def writer(self, key: str, media: MediaFile) -> Optional[MediaCacheWriter]:
+        """Start caching a full download, unless the file could never fit."""
+        if media.size > self.max_bytes:
+            return None
+        return MediaCacheWriter(self, key, {"mime_type": media.mime_type, "file_name": media.file_name})
+
+    def _install(self, key: str, part_path: str, meta: Dict[str, Any]) -> int:
+        os.replace(part_path, self._path(key))
+        with open(self._path(f"{key}.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        return os.path.getsize(self._path(key))
+
+    async def add(self, key: str, part_path: str, meta: Dict[str, Any]):
+        size = await asyncio.to_thread(self._install, key, part_path, meta)
+        previous = self.entries.pop(key, None)
+        if previous is not None:
+            self.total_bytes -= previous[0]
+        self.entries[key] = (size, meta)
+        self.total_bytes += size
+        self._evict()
+
+    def discard(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[0]
+        self._remove_files(key, f"{key}.json")
+
+    def discard_message(self, peer_id: int, message_id: int, account: Optional[str] = None):
+        """Forget a message's files, e.g. after an edit that may have replaced its media."""
+        for thumb in (False, True):
+            key = self.key_for(peer_id, message_id, thumb, account)
+            if key in self.entries:
+                self.discard(key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+def content_disposition(file_name: str) -> str:
+    return f"inline; filename*=utf-8''{quote(file_name)}"
+
+
+# ============= DIALOG INDEX =============
+
+class DialogEntry:
+    __slots__ = ("peer_id", "info", "type", "unread_count", "last_message", "last_message_id", "last_date", "pinned")
+
+    def __init__(self, peer_id: int, info: Dict[str, Any], pinned: bool = False):
+        self.peer_id = peer_id
+        self.info = info
+        self.type = info.get("type")
+        self.unread_count = 0
+        self.last_message: Optional[str] = None
+        self.last_message_id = 0
+        self.last_date = 0.0
+        self.pinned = pinned
+
+    def set_last_message(self, message):
+        self.last_message = message.message[:100] if message.message else None
+        self.last_message_id = message.id
+        self.last_date = message.date.timestamp() if message.date else time.time()
+
+    def sort_key(self) -> Tuple[int, float, int]:
+        # Pinned dialogs first, then most recent activity
+        return (0 if self.pinned else 1, -self.last_date, self.peer_id)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {**self.info, "unread_count": self.unread_count, "last_message": self.last_message}
+
+
+class DialogIndex:
+    """In-memory dialog list loaded once and kept current from updates.
+
+    Sorted views per chat type are rebuilt lazily after a change, so repeated
+    reads between updates are a slice of a prepared list. Loading also tells the
+    account pool which chats the account is in.
+    """
+
+    def __init__(self, account: Optional["Account"] = None):
+        self.account = account
+        self.entries: Dict[int, DialogEntry] = {}
+        self.loaded_at: Optional[float] = None
+        self.stale = False
+        self.updates_applied = 0
+        self._views: Dict[Optional[str], Tuple[List[Tuple[int, float, int]], List[DialogEntry]]] = {}
+        self._lock = asyncio.Lock()
+        self._refresh: Optional[asyncio.Task] = None
+        # Updates seen while a load runs, replayed onto its result (None: no load running)
+        self._pending: Optional[List[Tuple[Any, tuple]]] = None
+
+    async def load(self):
+        async with self._lock:
+            self._pending = []
+            try:
+                dialogs = await rpc("get_dialogs", lambda: client.get_dialogs(limit=None), priority=PRIORITY_BACKGROUND)
+                entries = {}
+                for dialog in dialogs:
+                    entry = DialogEntry(dialog.id, format_entity(dialog.entity), dialog.pinned)
+                    entry.unread_count = dialog.unread_count
+                    if dialog.message:
+                        entry.set_last_message(dialog.message)
+                    elif dialog.date:
+                        entry.last_date = dialog.date.timestamp()
+                    entries[dialog.id] = entry
+                    if self.account is not None:
+                        accounts.claim(dialog.id, self.account)
+                self.entries = entries
+                self.loaded_at = time.monotonic()
+                self.stale = False
+                self._views.clear()
+                # The list may have been fetched before these; what it already has is skipped
+                for apply, args in self._pending:
+                    apply(*args)
+            finally:
+                self._pending = None
+
+    def preload(self):
+        """Start loading in the background; ensure_fresh waits for it rather than loading again."""
+        self._refresh = asyncio.create_task(self.load())
+        # A failure is retried by the next ensure_fresh
+        self._refresh.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+    async def ensure_fresh(self):
+        """Load on first use; afterwards refresh in the background when stale or expired."""
+        if self.loaded_at is None:
+            if self._refresh is not None and not self._refresh.done():
+                await asyncio.shield(self._refresh)
+            else:
+                await self.load()
+        elif self.stale or time.monotonic() - self.loaded_at > DIALOG_INDEX_TTL:
+            if self._refresh is None or self._refresh.done():
+                self._refresh = asyncio.create_task(self.load())
+
+    def _changed(self):
+        self.updates_applied += 1
+        self._views.clear()
+
+    def _apply(self, apply, *args):
+        if self._pending is not None:
+            self._pending.append((apply, args))
+        if self.loaded_at is not None:
+            apply(*args)
+
+    def on_new_message(self, event):
+        self._apply(self._new_message, event.chat_id, event.message,
+                    lambda: event._entities.get(event.chat_id) or event.chat)
+
+    def on_sent(self, entity, message):
+        """Apply a message the bridge sent itself; Telethon never passes those to handlers."""
+        self._apply(self._new_message, utils.get_peer_id(entity), message, lambda: entity)
+
+    def on_read(self, event):
+        self._apply(self._read, event.chat_id, event.max_id)
+
+    def on_own_read(self, entity, max_id: int):
+        """Apply a read ack the bridge sent itself (max_id 0 = everything)."""
+        self._apply(self._read, utils.get_peer_id(entity), max_id)
+
+    def on_own_delete(self, entity, ids: List[int]):
+        """Apply a deletion the bridge made itself."""
+        self._apply(self._deleted, utils.get_peer_id(entity), set(ids))
+
+    def on_chat_action(self, event):
+        self._apply(self._chat_action, event)
+
+    def _new_message(self, peer_id: int, message, get_entity):
+        entry = self.entries.get(peer_id)
+        if entry is None:
+            entity = get_entity()
+            if entity is None:
+                self.stale = True
+                return
+            entry = self.entries[peer_id] = DialogEntry(peer_id, format_entity(entity))
+        elif message.id <= entry.last_message_id:
+            # Already counted (e.g. replayed after a load that included it)
+            return
+        entry.set_last_message(message)
+        if not message.out:
+            entry.unread_count += 1
+        self._changed()
+
+    def _read(self, peer_id: int, max_id: int):
+        entry = self.entries.get(peer_id)
+        if entry is not None and (max_id or entry.last_message_id) >= entry.last_message_id and entry.unread_count:
+            entry.unread_count = 0
+            self._changed()
+
+    def _deleted(self, peer_id: int, ids: set):
+        entry = self.entries.get(peer_id)
+        if entry is not None and entry.last_message_id in ids:
+            # The message before it isn't known here; let a reload sort it out
+            self.stale = True
+
+    def _chat_action(self, event):
+        entry = self.entries.get(event.chat_id)
+        if event.new_title and entry is not None:
+            entry.info["title"] = event.new_title
+            self._changed()
+        elif event.user_joined or event.user_added or event.user_left or event.user_kicked or event.created:
+            # Membership changes may add or remove whole dialogs; let a reload sort it out
+            self.stale = True
+
+    def _view(self, chat_type: Optional[str]) -> Tuple[List[Tuple[int, float, int]], List[DialogEntry]]:
+        view = self._views.get(chat_type)
+        if view is None:
+            entries = sorted(
+                (e for e in self.entries.values() if chat_type is None or e.type == chat_type),
+                key=DialogEntry.sort_key
+            )
+            view = self._views[chat_type] = ([e.sort_key() for e in entries], entries)
+        return view
+
+    def page(self, limit: int, chat_type: Optional[str] = None, cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        keys, entries = self._view(chat_type)
+        start = 0
+        if cursor:
+            try:
+                key = tuple(json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))))
+                start = bisect.bisect_right(keys, (int(key[0]), float(key[1]), int(key[2])))
+            except (ValueError, TypeError, IndexError):
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+        selected = entries[start:start + limit]
+        next_cursor = None
+        if start + limit < len(entries) and selected:
+            raw = json.dumps(list(selected[-1].sort_key()), separators=(",", ":"))
+            next_cursor = base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+        return [entry.to_dict() for entry in selected], next_cursor
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "dialogs": len(self.entries),
+            "loaded": self.loaded_at is not None,
+            "age": round(time.monotonic() - self.loaded_at, 1) if self.loaded_at is not None else None,
+            "stale": self.stale,
+            "updates_applied": self.updates_applied,
+        }
+
+
+# ============= CONTACT INDEX =============
+
+def telegram_hash(values: List[int]) -> int:
+    """Telegram's hash for incremental fetches (https://core.telegram.org/api/offsets#hash-generation)."""
+    mask = (1 << 64) - 1
+    value = 0
+    for item in values:
+        value ^= value >> 21
+        value ^= (value << 35) & mask
+        value ^= value >> 4
+        value = (value + item) & mask
+    # Sent as a signed 64-bit long
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def format_contact(user) -> Dict[str, Any]:
+    return {
+        "id": user.id,
+        "first_name": getattr(user, "first_name", None),
+        "last_name": getattr(user, "last_name", None),
+        "username": getattr(user, "username", None),
+        "phone": getattr(user, "phone", None),
+    }
+
+
+def contact_terms(contact: Dict[str, Any]) -> List[str]:
+    """Lowercased strings a contact can be found by: name words, full name, username, phone."""
+    first = (contact["first_name"] or "").lower()
+    last = (contact["last_name"] or "").lower()
+    terms = [*first.split(), *last.split(), f"{first} {last}".strip()]
+    if contact["username"]:
+        terms.append(contact["username"].lower())
+    if contact["phone"]:
+        terms.append(contact["phone"])
+    return list(dict.fromkeys(term for term in terms if term))
+
+
+class ContactIndex:
+    """Local copy of the contact list with an in-memory search index.
+
+    Refreshes send Telegram the hash of what we hold, so an unchanged list costs a
+    "not modified" reply instead of a full download. Search matches term prefixes via
+    a sorted list and substrings (3+ characters) via trigram postings, without I/O.
+    """
+
+    def __init__(self):
+        self.contacts: Dict[int, Dict[str, Any]] = {}
+        self.hash = 0
+        self.loaded_at: Optional[float] = None
+        self.refreshes = 0
+        self.not_modified = 0
+        self.local_searches = 0
+        self.remote_searches = 0
+        self._prefixes: List[Tuple[str, int]] = []
+        self._trigrams: Dict[str, set] = {}
+        self._haystacks: Dict[int, str] = {}
+        self._refresh: Optional[asyncio.Task] = None
+
+    async def refresh(self):
+        result = await rpc("get_contacts", lambda: client(functions.contacts.GetContactsRequest(hash=self.hash)))
+        self.refreshes += 1
+        self.loaded_at = time.monotonic()
+        if isinstance(result, types.contacts.ContactsNotModified):
+            self.not_modified += 1
+            return
+        users = [user for user in result.users if isinstance(user, User)]
+        cache_update_entities({user.id: user for user in users})
+        self.contacts = {user.id: format_contact(user) for user in users}
+        self.hash = telegram_hash([result.saved_count, *sorted(contact.user_id for contact in result.contacts)])
+        self._build()
+
+    async def ensure_fresh(self):
+        """Load on first use; afterwards refresh in the background every CONTACTS_REFRESH_INTERVAL."""
+        if self._refresh is None or self._refresh.done():
+            if self.loaded_at is not None and time.monotonic() - self.loaded_at < CONTACTS_REFRESH_INTERVAL:
+                return
+            self._refresh = asyncio.create_task(self.refresh())
+            # Background failures are retried on a later call
+            self._refresh.add_done_callback(lambda task: task.cancelled() or task.exception())
+        if self.loaded_at is None:
+            await asyncio.shield(self._refresh)
+
+    def _build(self):
+        prefixes = []
+        trigrams: Dict[str, set] = {}
+        haystacks = {}
+        for user_id, contact in self.contacts.items():
+            terms = contact_terms(contact)
+            prefixes.extend((term, user_id) for term in terms)
+            haystack = haystacks[user_id] = "\n".join(terms)
+            for i in range(len(haystack) - 2):
+                trigrams.setdefault(haystack[i:i + 3], set()).add(user_id)
+        prefixes.sort()
+        self._prefixes, self._trigrams, self._haystacks = prefixes, trigrams, haystacks
+
+    def search(self, query: str, limit: int) -> List[Dict[str, Any]]:
+        """Contacts matching `query`: exact terms, then term prefixes, then substrings."""
+        self.local_searches += 1
+        q = " ".join(query.lower().split()).lstrip("@")
+        if q.startswith("+") and q[1:].replace(" ", "").isdigit():
+            q = q[1:].replace(" ", "")
+        if not q:
+            return []
+
+        # Sorted terms put an exact match before its longer completions, so the scan
+        # can stop as soon as `limit` contacts have been found
+        found: Dict[int, None] = {}
+        prefixes = self._prefixes
+        i = bisect.bisect_left(prefixes, (q,))
+        while i < len(prefixes) and len(found) < limit:
+            term, user_id = prefixes[i]
+            if not term.startswith(q):
+                break
+            found.setdefault(user_id)
+            i += 1
+
+        if len(found) < limit and len(q) >= 3:
+            postings = sorted((self._trigrams.get(q[j:j + 3], set()) for j in range(len(q) - 2)), key=len)
+            candidates = set.intersection(*postings) if postings[0] else set()
+            for user_id in sorted(candidates - found.keys()):
+                if q in self._haystacks[user_id]:
+                    found.setdefault(user_id)
+                    if len(found) >= limit:
+                        break
+
+        return [self.contacts[user_id] for user_id in found]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "contacts": len(self.contacts),
+            "loaded": self.loaded_at is not None,
+            "age": round(time.monotonic() - self.loaded_at, 1) if self.loaded_at is not None else None,
+            "refreshes": self.refreshes,
+            "not_modified": self.not_modified,
+            "local_searches": self.local_searches,
+            "remote_searches": self.remote_searches,
+        }
+
+
+# ============= ACCOUNTS =============
+
+# Account serving the current request or update (None: the primary account)
+current_account: ContextVar[Optional["Account"]] = ContextVar("current_account", default=None)
+
+# Account the client asked for by name with the X-Telegram-Account header
+account_hint: ContextVar[Optional[str]] = ContextVar("account_hint", default=None)
+
+
+class Account:
+    """One Telegram session and everything tied to it.
+
+    Flood limits, access hashes, dialogs and contacts all differ between accounts,
+    so each has its own client, scheduler, caches and indexes.
+    """
+
+    def __init__(self, name: str, session: Union[str, StringSession]):
+        self.name = name
+        self.session = session
+        self.client: Optional[TelegramClient] = None
+        self.scheduler = RpcScheduler(
+            RPC_CONCURRENCY, RPC_MAX_FLOOD_WAIT, {**DEFAULT_METHOD_LIMITS, **parse_method_limits(RPC_METHOD_LIMITS)}
+        )
+        self.entity_cache = EntityCache(ENTITY_CACHE_SIZE, ENTITY_CACHE_TTL, ENTITY_NEGATIVE_TTL)
+        # Entity lookups: the entity cache keeps results, this only merges concurrent misses
+        self.entity_flight = SingleFlight()
+        # Hot read endpoints (/chats/{id}, /users/{id}/status, /users/{id}/photos)
+        self.read_flight = SingleFlight(COALESCE_CACHE_TTL)
+        self.dialog_index = DialogIndex(self)
+        self.contact_index = ContactIndex()
+        self.read_acks = ReadAckBatcher(READ_ACK_INTERVAL)
+        self.requests = 0
+        self.failovers = 0
+
+    def flood_waited(self) -> bool:
+        now = time.monotonic()
+        return any(bucket.blocked_until > now for bucket in self.scheduler.method_buckets.values())
+
+    def load(self) -> int:
+        """Telegram calls running or queued for this account."""
+        return self.scheduler.in_flight + sum(len(queue) for queue in self.scheduler.queues)
+
+    def stats(self, chats: int) -> Dict[str, Any]:
+        rpc_stats = self.scheduler.stats()
+        return {
+            "name": self.name,
+            "connected": self.client.is_connected() if self.client is not None else False,
+            "chats": chats,
+            "requests": self.requests,
+            # Requests taken over from a flood-waited account
+            "failovers": self.failovers,
+            "load": self.load(),
+            "in_flight": rpc_stats["in_flight"],
+            "queued": {name: queue["depth"] for name, queue in rpc_stats["queues"].items()},
+            "completed": rpc_stats["completed"],
+            "failed": rpc_stats["failed"],
+            "flood_waits": rpc_stats["flood_waits"],
+            "flood_wait_seconds": rpc_stats["flood_wait_seconds"],
+            "blocked_methods": rpc_stats["blocked_methods"],
+        }
+
+
+def parse_sessions(value: str) -> List[Tuple[str, Union[str, StringSession]]]:
+    """Parse TELEGRAM_EXTRA_SESSIONS into (account name, session) pairs."""
+    sessions = []
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, separator, session = item.partition(":")
+        if separator:
+            sessions.append((name.strip(), StringSession(session.strip())))
+        else:
+            sessions.append((item, item))
+    return sessions
+
+
+def ring_position(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class AccountPool:
+    """The configured accounts and which of them serves each chat.
+
+    A chat belongs to the first account found in it, from its dialogs or an update;
+    chats no account has claimed are spread over the accounts by consistent hashing,
+    so adding an account moves only its share of them. While a chat's account is
+    flood-waited, channel requests move to the least loaded account that can serve
+    them; private chats and basic groups number their messages per account and stay.
+    """
+
+    VIRTUAL_NODES = 64
+
+    def __init__(self, accounts: List[Account]):
+        self.accounts = accounts
+        self.primary = accounts[0]
+        self.by_name = {account.name: account for account in accounts}
+        if len(self.by_name) != len(accounts):
+            raise ValueError("Account names must be unique")
+        # Accounts known to be in each chat, the first one serving it
+        self.members: Dict[int, List[Account]] = {}
+        ring = sorted(
+            (ring_position(f"{account.name}#{i}"), account.name)
+            for account in accounts for i in range(self.VIRTUAL_NODES)
+        )
+        self._ring_positions = [position for position, _ in ring]
+        self._ring_accounts = [self.by_name[name] for _, name in ring]
+
+    def claim(self, peer_id: int, account: Account):
+        members = self.members.get(peer_id)
+        if members is None:
+            self.members[peer_id] = [account]
+        elif account not in members:
+            members.append(account)
+
+    def _ring_order(self, peer_id: int) -> List[Account]:
+        """Every account, in ring order starting from the chat's position."""
+        start = bisect.bisect(self._ring_positions, ring_position(str(peer_id)))
+        order: List[Account] = []
+        for i in range(len(self._ring_accounts)):
+            account = self._ring_accounts[(start + i) % len(self._ring_accounts)]
+            if account not in order:
+                order.append(account)
+                if len(order) == len(self.accounts):
+                    break
+        return order
+
+    def home(self, peer_id: int) -> Account:
+        """The account a chat normally belongs to; its updates are only handled there."""
+        if len(self.accounts) == 1:
+            return self.primary
+        members = self.members.get(peer_id)
+        return members[0] if members else self._ring_order(peer_id)[0]
+
+    def route(self, peer_id: int) -> Account:
+        """The account to serve a request for this chat with now."""
+        home = self.home(peer_id)
+        if not home.flood_waited() or not is_channel(peer_id):
+            return home
+        candidates = [
+            account for account in (self.members.get(peer_id) or self._ring_order(peer_id))
+            if not account.flood_waited()
+        ]
+        if not candidates:
+            return home
+        account = min(candidates, key=Account.load)
+        account.failovers += 1
+        return account
+
+    def stats(self) -> List[Dict[str, Any]]:
+        chats = {account.name: 0 for account in self.accounts}
+        for members in self.members.values():
+            chats[members[0].name] += 1
+        return [account.stats(chats[account.name]) for account in self.accounts]
+
+
+class AccountLocal:
+    """Module-level stand-in for one attribute of the current account.
+
+    Lets `client`, `scheduler`, `entity_cache` and the rest stay plain globals in
+    the code that uses them while every account has its own.
+    """
+
+    __slots__ = ("attribute",)
+
+    def __init__(self, attribute: str):
+        object.__setattr__(self, "attribute", attribute)
+
+    def _target(self):
+        return getattr(current_account.get() or accounts.primary, self.attribute)
+
+    def __getattr__(self, name: str):
+        return getattr(self._target(), name)
+
+    def __setattr__(self, name: str, value):
+        setattr(self._target(), name, value)
+
+    def __call__(self, *args, **kwargs):
+        return self._target()(*args, **kwargs)
+
+    def __bool__(self) -> bool:
+        return self._target() is not None
+
+
+accounts = AccountPool([
+    Account(TELEGRAM_SESSION_NAME or "primary", StringSession(SESSION_STRING) if SESSION_STRING else TELEGRAM_SESSION_NAME),
+    *(Account(name, session) for name, session in parse_sessions(TELEGRAM_EXTRA_SESSIONS)),
+])
+
+client = AccountLocal("client")
+scheduler = AccountLocal("scheduler")
+entity_cache = AccountLocal("entity_cache")
+entity_flight = AccountLocal("entity_flight")
+read_flight = AccountLocal("read_flight")
+dialog_index = AccountLocal("dialog_index")
+contact_index = AccountLocal("contact_index")
+read_acks = AccountLocal("read_acks")
+
+
+def active_account() -> Account:
+    return current_account.get() or accounts.primary
+
+
+def is_channel(peer_id: int) -> bool:
+    return utils.resolve_id(peer_id)[1] is types.PeerChannel
+
+
+def peer_scope(peer_id: Optional[int]) -> Optional[str]:
+    """Account whose copy of a chat the current request or update sees; None when it is shared.
+
+    Channels look the same from every account. Private chats and basic groups number their
+    messages per account, so non-primary accounts keep them apart, as uploads already are.
+    """
+    account = active_account()
+    if account is accounts.primary or (peer_id is not None and is_channel(peer_id)):
+        return None
+    return account.name
+
+
+async def bind_account(chat: Optional[Union[int, str]] = None, hint: Optional[str] = None) -> Account:
+    """Pick the account for a request about `chat` and make it current for the rest of it.
+
+    The context variable is set rather than reset afterwards, so a streamed body keeps
+    using the account its handler started with.
+    """
+    if bridge is not None:
+        # Worker process: the owner picks the account when the call reaches it
+        return accounts.primary
+    if hint:
+        account = accounts.by_name.get(hint)
+        if account is None:
+            raise HTTPException(status_code=400, detail=f"Unknown account: {hint}")
+    elif chat is None or len(accounts.accounts) == 1:
+        account = accounts.primary
+    else:
+        kind, value = EntityCache.key_for(chat)
+        peer_id = None
+        if kind == "id":
+            peer_id = value
+        elif value not in ("me", "self"):
+            # Usernames are resolved once, by the primary account, to find the chat
+            current_account.set(accounts.primary)
+            try:
+                peer_id = utils.get_peer_id(await resolve_entity(chat))
+            except Exception:
+                # The handler reports it as it always has
+                pass
+        account = accounts.route(peer_id) if peer_id is not None else accounts.primary
+    current_account.set(account)
+    account.requests += 1
+    return account
+
+
+# ============= PROCESS BRIDGE =============
+
+# Frames in both directions: two big-endian lengths, a JSON header, then optional raw bytes
+FRAME_HEADER = struct.Struct(">II")
+
+# Events a worker may fall behind by before the oldest are dropped
+BRIDGE_FEED_BUFFER = 10000
+
+# Async route handlers by name, registered by NegotiatedRoute; the owner runs them for workers
+ROUTE_HANDLERS: Dict[str, Any] = {}
+
+# Handlers a worker runs itself instead of forwarding to the owner
+WORKER_LOCAL_HANDLERS = {"watch_chat", "get_metrics"}
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Tuple[Dict[str, Any], bytes]:
+    header_size, data_size = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+    header = load_json(await reader.readexactly(header_size))
+    data = await reader.readexactly(data_size) if data_size else b""
+    return header, data
+
+
+def write_frame(writer: asyncio.StreamWriter, header: Dict[str, Any], data: bytes = b""):
+    encoded = dump_json(header)
+    writer.write(FRAME_HEADER.pack(len(encoded), len(data)) + encoded)
+    if data:
+        writer.write(data)
+
+
+def raw_headers(headers: List[Tuple[str, str]]) -> List[Tuple[bytes, bytes]]:
+    return [(name.encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+
+
+def header_pairs(response: Response) -> List[Tuple[str, str]]:
+    return [(name.decode("latin-1"), value.decode("latin-1")) for name, value in response.raw_headers]
+
+
+def handler_params_model(handler):
+    """A model validating a handler's parameters like FastAPI would (Query limits, body models).
+
+    Request and UploadFile parameters are left out; the bridge passes those separately.
+    """
+    params = {}
+    for param in inspect.signature(handler).parameters.values():
+        if param.annotation in (Request, UploadFile):
+            continue
+        default = ... if param.default is inspect.Parameter.empty else param.default
+        params[param.name] = (param.annotation, default)
+    return create_model(f"{handler.__name__}_params", **params)
+
+
+SPOOL_PREFIX = "bridge-upload-"
+
+
+def spool_upload(upload: UploadFile) -> str:
+    """Copy an upload to a named temp file the owner process can open."""
+    upload.file.seek(0)
+    with tempfile.NamedTemporaryFile(prefix=SPOOL_PREFIX, delete=False) as target:
+        shutil.copyfileobj(upload.file, target, 1024 * 1024)
+    return target.name
+
+
+def open_spooled(path: str):
+    """Open a file spool_upload() created, refusing any other path a caller names."""
+    real = os.path.realpath(path)
+    if (os.path.dirname(real) != os.path.realpath(tempfile.gettempdir())
+            or not os.path.basename(real).startswith(SPOOL_PREFIX)):
+        raise HTTPException(status_code=400, detail="Upload was not spooled by a worker")
+    fd = os.open(real, os.O_RDONLY | getattr(os, "O_NOFOLLOW", 0))
+    info = os.fstat(fd)
+    # A hard link placed in the temp directory would pass the name check
+    if not stat.S_ISREG(info.st_mode) or info.st_nlink != 1 or info.st_uid != os.getuid():
+        os.close(fd)
+        raise HTTPException(status_code=400, detail="Upload was not spooled by a worker")
+    return os.fdopen(fd, "rb")
+
+
+class RemoteRequest:
+    """Stand-in for a worker's Request inside the owner: its headers and, if sent, its body."""
+
+    def __init__(self, headers: List[Tuple[str, str]], reader: Optional[asyncio.StreamReader]):
+        self.headers = Headers(raw=raw_headers(headers))
+        self._reader = reader
+        self.consumed = reader is None
 
-TELEGRAM_API_ID = int(os.getenv("TELEGRAM_API_ID"))
-TELEGRAM_API_HASH = os.getenv("TELEGRAM_API_HASH")
-TELEGRAM_SESSION_NAME = os.getenv("TELEGRAM_SESSION_NAME")
-SESSION_STRING = os.getenv("TELEGRAM_SESSION_STRING")
+    async def stream(self) -> AsyncIterator[bytes]:
+        while not self.consumed:
+            header, data = await read_frame(self._reader)
+            if header["type"] == "end":
+                self.consumed = True
+                break
+            yield data
 
-# Global client instance
-client: TelegramClient = None
 
-# Global storage for watched chats
-watched_chats: Dict[str, asyncio.Queue] = {}
+class WorkerFeed:
+    """Owner side of a worker's event feed: one multiplexed subscriber for every chat it watches."""
 
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.subscriber = Subscriber(BRIDGE_FEED_BUFFER, "drop_oldest", multiplexed=True)
+        self.topics: Dict[str, ChatTopic] = {}
 
-def json_serializer(obj):
-    """Helper function to convert non-serializable objects for JSON serialization."""
-    if isinstance(obj, datetime):
-        return obj.isoformat()
-    if isinstance(obj, bytes):
-        return obj.decode("utf-8", errors="replace")
-    raise TypeError(f"Object of type {type(obj)} is not JSON serializable")
+    def send(self, batch: List[Tuple[str, int, str]]):
+        if batch:
+            write_frame(self.writer, {"type": "events"}, dump_json(batch))
 
+    def flush(self):
+        """Write out queued events, so a reply written next follows them."""
+        self.send(self.subscriber.drain(BRIDGE_FEED_BUFFER))
 
-def format_entity(entity) -> Dict[str, Any]:
-    """Format entity information consistently."""
-    result = {"id": entity.id}
-    if isinstance(entity, User):
-        result["type"] = "user"
-        result["first_name"] = getattr(entity, "first_name", None)
-        result["last_name"] = getattr(entity, "last_name", None)
-        result["username"] = getattr(entity, "username", None)
-        result["phone"] = getattr(entity, "phone", None)
-    elif isinstance(entity, Chat):
-        result["type"] = "chat"
-        result["title"] = getattr(entity, "title", None)
-    elif isinstance(entity, Channel):
-        result["type"] = "channel"
-        result["title"] = getattr(entity, "title", None)
-        result["username"] = getattr(entity, "username", None)
-    return result
+    def attach(self, chat_id: str, last_event_id: Optional[int]) -> List[Tuple[str, int, str]]:
+        """Follow a chat, returning its retained events after `last_event_id`."""
+        topic = watched_chats.get(chat_id)
+        if topic is None:
+            topic = watched_chats[chat_id] = ChatTopic(chat_id)
+        if chat_id not in self.topics:
+            topic.attach(self.subscriber)
+            self.topics[chat_id] = topic
+        return topic.events_after(last_event_id) if last_event_id is not None else []
 
+    def detach(self, chat_id: str):
+        topic = self.topics.pop(chat_id, None)
+        if topic is not None:
+            topic.unsubscribe(self.subscriber)
 
-def format_message(message) -> Dict[str, Any]:
-    """Format message information consistently."""
-    result = {
-        "id": message.id,
-        "date": message.date.isoformat() if message.date else None,
-        "text": message.message,
-        "out": message.out,  # True if sent by us
-    }
+    def close(self):
+        self.subscriber.close("disconnected")
+        for chat_id in list(self.topics):
+            self.detach(chat_id)
+
+
+class BridgeServer:
+    """Owner process side: runs route handlers and watch feeds for HTTP worker processes.
+
+    Each connection carries one call at a time. A call names a route handler and its
+    already validated parameters; the reply is its result, its error, or a streamed body.
+    """
+
+    # Longest wait for a worker to hang up after a reply that ends its connection
+    LINGER_SECONDS = 5.0
+
+    def __init__(self, path: str):
+        self.path = path
+        self.feeds: set = set()
+        self._models: Dict[str, Any] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+        self.connections = 0
+        self.calls = 0
+        self.streams = 0
+        self.errors = 0
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        # Anyone who can connect can act as the Telegram account: bind owner-only from the start
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o177)
+        try:
+            sock.bind(self.path)
+        finally:
+            os.umask(umask)
+        self._server = await asyncio.start_unix_server(self._serve, sock=sock)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for feed in list(self.feeds):
+            feed.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def topic_closed(self, chat_id: str):
+        """Tell workers a chat was unwatched so they close its subscribers too."""
+        for feed in self.feeds:
+            if feed.topics.pop(chat_id, None) is not None:
+                feed.flush()
+                write_frame(feed.writer, {"type": "closed", "chat_id": chat_id})
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            while True:
+                header, data = await read_frame(reader)
+                if header["type"] == "feed":
+                    await self._serve_feed(reader, writer)
+                    return
+                if header["type"] == "observe":
+                    # One-way: a worker's HTTP latencies, reported here for all workers
+                    http_latency.merge(load_json(data))
+                    continue
+                if not await self._serve_call(header, reader, writer):
+                    await self._linger(reader)
+                    return
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def _linger(self, reader):
+        """Discard what the worker still sends until it hangs up.
+
+        Closing with part of a request body unread would reset the connection, and the
+        worker would lose the reply it hasn't read yet. It stops sending once it has.
+        """
+        async def discard():
+            while await reader.read(65536):
+                pass
+
+        try:
+            await asyncio.wait_for(discard(), timeout=self.LINGER_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+    def _local_params(self, handler, params: Dict[str, Any], reader, body: bool):
+        """Rebuild handler arguments: revalidate plain parameters, recreate Request/UploadFile ones."""
+        kwargs = {}
+        remote = None
+        uploads = []
+        for param in inspect.signature(handler).parameters.values():
+            if param.annotation is Request:
+                remote = kwargs[param.name] = RemoteRequest(params.pop(param.name)["headers"], reader if body else None)
+            elif param.annotation is UploadFile:
+                spec = params.pop(param.name)
+                upload = kwargs[param.name] = UploadFile(
+                    open_spooled(spec["path"]), size=spec["size"], filename=spec["filename"],
+                    headers=Headers(raw=raw_headers(spec["headers"]))
+                )
+                uploads.append(upload)
+        model = self._models.get(handler.__name__)
+        if model is None:
+            model = self._models[handler.__name__] = handler_params_model(handler)
+        try:
+            validated = model.model_validate(params)
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
+        kwargs.update((name, getattr(validated, name)) for name in type(validated).model_fields)
+        return kwargs, remote, uploads
+
+    async def _serve_call(self, header: Dict[str, Any], reader, writer) -> bool:
+        """Run one call and write its reply; returns whether the connection can be reused."""
+        self.calls += 1
+        remote = None
+        uploads = []
+        try:
+            handler = ROUTE_HANDLERS.get(header["handler"])
+            if handler is None:
+                raise HTTPException(status_code=404, detail=f"Unknown handler: {header['handler']}")
+            kwargs, remote, uploads = self._local_params(handler, header["params"], reader, header.get("body", False))
+            await bind_account(kwargs.get("chat_id", kwargs.get("user_id")), header.get("account"))
+            result = await handler(**kwargs)
+        except HTTPException as e:
+            reply, data = {"type": "error", "status": e.status_code, "detail": e.detail, "headers": e.headers}, b""
+        except Exception as e:
+            reply, data = {"type": "error", "status": 500, "detail": str(e)}, b""
+        else:
+            if isinstance(result, StreamingResponse):
+                return await self._send_stream(result, reader, writer)
+            if isinstance(result, FileResponse):
+                reply, data = {"type": "file", "path": str(result.path), "status": result.status_code}, b""
+                reply["headers"] = header_pairs(result)
+            elif isinstance(result, Response):
+                reply, data = {"type": "response", "status": result.status_code, "headers": header_pairs(result)}, result.body
+            else:
+                try:
+                    data = dump_json(result)
+                except (TypeError, ValueError, OverflowError):
+                    data = dump_json(jsonable_encoder(result))
+                reply = {"type": "result"}
+        finally:
+            for upload in uploads:
+                await upload.close()
+        if reply["type"] == "error":
+            self.errors += 1
+        # An unread request body would be taken for the next call
+        reusable = remote is None or remote.consumed
+        reply["close"] = not reusable
+        write_frame(writer, reply, data)
+        await writer.drain()
+        return reusable
+
+    async def _send_stream(self, response: StreamingResponse, reader, writer) -> bool:
+        self.streams += 1
+        write_frame(writer, {"type": "stream", "status": response.status_code, "headers": header_pairs(response)})
+
+        async def pump():
+            try:
+                async for chunk in response.body_iterator:
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode(response.charset)
+                    write_frame(writer, {"type": "chunk"}, chunk)
+                    await writer.drain()
+            except ConnectionError:
+                raise
+            except Exception as e:
+                write_frame(writer, {"type": "end", "error": str(e)})
+                return False
+            write_frame(writer, {"type": "end"})
+            await writer.drain()
+            return True
+
+        # The worker sends nothing while a stream is open; EOF means its client went away
+        pumping = asyncio.create_task(pump())
+        hangup = asyncio.create_task(reader.read(1))
+        try:
+            done, _ = await asyncio.wait({pumping, hangup}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            if not pumping.done():
+                pumping.cancel()
+            hangup.cancel()
+            # The reader can't be used again until the cancelled read has unwound
+            await asyncio.wait({hangup})
+        if pumping not in done or pumping.exception() is not None:
+            return False
+        return pumping.result()
+
+    async def _serve_feed(self, reader, writer):
+        """Stream watched-chat events to a worker, which fans them out to its own subscribers."""
+        feed = WorkerFeed(writer)
+        self.feeds.add(feed)
+
+        async def send_events():
+            while not feed.subscriber.closed:
+                feed.send(await feed.subscriber.next_batch(timeout=30.0, max_items=BRIDGE_FEED_BUFFER))
+                await writer.drain()
+
+        async def resolve(request_id: int, chat: Union[int, str]):
+            try:
+                await bind_account(chat)
+                reply = {"type": "resolved", "id": request_id, "chat_id": chat_key(await resolve_entity(chat))}
+            except Exception as e:
+                reply = {"type": "resolved", "id": request_id, "error": str(e)}
+            write_frame(writer, reply)
+
+        sender = asyncio.create_task(send_events())
+        resolving = set()
+        try:
+            while True:
+                header, _ = await read_frame(reader)
+                kind = header["type"]
+                if kind == "resolve":
+                    task = asyncio.create_task(resolve(header["id"], header["chat"]))
+                    resolving.add(task)
+                    task.add_done_callback(resolving.discard)
+                elif kind == "attach":
+                    replay = feed.attach(header["chat_id"], header.get("last_event_id"))
+                    # Events queued before the snapshot go out first, to the worker's existing subscribers
+                    feed.flush()
+                    write_frame(writer, {"type": "attached", "id": header["id"], "chat_id": header["chat_id"]}, dump_json(replay))
+                elif kind == "detach":
+                    feed.detach(header["chat_id"])
+        finally:
+            sender.cancel()
+            for task in resolving:
+                task.cancel()
+            feed.close()
+            self.feeds.discard(feed)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "socket": self.path,
+            "connections": self.connections,
+            "calls": self.calls,
+            "streams": self.streams,
+            "errors": self.errors,
+            "feeds": [{"chats": len(feed.topics), **feed.subscriber.stats()} for feed in self.feeds],
+        }
+
+
+class BridgeClient:
+    """Worker process side: forwards route calls to the owner and mirrors watched chats locally.
+
+    Calls go over a small pool of connections, one call per connection at a time, so a
+    slow streamed body only holds up its own connection. Watch events arrive over one
+    feed connection and are fanned out to this worker's subscribers.
+    """
+
+    MAX_IDLE_CONNECTIONS = 32
+    # How often HTTP latency observations are handed to the owner
+    OBSERVATION_FLUSH_SECONDS = 5.0
+
+    def __init__(self, path: str):
+        self.path = path
+        self._idle: List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+        self._feed: Optional[asyncio.StreamWriter] = None
+        self._feed_task: Optional[asyncio.Task] = None
+        self._pending: Dict[int, Tuple[asyncio.Future, Optional[Subscriber]]] = {}
+        self._request_ids = itertools.count(1)
+
+    async def _open(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        try:
+            return await asyncio.open_unix_connection(self.path)
+        except OSError as e:
+            raise HTTPException(status_code=503, detail=f"Telegram owner process unavailable: {e}")
+
+    def _release(self, connection: Tuple[asyncio.StreamReader, asyncio.StreamWriter]):
+        if len(self._idle) < self.MAX_IDLE_CONNECTIONS:
+            self._idle.append(connection)
+        else:
+            connection[1].close()
+
+    async def send_observations(self):
+        """Hand this worker's HTTP latency observations to the owner, which reports every worker's."""
+        series = http_latency.take()
+        if not series:
+            return
+        try:
+            reader, writer = self._idle.pop() if self._idle else await self._open()
+        except HTTPException:
+            http_latency.merge(series.items())
+            return
+        try:
+            write_frame(writer, {"type": "observe"}, dump_json([[labels, values] for labels, values in series.items()]))
+            await writer.drain()
+        except ConnectionError:
+            writer.close()
+            # Kept for the next flush
+            http_latency.merge(series.items())
+            return
+        self._release((reader, writer))
+
+    async def flush_observations(self):
+        while True:
+            await asyncio.sleep(self.OBSERVATION_FLUSH_SECONDS)
+            await self.send_observations()
+
+    async def call(self, handler: str, kwargs: Dict[str, Any]) -> Response:
+        """Run a route handler in the owner and turn its reply into this worker's response."""
+        params = {}
+        body_request = None
+        spooled = []
+        try:
+            for name, value in kwargs.items():
+                if isinstance(value, Request):
+                    params[name] = {"headers": value.headers.items()}
+                    if value.headers.get("content-length", "0") != "0" or "transfer-encoding" in value.headers:
+                        body_request = value
+                elif isinstance(value, StarletteUploadFile):
+                    path = await asyncio.to_thread(spool_upload, value)
+                    spooled.append(path)
+                    params[name] = {
+                        "path": path, "size": value.size, "filename": value.filename, "headers": value.headers.items()
+                    }
+                elif isinstance(value, BaseModel):
+                    params[name] = value.model_dump(mode="json")
+                else:
+                    params[name] = value
+            call = {
+                "type": "call", "handler": handler, "params": params, "body": body_request is not None,
+                "account": account_hint.get(),
+            }
+
+            while True:
+                pooled = bool(self._idle)
+                reader, writer = self._idle.pop() if pooled else await self._open()
+                try:
+                    reply, data = await self._exchange(call, body_request, reader, writer)
+                except (asyncio.IncompleteReadError, ConnectionError) as e:
+                    writer.close()
+                    # An idle connection closed by an owner restart fails before any reply: try a fresh one
+                    if pooled and body_request is None and not getattr(e, "partial", b""):
+                        continue
+                    raise HTTPException(status_code=502, detail=f"Telegram owner process connection lost: {e!r}")
+                except BaseException:
+                    writer.close()
+                    raise
+                break
+        finally:
+            for path in spooled:
+                os.unlink(path)
+
+        if reply["type"] == "stream":
+            response = StreamingResponse(self._relay(reader, writer), status_code=reply["status"])
+            # Replaced in place: Starlette keeps a view of the list it built
+            response.raw_headers[:] = raw_headers(reply["headers"])
+            return response
+        if reply.get("close"):
+            writer.close()
+        else:
+            self._release((reader, writer))
+        return self._response(reply, data)
+
+    async def _exchange(self, call: Dict[str, Any], body_request: Optional[Request], reader, writer):
+        write_frame(writer, call)
+        if body_request is None:
+            await writer.drain()
+            return await read_frame(reader)
+
+        async def send_body():
+            async for chunk in body_request.stream():
+                if chunk:
+                    write_frame(writer, {"type": "chunk"}, chunk)
+                    await writer.drain()
+            write_frame(writer, {"type": "end"})
+            await writer.drain()
+
+        sending = asyncio.create_task(send_body())
+        reading = asyncio.create_task(read_frame(reader))
+        try:
+            await asyncio.wait({sending, reading}, return_when=asyncio.FIRST_COMPLETED)
+            if not reading.done() and sending.exception() is not None:
+                # The client went away mid-body; no reply is coming
+                raise sending.exception()
+            reply, data = await reading
+        finally:
+            sending.cancel()
+            reading.cancel()
+        # The owner answered before reading the whole body (e.g. an error): the rest is abandoned
+        if not sending.done() or sending.cancelled():
+            reply["close"] = True
+        return reply, data
+
+    def _response(self, reply: Dict[str, Any], data: bytes) -> Response:
+        kind = reply["type"]
+        if kind == "result":
+            media_type, coding = response_encoding.get()
+            if media_type == "application/json":
+                # Already encoded by the owner; only compression is left
+                return negotiated_response(data, media_type, coding)
+            return encode_response(load_json(data))
+        if kind == "error":
+            raise HTTPException(status_code=reply["status"], detail=reply["detail"], headers=reply.get("headers"))
+        if kind == "file":
+            # Same host: the file is served from here, Range handling included
+            response = FileResponse(reply["path"], status_code=reply["status"])
+        else:
+            response = Response(data, status_code=reply["status"])
+        response.raw_headers[:] = raw_headers(reply["headers"])
+        return response
+
+    async def _relay(self, reader, writer) -> AsyncIterator[bytes]:
+        finished = False
+        try:
+            while True:
+                header, data = await read_frame(reader)
+                if header["type"] == "chunk":
+                    yield data
+                    continue
+                if "error" in header:
+                    # Same as a failing local stream: the response is cut short
+                    raise RuntimeError(header["error"])
+                finished = True
+                break
+        finally:
+            if finished:
+                self._release((reader, writer))
+            else:
+                writer.close()
+
+    async def _feed_request(self, request: Dict[str, Any], subscriber: Optional[Subscriber] = None):
+        if self._feed is None:
+            reader, self._feed = await self._open()
+            write_frame(self._feed, {"type": "feed"})
+            self._feed_task = asyncio.create_task(self._read_feed(reader))
+        request_id = next(self._request_ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = (future, subscriber)
+        write_frame(self._feed, {**request, "id": request_id})
+        await self._feed.drain()
+        return await future
+
+    async def watch_key(self, chat: Union[int, str]) -> str:
+        """Resolve a chat reference to its watched-chat key (in the owner)."""
+        return await self._feed_request({"type": "resolve", "chat": chat})
+
+    async def attach(self, chat_id: str, subscriber: Subscriber, last_event_id: Optional[int]) -> "ChatTopic":
+        """Follow a chat through the owner and add `subscriber` to this worker's topic for it."""
+        return await self._feed_request({"type": "attach", "chat_id": chat_id, "last_event_id": last_event_id}, subscriber)
+
+    def detach(self, chat_id: str):
+        if self._feed is not None:
+            write_frame(self._feed, {"type": "detach", "chat_id": chat_id})
+
+    async def _read_feed(self, reader: asyncio.StreamReader):
+        try:
+            while True:
+                header, data = await read_frame(reader)
+                kind = header["type"]
+                if kind == "events":
+                    for chat_id, event_id, payload in load_json(data):
+                        topic = watched_chats.get(chat_id)
+                        # Control items aren't relayed; a "closed" frame follows instead
+                        if topic is not None and event_id is not None:
+                            topic.publish_item((chat_id, event_id, payload))
+                elif kind == "closed":
+                    topic = watched_chats.pop(header["chat_id"], None)
+                    if topic is not None:
+                        topic.close()
+                else:
+                    future, subscriber = self._pending.pop(header["id"])
+                    if "error" in header:
+                        future.set_exception(HTTPException(status_code=500, detail=header["error"]))
+                    elif kind == "attached":
+                        # Attach here, before later events are read, so none are missed or repeated
+                        chat_id = header["chat_id"]
+                        topic = watched_chats.get(chat_id)
+                        if topic is None:
+                            topic = watched_chats[chat_id] = ChatTopic(chat_id)
+                        subscriber.prefill([tuple(item) for item in load_json(data)])
+                        topic.attach(subscriber)
+                        future.set_result(topic)
+                    else:
+                        future.set_result(header["chat_id"])
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            # Owner went away: end local streams so clients reconnect and resume from their last event id
+            self._feed = None
+            for future, _ in self._pending.values():
+                if not future.done():
+                    future.set_exception(HTTPException(status_code=503, detail="Telegram owner process disconnected"))
+            self._pending.clear()
+            for topic in watched_chats.values():
+                for subscriber in topic.subscribers:
+                    subscriber.close("owner disconnected")
+            watched_chats.clear()
+
+    async def close(self):
+        if self._feed_task is not None:
+            self._feed_task.cancel()
+        if self._feed is not None:
+            self._feed.close()
+        while self._idle:
+            self._idle.pop()[1].close()
+
+
+async def watch_key(chat: Union[int, str]) -> str:
+    """Key of a chat in watched_chats."""
+    if bridge is not None:
+        return await bridge.watch_key(chat)
+    return chat_key(await resolve_entity(chat))
+
+
+async def watch_topic(chat_id: str, subscriber: Subscriber, last_event_id: Optional[int] = None) -> "ChatTopic":
+    """Add `subscriber` to a watched chat, starting to watch it if needed."""
+    if bridge is not None:
+        return await bridge.attach(chat_id, subscriber, last_event_id)
+    topic = watched_chats.get(chat_id)
+    if topic is None:
+        topic = watched_chats[chat_id] = ChatTopic(chat_id)
+    topic.attach(subscriber, last_event_id)
+    return topic
+
+
+async def run_owner():
+    """Owner process: holds the Telegram session and serves HTTP workers over BRIDGE_SOCKET."""
+    global bridge_server
+    await start_telegram()
+    bridge_server = BridgeServer(BRIDGE_SOCKET)
+    await bridge_server.start()
+    log.info("Serving workers", extra={"socket": BRIDGE_SOCKET})
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+    try:
+        await stopping.wait()
+    finally:
+        await bridge_server.stop()
+        await stop_telegram()
+
+
+def launch_owner() -> subprocess.Popen:
+    """Start the owner process and wait until it accepts workers."""
+    if os.path.exists(BRIDGE_SOCKET):
+        os.unlink(BRIDGE_SOCKET)
+    owner = subprocess.Popen([sys.executable, os.path.abspath(__file__)], env={**os.environ, "BRIDGE_ROLE": "owner"})
+    # Logging in may prompt on the terminal, so there is no fixed deadline
+    while not os.path.exists(BRIDGE_SOCKET):
+        if owner.poll() is not None:
+            raise SystemExit(f"Owner process exited with code {owner.returncode}")
+        time.sleep(0.1)
+    return owner
+
+
+def register_update_handlers(account: Account):
+    """Handle one account's updates.
+
+    A channel several accounts are in is handled by its home account only. Private chats
+    and basic groups are separate conversations per account, so every account handles its own.
+    """
+    from telethon import events
+    tg = account.client
+    
+    @tg.on(events.NewMessage())
+    @timed_handler("new_message")
+    async def handle_new_message(event):
+        """Handle new messages for watched chats."""
+        current_account.set(account)
+        accounts.claim(event.chat_id, account)
+        # In-memory only: keeps /chats current for every dialog
+        dialog_index.on_new_message(event)
+        if is_channel(event.chat_id) and accounts.home(event.chat_id) is not account:
+            return
+        
+        # Skip unwatched chats before doing any work
+        topic = watched_chats.get(str(event.chat_id))
+        if topic is None:
+            return
+        if event.out:
+            # Our own messages aren't broadcast, but the store needs them to keep its ranges complete
+            if message_store is not None:
+                message_store.record_live(event.chat_id, format_message(event.message))
+            return
+        
+        # Sender usually comes from the users attached to the update or the
+        # resolver cache; only fall back to a network call when both miss
+        cache_update_entities(event._entities)
+        try:
+            await resolve_sender(event)
+        except Exception as e:
+            log.warning("Could not get sender", extra={"chat_id": event.chat_id, "error": str(e)})
+        
+        # Broadcast message to every subscriber of this chat
+        try:
+            message_data = format_message(event.message)
+            topic.publish(message_data)
+            if message_store is not None:
+                message_store.record_live(event.chat_id, message_data)
+        except Exception:
+            log.exception("Error broadcasting message", extra={"chat_id": event.chat_id, "message_id": event.id})
+            return
+        event_log.debug("Message broadcast", extra={
+            "chat_id": event.chat_id, "message_id": event.id, "subscribers": len(topic.subscribers)
+        })
     
-    # Sender info - try multiple ways to get sender name
-    sender_name = "Unknown"
-    sender_id = None
+    @tg.on(events.UserUpdate())
+    @timed_handler("user_update")
+    async def handle_user_update(event):
+        """Keep the presence cache current; typing notifications carry no status."""
+        if event.status is not None:
+            presence_cache.put(event.user_id, event.status)
     
-    # Try to get sender from message
-    if hasattr(message, 'sender') and message.sender:
-        sender = message.sender
-        sender_id = getattr(sender, 'id', None)
-        
-        if hasattr(sender, 'first_name'):
-            first = getattr(sender, 'first_name', '') or ''
-            last = getattr(sender, 'last_name', '') or ''
-            sender_name = f"{first} {last}".strip()
-        elif hasattr(sender, 'title'):
-            sender_name = sender.title
-        elif hasattr(sender, 'username'):
-            sender_name = f"@{sender.username}"
+    @tg.on(events.MessageRead(inbox=True))
+    @timed_handler("message_read")
+    async def handle_read(event):
+        """Reset unread counters when a dialog is read elsewhere."""
+        current_account.set(account)
+        dialog_index.on_read(event)
     
-    # Try sender_id attribute if sender object not available
-    if sender_name == "Unknown" and hasattr(message, 'from_id'):
-        from_id = message.from_id
-        if hasattr(from_id, 'user_id'):
-            sender_id = from_id.user_id
+    @tg.on(events.ChatAction())
+    @timed_handler("chat_action")
+    async def handle_chat_action(event):
+        """Track renamed dialogs and membership changes."""
+        current_account.set(account)
+        dialog_index.on_chat_action(event)
     
-    # Fallback to peer_id if still unknown
-    if sender_name == "Unknown" and hasattr(message, 'peer_id'):
-        peer_id = message.peer_id
-        if hasattr(peer_id, 'user_id'):
-            sender_id = peer_id.user_id
-            sender_name = f"User {sender_id}"
-        elif hasattr(peer_id, 'channel_id'):
-            sender_name = f"Channel {peer_id.channel_id}"
+    @tg.on(events.MessageEdited())
+    @timed_handler("message_edited")
+    async def handle_edited_message(event):
+        """Keep stored copies of edited messages current."""
+        current_account.set(account)
+        if is_channel(event.chat_id) and accounts.home(event.chat_id) is not account:
+            return
+        if media_cache is not None:
+            # The edit may have replaced the media
+            media_cache.discard_message(event.chat_id, event.id, peer_scope(event.chat_id))
+        if message_store is None or not message_store.knows(event.chat_id):
+            return
+        cache_update_entities(event._entities)
+        try:
+            await resolve_sender(event)
+        except Exception:
+            pass
+        message_store.update(event.chat_id, format_message(event.message))
     
-    result["sender_name"] = sender_name if sender_name else "Unknown"
-    result["sender_id"] = sender_id
+    @tg.on(events.MessageDeleted())
+    @timed_handler("message_deleted")
+    async def handle_deleted_messages(event):
+        """Drop deleted messages from the store."""
+        current_account.set(account)
+        # Deletions outside channels don't say which chat they were in
+        if event.chat_id is not None and accounts.home(event.chat_id) is not account:
+            return
+        if message_store is not None:
+            message_store.delete(event.chat_id, event.deleted_ids)
+
+
+async def start_telegram():
+    """Connect every account, open the local stores and register update handlers."""
+    global message_store, upload_cache, media_cache, reaper
+    log_pipeline.start()
     
-    # Reply info
-    if message.reply_to and message.reply_to.reply_to_msg_id:
-        result["reply_to_msg_id"] = message.reply_to.reply_to_msg_id
+    if MESSAGE_STORE_PATH:
+        message_store = MessageStore(MESSAGE_STORE_PATH)
+    if UPLOAD_CACHE_PATH:
+        upload_cache = UploadCache(UPLOAD_CACHE_PATH, UPLOAD_CACHE_SIZE)
+    if MEDIA_CACHE_DIR:
+        media_cache = MediaCache(MEDIA_CACHE_DIR, MEDIA_CACHE_MAX_BYTES)
     
-    # Media info
-    if message.media:
-        result["has_media"] = True
-        result["media_type"] = type(message.media).__name__
-    else:
-        result["has_media"] = False
+    for account in accounts.accounts:
+        account.client = FloodAwareClient(account.session, TELEGRAM_API_ID, TELEGRAM_API_HASH)
+        # Work Telethon starts for this client (e.g. its update loop) runs as this account
+        current_account.set(account)
+        await account.client.start()
+        register_update_handlers(account)
+        if len(accounts.accounts) > 1:
+            # Learn which chats the account is in, so requests for them are routed to it
+            account.dialog_index.preload()
+        log.info("Telegram client connected", extra={"account": account.name})
+    current_account.set(None)
     
-    return result
+    reaper = asyncio.create_task(reap_idle_topics())
+
+
+async def stop_telegram():
+    reaper.cancel()
+    for account in accounts.accounts:
+        current_account.set(account)
+        await account.read_acks.flush()
+        account.scheduler.stop()
+    if message_store is not None:
+        message_store.close()
+    if upload_cache is not None:
+        upload_cache.close()
+    for account in accounts.accounts:
+        await account.client.disconnect()
+    log.info("Telegram client disconnected")
+    log_pipeline.stop()
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Manage Telegram client lifecycle."""
-    global client
+    """Manage Telegram client lifecycle; a worker process only links to the owner."""
+    global bridge, reaper
+    if BRIDGE_ROLE == "worker":
+        log_pipeline.start()
+        bridge = BridgeClient(BRIDGE_SOCKET)
+        # Watched chats are mirrored locally, and reaped locally too
+        reaper = asyncio.create_task(reap_idle_topics())
+        observations = asyncio.create_task(bridge.flush_observations())
+        yield
+        reaper.cancel()
+        observations.cancel()
+        await bridge.send_observations()
+        await bridge.close()
+        log_pipeline.stop()
+        return
     
-    if SESSION_STRING:
-        client = TelegramClient(StringSession(SESSION_STRING), TELEGRAM_API_ID, TELEGRAM_API_HASH)
+    await start_telegram()
+    yield
+    await stop_telegram()
+
+
+# Negotiated per request by NegotiatedRoute: (media type, content coding or None)
+response_encoding: ContextVar[Tuple[str, Optional[str]]] = ContextVar(
+    "response_encoding", default=("application/json", None)
+)
+
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+
+# Speed-oriented levels: these responses are compressed on the fly, once per request
+COMPRESSORS = {"gzip": lambda body: gzip.compress(body, compresslevel=5, mtime=0)}
+if brotli is not None:
+    COMPRESSORS["br"] = lambda body: brotli.compress(body, quality=4)
+
+
+def parse_qualities(header: Optional[str]) -> Dict[str, float]:
+    """Parse an Accept-style header into {value: q}."""
+    qualities = {}
+    for item in (header or "").split(","):
+        value, *params = (part.strip() for part in item.split(";"))
+        if not value:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, raw = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(raw)
+                except ValueError:
+                    q = 0.0
+        qualities[value.lower()] = q
+    return qualities
+
+
+def negotiate_encoding(accept: Optional[str], accept_encoding: Optional[str]) -> Tuple[str, Optional[str]]:
+    """Pick the response media type (JSON or MessagePack) and content coding for a request."""
+    media_type = "application/json"
+    if msgpack is not None and accept and "msgpack" in accept:
+        offered = parse_qualities(accept)
+        json_q = max(offered.get("application/json", 0.0), offered.get("application/*", 0.0), offered.get("*/*", 0.0))
+        best = max(MSGPACK_MEDIA_TYPES, key=lambda media: offered.get(media, 0.0))
+        if offered.get(best, 0.0) > 0 and offered[best] >= json_q:
+            media_type = best
+
+    coding = None
+    if accept_encoding:
+        offered = parse_qualities(accept_encoding)
+        wildcard = offered.get("*", 0.0)
+        best_q = 0.0
+        # Preference order on ties: brotli compresses JSON noticeably better than gzip
+        for name in ("br", "gzip"):
+            q = offered.get(name, wildcard)
+            if name in COMPRESSORS and q > best_q:
+                coding, best_q = name, q
+    return media_type, coding
+
+
+def encode_response(content: Any) -> Response:
+    """Encode a handler result in the format and content coding negotiated for this request."""
+    media_type, coding = response_encoding.get()
+    if media_type == "application/json":
+        body = dump_json(content)
     else:
-        client = TelegramClient(TELEGRAM_SESSION_NAME, TELEGRAM_API_ID, TELEGRAM_API_HASH)
-    
-    await client.start()
-    
-    # Register event handler for new messages
-    from telethon import events
-    
-    @client.on(events.NewMessage())
-    async def handle_new_message(event):
-        """Handle new messages for watched chats."""
-        # Skip our own messages
-        if event.out:
-            print(f"⏭️  Skipping outgoing message")
-            return
-        
-        # Get chat ID
-        chat_id = str(event.chat_id)
-        print(f"📬 New message received in chat {chat_id}")
-        print(f"   Watched chats: {list(watched_chats.keys())}")
-        
-        # Check if this chat is being watched
-        if chat_id in watched_chats:
-            print(f"   ✓ Chat is being watched, processing message...")
-            
-            # Get sender info (event might not have it populated)
-            try:
-                sender = await event.get_sender()
-                # Attach sender to message if not already there
-                if not event.message.sender:
-                    event.message.sender = sender
-            except Exception as e:
-                print(f"   Warning: Could not get sender: {e}")
-            
-            message_data = format_message(event.message)
-            print(f"   Message from: {message_data.get('sender_name')}")
-            print(f"   Message text: {message_data.get('text', '')[:50]}...")
-            
-            # Add message to the queue for this chat
+        body = msgpack.packb(content, default=json_serializer, use_bin_type=True)
+    return negotiated_response(body, media_type, coding)
+
+
+def negotiated_response(body: bytes, media_type: str, coding: Optional[str]) -> Response:
+    """Wrap an encoded body, compressing it if it's large enough and the client accepts it."""
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if coding is not None and len(body) >= RESPONSE_COMPRESS_MIN_BYTES:
+        body = COMPRESSORS[coding](body)
+        headers["Content-Encoding"] = coding
+    return Response(body, media_type=media_type, headers=headers)
+
+
+class NegotiatedRoute(APIRoute):
+    """Route whose plain dict/list results are encoded by encode_response directly.
+
+    FastAPI would otherwise walk every result through jsonable_encoder first, which
+    dominates the cost of large message lists. The client picks JSON or MessagePack
+    with Accept, and large bodies are compressed per Accept-Encoding. Results that
+    can't be encoded this way still take FastAPI's generic path.
+
+    In a worker process the handler runs in the owner instead (see BridgeClient); the
+    worker keeps the parsing, validation, encoding and compression.
+    """
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        if asyncio.iscoroutinefunction(endpoint):
+            original = endpoint
+            ROUTE_HANDLERS[original.__name__] = original
+
+            @functools.wraps(original)
+            async def endpoint(*args, **kw):
+                if bridge is not None and original.__name__ not in WORKER_LOCAL_HANDLERS:
+                    return await bridge.call(original.__name__, kw)
+                await bind_account(kw.get("chat_id", kw.get("user_id")), account_hint.get())
+                result = await original(*args, **kw)
+                if isinstance(result, (dict, list)):
+                    try:
+                        return encode_response(result)
+                    except (TypeError, ValueError, OverflowError):
+                        pass
+                return result
+        super().__init__(path, endpoint, **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def negotiated_handler(request: Request) -> Response:
+            token = response_encoding.set(
+                negotiate_encoding(request.headers.get("accept"), request.headers.get("accept-encoding"))
+            )
+            hint_token = account_hint.set(request.headers.get("x-telegram-account"))
+            started = time.monotonic()
+            status = 500
             try:
-                await watched_chats[chat_id].put(message_data)
-                print(f"   ✓ Message added to queue")
-            except Exception as e:
-                print(f"   ✗ Error adding message to queue: {e}")
-        else:
-            print(f"   ⏭️  Chat not being watched")
-    
-    print("✅ Telegram client connected")
-    
-    yield
-    
-    await client.disconnect()
-    print("👋 Telegram client disconnected")
+                response = await handler(request)
+                status = response.status_code
+                return response
+            except HTTPException as e:
+                status = e.status_code
+                raise
+            except RequestValidationError:
+                status = 422
+                raise
+            finally:
+                http_latency.observe((self.path, request.method, str(status)), time.monotonic() - started)
+                account_hint.reset(hint_token)
+                response_encoding.reset(token)
+
+        return negotiated_handler
 
 
 app = FastAPI(
@@ -186,6 +4070,7 @@ app = FastAPI(
     description="HTTP API for Telegram operations",
     lifespan=lifespan
 )
+app.router.route_class = NegotiatedRoute
 
 app.add_middleware(
     CORSMiddleware,
@@ -219,11 +4104,56 @@ async def health_check():
     return {"status": "ok", "connected": client.is_connected() if client else False}
 
 
+@app.get("/stats")
+async def get_stats():
+    """Internal cache statistics."""
+    return {
+        "entity_cache": entity_cache.stats(),
+        "coalescing": {"entities": entity_flight.stats(), "reads": read_flight.stats()},
+        "rpc": scheduler.stats(),
+        "message_store": message_store.stats() if message_store is not None else None,
+        "dialog_index": dialog_index.stats(),
+        "contacts": contact_index.stats(),
+        "presence": presence_cache.stats(),
+        "read_acks": read_acks.stats(),
+        "uploads": dict(upload_stats),
+        "upload_cache": upload_cache.stats() if upload_cache is not None else None,
+        "downloads": dict(download_stats),
+        "media_cache": media_cache.stats() if media_cache is not None else None,
+        "watched_chats": {chat_id: topic.stats() for chat_id, topic in watched_chats.items()},
+        "bridge": bridge_server.stats() if bridge_server is not None else None,
+        "accounts": accounts.stats(),
+        "logging": log_pipeline.stats(),
+    }
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics: latency histograms, scheduler and flood-wait counters, watch and transfer totals.
+
+    Workers hand their HTTP latencies to the owner every few seconds, so a scrape through
+    any worker reports all of them; the scraped worker sends what it has first.
+    """
+    if bridge is not None:
+        await bridge.send_observations()
+        owner = await bridge.call("get_metrics", {})
+        body = owner.body.decode()
+    else:
+        body = render_metrics()
+    return Response(body, media_type="text/plain; version=0.0.4")
+
+
+@app.get("/accounts")
+async def get_accounts():
+    """Configured accounts with their share of chats and current load."""
+    return {"accounts": accounts.stats(), "count": len(accounts.accounts)}
+
+
 @app.get("/me")
 async def get_me():
     """Get current user info."""
     try:
-        me = await client.get_me()
+        me = await rpc("get_me", client.get_me, priority=PRIORITY_INTERACTIVE)
         return format_entity(me)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -232,31 +4162,17 @@ async def get_me():
 @app.get("/chats")
 async def get_chats(
     limit: int = Query(default=50, le=200),
-    chat_type: Optional[str] = Query(default=None, description="Filter by type: user, chat, channel")
+    chat_type: Optional[str] = Query(default=None, description="Filter by type: user, chat, channel"),
+    cursor: Optional[str] = Query(default=None, description="next_cursor from the previous page")
 ):
-    """Get list of chats/dialogs."""
-    try:
-        dialogs = await client.get_dialogs(limit=limit)
-        chats = []
-        
-        for dialog in dialogs:
-            entity = dialog.entity
-            chat_info = format_entity(entity)
-            chat_info["unread_count"] = dialog.unread_count
-            chat_info["last_message"] = dialog.message.message[:100] if dialog.message and dialog.message.message else None
-            
-            # Filter by type if specified
-            if chat_type:
-                if chat_type == "user" and isinstance(entity, User):
-                    chats.append(chat_info)
-                elif chat_type == "chat" and isinstance(entity, Chat):
-                    chats.append(chat_info)
-                elif chat_type == "channel" and isinstance(entity, Channel):
-                    chats.append(chat_info)
-            else:
-                chats.append(chat_info)
+    """Get list of chats/dialogs, served from the event-maintained dialog index."""
+    try:
+        await dialog_index.ensure_fresh()
+        chats, next_cursor = dialog_index.page(limit, chat_type, cursor)
         
-        return {"chats": chats, "count": len(chats)}
+        return {"chats": chats, "count": len(chats), "next_cursor": next_cursor}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -264,14 +4180,12 @@ async def get_chats(
 @app.get("/chats/{chat_id}")
 async def get_chat(chat_id: Union[int, str]):
     """Get detailed info about a specific chat."""
-    try:
-        # Handle string chat_id (username)
-        if isinstance(chat_id, str) and not chat_id.lstrip('-').isdigit():
-            entity = await client.get_entity(chat_id)
-        else:
-            entity = await client.get_entity(int(chat_id))
-        
+    async def load():
+        entity = await resolve_entity(chat_id)
         return format_entity(entity)
+    
+    try:
+        return await read_flight.do(("chat", EntityCache.key_for(chat_id)), load)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -280,25 +4194,20 @@ async def get_chat(chat_id: Union[int, str]):
 async def get_messages(
     chat_id: Union[int, str],
     limit: int = Query(default=20, le=100),
-    offset_id: Optional[int] = Query(default=None, description="Get messages before this ID")
+    offset_id: Optional[int] = Query(default=None, description="Get messages before this ID"),
+    fields: Optional[str] = Query(default=None, description="Comma-separated message fields to return, e.g. id,text,sender_id")
 ):
     """Get messages from a chat."""
+    selected = parse_fields(fields)
     try:
-        # Handle string chat_id (username)
-        if isinstance(chat_id, str) and not chat_id.lstrip('-').isdigit():
-            entity = await client.get_entity(chat_id)
-        else:
-            entity = await client.get_entity(int(chat_id))
+        entity = await resolve_entity(chat_id)
         
-        kwargs = {"limit": limit}
-        if offset_id:
-            kwargs["offset_id"] = offset_id
-        
-        messages = await client.get_messages(entity, **kwargs)
+        messages, source = await read_messages(entity, limit, offset_id or 0, fields=selected)
         
         return {
-            "messages": [format_message(msg) for msg in messages],
-            "count": len(messages)
+            "messages": messages,
+            "count": len(messages),
+            "source": source
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -308,17 +4217,17 @@ async def get_messages(
 async def send_message(chat_id: Union[int, str], request: SendMessageRequest):
     """Send a message to a chat."""
     try:
-        # Handle string chat_id (username)
-        if isinstance(chat_id, str) and not chat_id.lstrip('-').isdigit():
-            entity = await client.get_entity(chat_id)
-        else:
-            entity = await client.get_entity(int(chat_id))
+        entity = await resolve_entity(chat_id)
         
         kwargs = {}
         if request.reply_to:
             kwargs["reply_to"] = request.reply_to
         
-        result = await client.send_message(entity, request.message, **kwargs)
+        result = await rpc(
+            "send_message", lambda: client.send_message(entity, request.message, **kwargs),
+            peer=entity, priority=PRIORITY_INTERACTIVE
+        )
+        record_sent(entity, [result])
         
         return {
             "success": True,
@@ -332,22 +4241,20 @@ async def send_message(chat_id: Union[int, str], request: SendMessageRequest):
 @app.post("/chats/{chat_id}/schedule")
 async def schedule_message(chat_id: Union[int, str], request: ScheduleMessageRequest):
     """Schedule a message to be sent at a future time."""
-    from datetime import timedelta
-
     try:
         if request.minutes_from_now < 1:
             raise HTTPException(status_code=400, detail="minutes_from_now must be at least 1")
         if request.minutes_from_now > 525600:
             raise HTTPException(status_code=400, detail="minutes_from_now cannot exceed 525600 (1 year)")
 
-        # Handle string chat_id (username)
-        if isinstance(chat_id, str) and not chat_id.lstrip('-').isdigit():
-            entity = await client.get_entity(chat_id)
-        else:
-            entity = await client.get_entity(int(chat_id))
+        entity = await resolve_entity(chat_id)
 
         schedule_time = datetime.now() + timedelta(minutes=request.minutes_from_now)
-        result = await client.send_message(entity, request.message, schedule=schedule_time)
+        result = await rpc(
+            "send_message", lambda: client.send_message(entity, request.message, schedule=schedule_time),
+            peer=entity, priority=PRIORITY_INTERACTIVE
+        )
+        # Not stored: the id is in the scheduled list, and posting it later arrives as a normal update
 
         return {
             "success": True,
@@ -360,48 +4267,144 @@ async def schedule_message(chat_id: Union[int, str], request: ScheduleMessageReq
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/chats/{chat_id}/files")
-async def send_file(
+@app.post("/chats/{chat_id}/files")
+async def send_file(
+    chat_id: Union[int, str],
+    file: UploadFile = File(...),
+    caption: Optional[str] = Form(default=None),
+    voice_note: bool = Form(default=False)
+):
+    """Send a file (photo, document, or voice note) to a chat."""
+    try:
+        entity = await resolve_entity(chat_id)
+        
+        # Stream the upload to Telegram in parts instead of buffering it whole
+        file_size = file.size
+        if file_size is None:
+            file_size = file.file.seek(0, os.SEEK_END)
+            file.file.seek(0)
+        
+        # The multipart body is already spooled locally, so hashing it first is cheap
+        # compared to an upload and lets repeated files skip the upload entirely
+        sha256 = await asyncio.to_thread(hash_file, file.file) if upload_cache is not None else None
+        
+        return await send_uploaded_file(
+            entity, ChunkReader(iter_upload_file(file)), file_size, file.filename or "file", caption, voice_note, sha256
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.put("/chats/{chat_id}/files")
+async def send_file_stream(
+    chat_id: Union[int, str],
+    request: Request,
+    filename: str = Query(..., description="File name; its extension decides photo vs document"),
+    caption: Optional[str] = Query(default=None),
+    voice_note: bool = Query(default=False)
+):
+    """Send a file from a raw request body, piping it to Telegram without buffering or temp files.
+
+    Requires Content-Length, which Telegram needs up front to plan the upload parts.
+    With UPLOAD_TRUST_CLIENT_SHA256 set, an X-Content-SHA256 header lets repeated content
+    skip the upload. The header is not checked against the body (that would mean reading
+    it first), so only enable this when every client is trusted: a client knowing another
+    file's hash could send that file.
+    """
+    try:
+        content_length = request.headers.get("content-length")
+        if not content_length or not content_length.isdigit():
+            raise HTTPException(status_code=411, detail="Content-Length is required")
+        
+        entity = await resolve_entity(chat_id)
+        
+        return await send_uploaded_file(
+            entity, ChunkReader(request.stream()), int(content_length), filename, caption, voice_note,
+            request.headers.get("x-content-sha256") if UPLOAD_TRUST_CLIENT_SHA256 else None
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/chats/{chat_id}/messages/{message_id}/media")
+async def download_media(
     chat_id: Union[int, str],
-    file: UploadFile = File(...),
-    caption: Optional[str] = Form(default=None),
-    voice_note: bool = Form(default=False)
+    message_id: int,
+    request: Request,
+    thumb: bool = Query(default=False, description="Return the thumbnail instead of the full file")
 ):
-    """Send a file (photo, document, or voice note) to a chat."""
+    """Download a message's photo, document or voice note, honouring Range requests.
+
+    Bytes are streamed as Telegram returns them; complete downloads are kept in the
+    on-disk media cache so repeat requests are served locally.
+    """
     try:
-        # Handle string chat_id (username)
-        if isinstance(chat_id, str) and not chat_id.lstrip('-').isdigit():
-            entity = await client.get_entity(chat_id)
-        else:
-            entity = await client.get_entity(int(chat_id))
+        entity = await resolve_entity(chat_id)
+        peer_id = utils.get_peer_id(entity)
+        key = MediaCache.key_for(peer_id, message_id, thumb, peer_scope(peer_id))
         
-        # Read file content
-        content = await file.read()
+        if media_cache is not None:
+            cached = media_cache.get(key)
+            if cached is not None:
+                path, meta = cached
+                return FileResponse(
+                    path, media_type=meta["mime_type"], filename=meta["file_name"], content_disposition_type="inline"
+                )
         
-        # Save temporarily
-        import tempfile
-        with tempfile.NamedTemporaryFile(delete=False, suffix=f"_{file.filename}") as tmp:
-            tmp.write(content)
-            tmp_path = tmp.name
+        message = await rpc(
+            "get_messages", lambda: client.get_messages(entity, ids=message_id), priority=PRIORITY_INTERACTIVE
+        )
+        if message is None:
+            raise HTTPException(status_code=404, detail="Message not found")
+        media = media_file(message, thumb)
+        if media is None:
+            raise HTTPException(status_code=404, detail="Message has no downloadable " + ("thumbnail" if thumb else "media"))
+        
+        headers = {"Accept-Ranges": "bytes", "Content-Disposition": content_disposition(media.file_name)}
+        if media.data is not None or media.size == 0:
+            return Response(media.data or b"", media_type=media.mime_type, headers=headers)
         
+        byte_range = parse_range(request.headers.get("range"), media.size)
+        start, end = byte_range or (0, media.size - 1)
+        
+        # Fetch the first part before answering so failures still get a proper status code
+        stream = MediaStream(media, start, end)
         try:
-            result = await client.send_file(
-                entity,
-                tmp_path,
-                caption=caption,
-                voice_note=voice_note
-            )
-            
-            return {
-                "success": True,
-                "message_id": result.id,
-                "date": result.date.isoformat() if result.date else None
-            }
-        finally:
-            # Clean up temp file
-            import os
-            os.unlink(tmp_path)
-            
+            first = await stream.read()
+        except BaseException:
+            await stream.close()
+            raise
+        
+        whole = start == 0 and end == media.size - 1
+        writer = media_cache.writer(key, media) if media_cache is not None and whole else None
+        
+        async def body():
+            try:
+                chunk = first
+                while chunk:
+                    if writer is not None:
+                        await writer.write(chunk)
+                    yield chunk
+                    chunk = await stream.read()
+                if writer is not None:
+                    await writer.commit()
+            finally:
+                await stream.close()
+                if writer is not None:
+                    await writer.abort()
+        
+        headers["Content-Length"] = str(end - start + 1)
+        if byte_range is not None:
+            headers["Content-Range"] = f"bytes {start}-{end}/{media.size}"
+        return StreamingResponse(
+            body(), status_code=206 if byte_range is not None else 200, media_type=media.mime_type, headers=headers
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -410,17 +4413,8 @@ async def send_file(
 async def get_contacts():
     """Get all contacts."""
     try:
-        result = await client(functions.contacts.GetContactsRequest(hash=0))
-        contacts = []
-        
-        for user in result.users:
-            contacts.append({
-                "id": user.id,
-                "first_name": getattr(user, "first_name", None),
-                "last_name": getattr(user, "last_name", None),
-                "username": getattr(user, "username", None),
-                "phone": getattr(user, "phone", None),
-            })
+        await contact_index.ensure_fresh()
+        contacts = list(contact_index.contacts.values())
         
         return {"contacts": contacts, "count": len(contacts)}
     except Exception as e:
@@ -428,23 +4422,25 @@ async def get_contacts():
 
 
 @app.get("/contacts/search")
-async def search_contacts(query: str = Query(..., min_length=1)):
-    """Search contacts by name, username, or phone."""
-    try:
-        result = await client(functions.contacts.SearchRequest(q=query, limit=20))
-        contacts = []
-        
-        for user in result.users:
-            if isinstance(user, User):
-                contacts.append({
-                    "id": user.id,
-                    "first_name": getattr(user, "first_name", None),
-                    "last_name": getattr(user, "last_name", None),
-                    "username": getattr(user, "username", None),
-                    "phone": getattr(user, "phone", None),
-                })
+async def search_contacts(query: str = Query(..., min_length=1), limit: int = Query(default=20, ge=1, le=100)):
+    """Search contacts by name, username, or phone.
+
+    Answered from the local contact index; Telegram is only searched when nothing local matches.
+    """
+    try:
+        await contact_index.ensure_fresh()
+        contacts = contact_index.search(query, limit)
+        if contacts:
+            return {"contacts": contacts, "count": len(contacts), "source": "local"}
         
-        return {"contacts": contacts, "count": len(contacts)}
+        contact_index.remote_searches += 1
+        result = await rpc(
+            "search_contacts", lambda: client(functions.contacts.SearchRequest(q=query, limit=limit)),
+            priority=PRIORITY_INTERACTIVE
+        )
+        contacts = [format_contact(user) for user in result.users if isinstance(user, User)]
+        
+        return {"contacts": contacts, "count": len(contacts), "source": "telegram"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -461,22 +4457,257 @@ class EditMessageRequest(BaseModel):
 
 
 @app.get("/chats/{chat_id}/history")
-async def get_history(chat_id: Union[int, str], limit: int = Query(default=100, le=500)):
+async def get_history(
+    chat_id: Union[int, str],
+    limit: int = Query(default=100, le=500),
+    fields: Optional[str] = Query(default=None, description="Comma-separated message fields to return, e.g. id,text,sender_id")
+):
     """Get full chat history."""
+    selected = parse_fields(fields)
     try:
-        if isinstance(chat_id, str) and not chat_id.lstrip('-').isdigit():
-            entity = await client.get_entity(chat_id)
-        else:
-            entity = await client.get_entity(int(chat_id))
+        entity = await resolve_entity(chat_id)
         
-        messages = await client.get_messages(entity, limit=limit)
+        messages, source = await read_messages(entity, limit, priority=PRIORITY_BACKGROUND, fields=selected)
+        return {
+            "messages": messages,
+            "count": len(messages),
+            "source": source
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def encode_cursor(offset_id: int, min_id: int, max_id: int) -> str:
+    """Pack a history position into an opaque resume cursor."""
+    raw = json.dumps({"offset_id": offset_id, "min_id": min_id, "max_id": max_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Dict[str, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+        return {key: int(data.get(key) or 0) for key in ("offset_id", "min_id", "max_id")}
+    except (ValueError, TypeError, AttributeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+@app.get("/chats/{chat_id}/history/export")
+async def export_history(
+    chat_id: Union[int, str],
+    limit: Optional[int] = Query(default=None, ge=1, description="Max messages to export (default: everything)"),
+    offset_id: int = Query(default=0, description="Start from messages older than this ID"),
+    min_id: int = Query(default=0, description="Only messages newer than this ID"),
+    max_id: int = Query(default=0, description="Only messages older than this ID"),
+    cursor: Optional[str] = Query(default=None, description="Resume cursor returned by a previous export"),
+    batch_size: int = Query(default=100, ge=1, le=100),
+    fields: Optional[str] = Query(default=None, description="Comma-separated message fields to return, e.g. id,text,sender_id")
+):
+    """Stream chat history newest-first as NDJSON with constant memory.
+
+    Emits {"type": "message", "message": {...}} lines as each page arrives and ends with
+    {"type": "end", "count": N, "cursor": ...}; the cursor is null once history is exhausted.
+    """
+    selected = parse_fields(fields)
+    if cursor:
+        position = decode_cursor(cursor)
+        offset_id, min_id, max_id = position["offset_id"], position["min_id"], position["max_id"]
+
+    try:
+        entity = await resolve_entity(chat_id)
+        peer_id = utils.get_peer_id(entity)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def export_stream():
+        offset = offset_id
+        exported = 0
+        exhausted = False
+        while limit is None or exported < limit:
+            page_size = batch_size if limit is None else min(batch_size, limit - exported)
+            try:
+                page = await rpc(
+                    "get_messages",
+                    lambda: client.get_messages(entity, limit=page_size, offset_id=offset, min_id=min_id, max_id=max_id),
+                    priority=PRIORITY_BACKGROUND
+                )
+            except Exception as e:
+                yield json_line({"type": "error", "detail": str(e), "cursor": encode_cursor(offset, min_id, max_id)})
+                return
+            if not page:
+                exhausted = True
+                break
+            formatted, stored = format_messages(page, selected, full=message_store is not None)
+            if stored is not None:
+                message_store.record_page(peer_id, stored, page_size, offset, min_id, max_id,
+                                          watched=str(peer_id) in watched_chats)
+            yield b"".join(json_line({"type": "message", "message": message}) for message in formatted)
+            exported += len(page)
+            offset = page[-1].id
+
+        end_cursor = None if exhausted else encode_cursor(offset, min_id, max_id)
+        yield json_line({"type": "end", "count": exported, "cursor": end_cursor})
+
+    return StreamingResponse(export_stream(), media_type="application/x-ndjson")
+
+
+class BackfillShard:
+    """One id range of a backfill, fetched newest-first by its own worker."""
+
+    def __init__(self, index: int, low: int, high: int, queue_size: int):
+        self.index = index
+        self.low = low  # exclusive
+        self.high = high  # exclusive
+        self.offset = high
+        self.fetched = 0
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+
+    def stats(self) -> Dict[str, Any]:
+        elapsed = 0.0
+        if self.started_at is not None:
+            elapsed = (self.finished_at or time.monotonic()) - self.started_at
         return {
-            "messages": [format_message(msg) for msg in messages],
-            "count": len(messages)
+            "shard": self.index,
+            "range": [self.low, self.high],
+            "fetched": self.fetched,
+            "done": self.finished_at is not None,
+            "msgs_per_sec": round(self.fetched / elapsed, 1) if elapsed > 0 else 0.0,
         }
+
+
+@app.get("/chats/{chat_id}/history/backfill")
+async def backfill_history(
+    chat_id: Union[int, str],
+    shards: int = Query(default=8, ge=1, le=64, description="Number of id ranges to split history into"),
+    concurrency: int = Query(default=4, ge=1, le=16, description="Shards fetched at the same time"),
+    ordered: bool = Query(default=True, description="Emit messages in id order (newest first); false emits as fetched"),
+    min_id: int = Query(default=0, description="Only messages newer than this ID"),
+    max_id: int = Query(default=0, description="Only messages older than this ID (default: latest)"),
+    batch_size: int = Query(default=100, ge=1, le=100),
+    progress_interval: float = Query(default=2.0, ge=0.1, description="Seconds between progress lines"),
+    fields: Optional[str] = Query(default=None, description="Comma-separated message fields to return, e.g. id,text,sender_id")
+):
+    """Backfill a large history by fetching id-range shards concurrently, streamed as NDJSON.
+
+    Besides "message" lines, emits periodic "progress" lines with per-shard throughput,
+    "error" lines with a resume cursor for a failed shard, and a final "end" line.
+    """
+    selected = parse_fields(fields)
+    try:
+        entity = await resolve_entity(chat_id)
+        peer_id = utils.get_peer_id(entity)
+        if not max_id:
+            latest = await rpc("get_messages", lambda: client.get_messages(entity, limit=1), priority=PRIORITY_BACKGROUND)
+            max_id = latest[0].id + 1 if latest else 0
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    # Split the ids strictly between min_id and max_id into contiguous ranges,
+    # highest range first; shard i covers ids in (edges[i + 1], edges[i]]
+    span = max(max_id - min_id - 1, 0)
+    shard_count = max(1, min(shards, span))
+    edges = [max_id - 1 - (span * i) // shard_count for i in range(shard_count + 1)]
+    queue_size = 4
+    parts = [BackfillShard(i, edges[i + 1], edges[i] + 1, queue_size) for i in range(shard_count)] if span else []
+    merged: asyncio.Queue = asyncio.Queue(maxsize=queue_size * concurrency)
+
+    async def fetch_shard(shard: BackfillShard, semaphore: asyncio.Semaphore):
+        output = shard.queue if ordered else merged
+        shard.started_at = time.monotonic()
+        try:
+            while True:
+                page = await rpc(
+                    "get_messages",
+                    lambda: client.get_messages(
+                        entity, limit=batch_size, offset_id=shard.offset, min_id=shard.low, max_id=shard.high
+                    ),
+                    priority=PRIORITY_BACKGROUND
+                )
+                if not page:
+                    break
+                formatted, stored = format_messages(page, selected, full=message_store is not None)
+                if stored is not None:
+                    message_store.record_page(peer_id, stored, batch_size, shard.offset, shard.low, shard.high)
+                shard.fetched += len(page)
+                shard.offset = page[-1].id
+                await output.put(b"".join(json_line({"type": "message", "message": message}) for message in formatted))
+        except Exception as e:
+            shard.error = str(e)
+            await output.put(json_line({
+                "type": "error",
+                "shard": shard.index,
+                "detail": shard.error,
+                "cursor": encode_cursor(shard.offset, shard.low, shard.high),
+            }))
+        finally:
+            shard.finished_at = time.monotonic()
+            semaphore.release()
+            await output.put(None)
+
+    async def launch(semaphore: asyncio.Semaphore, tasks: List[asyncio.Task]):
+        # Shards are started strictly in order so the shard being drained always holds a slot
+        for shard in parts:
+            await semaphore.acquire()
+            tasks.append(asyncio.create_task(fetch_shard(shard, semaphore)))
+
+    async def backfill_stream():
+        started = time.monotonic()
+        semaphore = asyncio.Semaphore(concurrency)
+        tasks: List[asyncio.Task] = []
+        launcher = asyncio.create_task(launch(semaphore, tasks))
+        last_progress = started
+
+        def progress_line() -> Optional[bytes]:
+            nonlocal last_progress
+            now = time.monotonic()
+            if now - last_progress < progress_interval:
+                return None
+            last_progress = now
+            return json_line({
+                "type": "progress",
+                "elapsed": round(now - started, 2),
+                "fetched": sum(shard.fetched for shard in parts),
+                "shards": [shard.stats() for shard in parts if shard.started_at is not None],
+            })
+
+        try:
+            if ordered:
+                for shard in parts:
+                    while (chunk := await shard.queue.get()) is not None:
+                        yield chunk
+                        if (line := progress_line()) is not None:
+                            yield line
+            else:
+                remaining = len(parts)
+                while remaining:
+                    chunk = await merged.get()
+                    if chunk is None:
+                        remaining -= 1
+                        continue
+                    yield chunk
+                    if (line := progress_line()) is not None:
+                        yield line
+
+            elapsed = time.monotonic() - started
+            total = sum(shard.fetched for shard in parts)
+            yield json_line({
+                "type": "end",
+                "count": total,
+                "elapsed": round(elapsed, 2),
+                "msgs_per_sec": round(total / elapsed, 1) if elapsed > 0 else 0.0,
+                "failed_shards": [shard.index for shard in parts if shard.error],
+                "shards": [shard.stats() for shard in parts],
+            })
+        finally:
+            launcher.cancel()
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(backfill_stream(), media_type="application/x-ndjson")
+
 
 @app.post("/chats/{chat_id}/messages/{message_id}/reaction")
 async def send_reaction(chat_id: Union[int, str], message_id: int, request: ReactionRequest):
@@ -484,17 +4715,19 @@ async def send_reaction(chat_id: Union[int, str], message_id: int, request: Reac
     try:
         from telethon.tl.types import ReactionEmoji
         
-        if isinstance(chat_id, str) and not chat_id.lstrip('-').isdigit():
-            entity = await client.get_entity(chat_id)
-        else:
-            entity = await client.get_entity(int(chat_id))
+        entity = await resolve_entity(chat_id)
         
-        await client(functions.messages.SendReactionRequest(
+        await rpc(
+            "send_reaction",
+            lambda: client(functions.messages.SendReactionRequest(
+                peer=entity,
+                msg_id=message_id,
+                big=request.big,
+                reaction=[ReactionEmoji(emoticon=request.emoji)]
+            )),
             peer=entity,
-            msg_id=message_id,
-            big=request.big,
-            reaction=[ReactionEmoji(emoticon=request.emoji)]
-        ))
+            priority=PRIORITY_INTERACTIVE
+        )
         
         return {"success": True, "emoji": request.emoji}
     except Exception as e:
@@ -505,12 +4738,13 @@ async def send_reaction(chat_id: Union[int, str], message_id: int, request: Reac
 async def reply_to_message(chat_id: Union[int, str], message_id: int, request: SendMessageRequest):
     """Reply to a specific message."""
     try:
-        if isinstance(chat_id, str) and not chat_id.lstrip('-').isdigit():
-            entity = await client.get_entity(chat_id)
-        else:
-            entity = await client.get_entity(int(chat_id))
+        entity = await resolve_entity(chat_id)
         
-        result = await client.send_message(entity, request.message, reply_to=message_id)
+        result = await rpc(
+            "send_message", lambda: client.send_message(entity, request.message, reply_to=message_id),
+            peer=entity, priority=PRIORITY_INTERACTIVE
+        )
+        record_sent(entity, [result])
         
         return {
             "success": True,
@@ -525,12 +4759,13 @@ async def reply_to_message(chat_id: Union[int, str], message_id: int, request: S
 async def edit_message(chat_id: Union[int, str], message_id: int, request: EditMessageRequest):
     """Edit a message."""
     try:
-        if isinstance(chat_id, str) and not chat_id.lstrip('-').isdigit():
-            entity = await client.get_entity(chat_id)
-        else:
-            entity = await client.get_entity(int(chat_id))
+        entity = await resolve_entity(chat_id)
         
-        result = await client.edit_message(entity, message_id, request.new_text)
+        result = await rpc(
+            "edit_message", lambda: client.edit_message(entity, message_id, request.new_text),
+            peer=entity, priority=PRIORITY_INTERACTIVE
+        )
+        record_edited(entity, result)
         
         return {"success": True, "message_id": result.id}
     except Exception as e:
@@ -541,12 +4776,10 @@ async def edit_message(chat_id: Union[int, str], message_id: int, request: EditM
 async def delete_message(chat_id: Union[int, str], message_id: int):
     """Delete a message."""
     try:
-        if isinstance(chat_id, str) and not chat_id.lstrip('-').isdigit():
-            entity = await client.get_entity(chat_id)
-        else:
-            entity = await client.get_entity(int(chat_id))
+        entity = await resolve_entity(chat_id)
         
-        await client.delete_messages(entity, [message_id])
+        await rpc("delete_messages", lambda: client.delete_messages(entity, [message_id]), priority=PRIORITY_INTERACTIVE)
+        record_deleted(entity, [message_id])
         
         return {"success": True}
     except Exception as e:
@@ -557,17 +4790,15 @@ async def delete_message(chat_id: Union[int, str], message_id: int):
 async def forward_message(chat_id: Union[int, str], message_id: int, to_chat_id: Union[int, str] = Query(...)):
     """Forward a message to another chat."""
     try:
-        if isinstance(chat_id, str) and not chat_id.lstrip('-').isdigit():
-            from_entity = await client.get_entity(chat_id)
-        else:
-            from_entity = await client.get_entity(int(chat_id))
+        from_entity = await resolve_entity(chat_id)
         
-        if isinstance(to_chat_id, str) and not to_chat_id.lstrip('-').isdigit():
-            to_entity = await client.get_entity(to_chat_id)
-        else:
-            to_entity = await client.get_entity(int(to_chat_id))
+        to_entity = await resolve_entity(to_chat_id)
         
-        result = await client.forward_messages(to_entity, message_id, from_entity)
+        result = await rpc(
+            "forward_messages", lambda: client.forward_messages(to_entity, message_id, from_entity),
+            peer=to_entity, priority=PRIORITY_INTERACTIVE
+        )
+        record_sent(to_entity, [result])
         
         return {"success": True, "message_id": result.id if hasattr(result, 'id') else None}
     except Exception as e:
@@ -575,17 +4806,18 @@ async def forward_message(chat_id: Union[int, str], message_id: int, to_chat_id:
 
 
 @app.post("/chats/{chat_id}/read")
-async def mark_as_read(chat_id: Union[int, str]):
-    """Mark all messages in chat as read."""
+async def mark_as_read(chat_id: Union[int, str], max_id: Optional[int] = Query(None, ge=1)):
+    """Mark messages in chat as read, up to `max_id` or all of them.
+
+    Acks for the same chat are coalesced: at most one is sent per READ_ACK_INTERVAL,
+    covering the highest id asked for in the meantime.
+    """
     try:
-        if isinstance(chat_id, str) and not chat_id.lstrip('-').isdigit():
-            entity = await client.get_entity(chat_id)
-        else:
-            entity = await client.get_entity(int(chat_id))
+        entity = await resolve_entity(chat_id)
         
-        await client.send_read_acknowledge(entity)
+        sent_max_id = await read_acks.ack(entity, max_id)
         
-        return {"success": True}
+        return {"success": True, "max_id": sent_max_id or None}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -594,12 +4826,9 @@ async def mark_as_read(chat_id: Union[int, str]):
 async def pin_message(chat_id: Union[int, str], message_id: int):
     """Pin a message."""
     try:
-        if isinstance(chat_id, str) and not chat_id.lstrip('-').isdigit():
-            entity = await client.get_entity(chat_id)
-        else:
-            entity = await client.get_entity(int(chat_id))
+        entity = await resolve_entity(chat_id)
         
-        await client.pin_message(entity, message_id)
+        await rpc("pin_message", lambda: client.pin_message(entity, message_id), peer=entity, priority=PRIORITY_INTERACTIVE)
         
         return {"success": True}
     except Exception as e:
@@ -607,19 +4836,35 @@ async def pin_message(chat_id: Union[int, str], message_id: int):
 
 
 @app.get("/chats/{chat_id}/search")
-async def search_messages(chat_id: Union[int, str], query: str = Query(...), limit: int = Query(default=20, le=100)):
+async def search_messages(
+    chat_id: Union[int, str],
+    query: str = Query(...),
+    limit: int = Query(default=20, le=100),
+    local_only: bool = Query(default=False, description="Search only the local store, even if it doesn't hold the whole chat"),
+    fields: Optional[str] = Query(default=None, description="Comma-separated message fields to return, e.g. id,text,sender_id")
+):
     """Search messages in a chat."""
+    selected = parse_fields(fields)
     try:
-        if isinstance(chat_id, str) and not chat_id.lstrip('-').isdigit():
-            entity = await client.get_entity(chat_id)
-        else:
-            entity = await client.get_entity(int(chat_id))
+        entity = await resolve_entity(chat_id)
+        peer_id = utils.get_peer_id(entity)
         
-        messages = await client.get_messages(entity, limit=limit, search=query)
+        # The local index answers when it holds the chat's whole history
+        if message_store is not None:
+            found = await message_store.search(peer_id, query, limit, force=local_only)
+            if found is not None:
+                found = project_messages(found, selected)
+                return {"messages": found, "count": len(found), "source": "store"}
+        
+        messages = await rpc("search_messages", lambda: client.get_messages(entity, limit=limit, search=query))
+        found, stored = format_messages(messages, selected, full=message_store is not None)
+        if stored is not None:
+            message_store.record(peer_id, stored)
         
         return {
-            "messages": [format_message(msg) for msg in messages],
-            "count": len(messages)
+            "messages": found,
+            "count": len(found),
+            "source": "telegram"
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -628,30 +4873,36 @@ async def search_messages(chat_id: Union[int, str], query: str = Query(...), lim
 @app.get("/users/{user_id}/status")
 async def get_user_status(user_id: Union[int, str]):
     """Get user online status."""
+    async def load():
+        statuses, errors = await fetch_statuses([user_id])
+        if user_id not in statuses:
+            raise ValueError(errors.get(str(user_id), "User not found"))
+        return statuses[user_id]
+    
     try:
-        if isinstance(user_id, str) and not user_id.lstrip('-').isdigit():
-            entity = await client.get_entity(user_id)
-        else:
-            entity = await client.get_entity(int(user_id))
-        
-        status = getattr(entity, "status", None)
-        status_str = type(status).__name__ if status else "Unknown"
-        
-        # Parse status type
-        if "Online" in status_str:
-            result = "online"
-        elif "Recently" in status_str:
-            result = "recently"
-        elif "LastWeek" in status_str:
-            result = "last_week"
-        elif "LastMonth" in status_str:
-            result = "last_month"
-        elif "Offline" in status_str:
-            result = "offline"
-        else:
-            result = status_str.lower()
+        return await read_flight.do(("user_status", EntityCache.key_for(user_id)), load)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+class UserStatusRequest(BaseModel):
+    user_ids: List[Union[int, str]]
+
+
+@app.post("/users/status")
+async def get_user_statuses(request: UserStatusRequest):
+    """Get online status for many users at once.
+
+    Statuses come from the presence cache where known; the rest are fetched up to 200
+    users per request. Unresolvable users are listed under `errors`.
+    """
+    if len(request.user_ids) > PRESENCE_MAX_USERS:
+        raise HTTPException(status_code=400, detail=f"At most {PRESENCE_MAX_USERS} users per request")
+    try:
+        statuses, errors = await fetch_statuses(request.user_ids)
         
-        return {"user_id": entity.id, "status": result, "raw_status": status_str}
+        ordered = [statuses[ref] for ref in dict.fromkeys(request.user_ids) if ref in statuses]
+        return {"statuses": ordered, "count": len(ordered), "errors": errors}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -659,18 +4910,18 @@ async def get_user_status(user_id: Union[int, str]):
 @app.get("/users/{user_id}/photos")
 async def get_user_photos(user_id: Union[int, str], limit: int = Query(default=10, le=50)):
     """Get user profile photos."""
-    try:
-        if isinstance(user_id, str) and not user_id.lstrip('-').isdigit():
-            entity = await client.get_entity(user_id)
-        else:
-            entity = await client.get_entity(int(user_id))
+    async def load():
+        entity = await resolve_entity(user_id)
         
-        photos = await client.get_profile_photos(entity, limit=limit)
+        photos = await rpc("get_profile_photos", lambda: client.get_profile_photos(entity, limit=limit))
         
         return {
             "photos": [{"id": p.id, "date": p.date.isoformat() if p.date else None} for p in photos],
             "count": len(photos)
         }
+    
+    try:
+        return await read_flight.do(("user_photos", EntityCache.key_for(user_id), limit), load)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -681,7 +4932,7 @@ async def search_gifs(query: str = Query(...), limit: int = Query(default=10, le
     try:
         from telethon.tl.types import InputBotInlineMessageID
         
-        result = await client.inline_query("@gif", query)
+        result = await rpc("inline_query", lambda: client.inline_query("@gif", query))
         gifs = []
         
         for i, r in enumerate(result):
@@ -698,55 +4949,409 @@ async def search_gifs(query: str = Query(...), limit: int = Query(default=10, le
         raise HTTPException(status_code=500, detail=str(e))
 
 
-# ============= WATCH CHAT ENDPOINTS =============
+# ============= BULK ENDPOINTS =============
 
-from fastapi.responses import StreamingResponse
-from starlette.requests import Request
+class BulkMessageItem(BaseModel):
+    chat_id: Union[int, str]
+    message: str
+    reply_to: Optional[int] = None
+    minutes_from_now: Optional[int] = None
 
 
-@app.get("/chats/{chat_id}/watch")
-async def watch_chat(chat_id: Union[int, str], request: Request):
-    """Watch a chat for new messages in real-time using Server-Sent Events."""
+class BulkSendRequest(BaseModel):
+    items: List[BulkMessageItem]
+    concurrency: int = BULK_CONCURRENCY
+
+
+async def send_bulk_item(index: int, item: BulkMessageItem) -> Dict[str, Any]:
+    """Send or schedule one bulk item, reporting failures in the result instead of raising."""
+    result = {"index": index, "chat_id": item.chat_id}
     try:
-        # Resolve entity and get chat ID
-        if isinstance(chat_id, str) and not chat_id.lstrip('-').isdigit():
-            entity = await client.get_entity(chat_id)
+        kwargs = {}
+        if item.reply_to:
+            kwargs["reply_to"] = item.reply_to
+        if item.minutes_from_now is not None:
+            if not 1 <= item.minutes_from_now <= 525600:
+                raise ValueError("minutes_from_now must be between 1 and 525600 (1 year)")
+            kwargs["schedule"] = datetime.now() + timedelta(minutes=item.minutes_from_now)
+
+        await bind_account(item.chat_id, account_hint.get())
+        entity = await resolve_entity(item.chat_id)
+        sent = await rpc("send_message", lambda: client.send_message(entity, item.message, **kwargs), peer=entity)
+
+        result["success"] = True
+        result["message_id"] = sent.id
+        if "schedule" in kwargs:
+            result["scheduled_for"] = kwargs["schedule"].isoformat()
         else:
-            entity = await client.get_entity(int(chat_id))
+            record_sent(entity, [sent])
+            result["date"] = sent.date.isoformat() if sent.date else None
+    except Exception as e:
+        result["success"] = False
+        result["error"] = str(e)
+    return result
+
+
+@app.post("/messages/bulk")
+async def send_bulk(request: BulkSendRequest):
+    """Send or schedule many messages concurrently, streaming per-item results as NDJSON.
+
+    Results are emitted in completion order; use `index` to match them to the request.
+    """
+    if len(request.items) > BULK_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_MAX_ITEMS} items per request")
+    if request.concurrency < 1:
+        raise HTTPException(status_code=400, detail="concurrency must be at least 1")
+
+    async def result_stream():
+        semaphore = asyncio.Semaphore(request.concurrency)
+        results: asyncio.Queue = asyncio.Queue()
+
+        async def worker(index: int, item: BulkMessageItem):
+            async with semaphore:
+                await results.put(await send_bulk_item(index, item))
+
+        tasks = [asyncio.create_task(worker(i, item)) for i, item in enumerate(request.items)]
+        try:
+            sent = 0
+            for _ in tasks:
+                result = await results.get()
+                sent += result["success"]
+                yield json_line(result)
+            yield json_line({"done": True, "total": len(tasks), "succeeded": sent, "failed": len(tasks) - sent})
+        finally:
+            # Client went away: stop dispatching the rest
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(result_stream(), media_type="application/x-ndjson")
+
+
+# Telegram's cap on message ids per messages.deleteMessages / forwardMessages call
+MESSAGE_ID_CHUNK = 100
+
+
+class BulkDeleteRequest(BaseModel):
+    message_ids: List[int]
+    revoke: bool = True
+
+
+class BulkForwardRequest(BaseModel):
+    message_ids: List[int]
+    to_chat_id: Union[int, str]
+
+
+class BulkReactionRequest(ReactionRequest):
+    message_ids: List[int]
+
+
+def unique_message_ids(message_ids: List[int]) -> List[int]:
+    """Deduplicate ids keeping their order, enforcing BULK_MAX_ITEMS."""
+    if len(message_ids) > BULK_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_MAX_ITEMS} message ids per request")
+    return list(dict.fromkeys(message_ids))
+
+
+def message_id_chunks(message_ids: List[int]) -> List[List[int]]:
+    ids = unique_message_ids(message_ids)
+    return [ids[i:i + MESSAGE_ID_CHUNK] for i in range(0, len(ids), MESSAGE_ID_CHUNK)]
+
+
+@app.post("/chats/{chat_id}/messages/delete")
+async def delete_messages(chat_id: Union[int, str], request: BulkDeleteRequest):
+    """Delete many messages, 100 per Telegram request.
+
+    Chunks run concurrently; ids of a failed chunk are listed under `errors`.
+    """
+    chunks = message_id_chunks(request.message_ids)
+    try:
+        entity = await resolve_entity(chat_id)
+        
+        results = await asyncio.gather(*(
+            rpc(
+                "delete_messages", lambda chunk=chunk: client.delete_messages(entity, chunk, revoke=request.revoke),
+                priority=PRIORITY_INTERACTIVE
+            )
+            for chunk in chunks
+        ), return_exceptions=True)
         
-        chat_id_str = str(entity.id)
+        deleted = 0
+        errors = []
+        for chunk, result in zip(chunks, results):
+            if isinstance(result, Exception):
+                errors.append({"message_ids": chunk, "error": str(result)})
+            else:
+                deleted += sum(affected.pts_count for affected in result)
+                record_deleted(entity, chunk)
+        
+        return {
+            "success": not errors,
+            "requested": sum(map(len, chunks)),
+            "deleted": deleted,
+            "requests": len(chunks),
+            "errors": errors,
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/chats/{chat_id}/messages/forward")
+async def forward_messages(chat_id: Union[int, str], request: BulkForwardRequest):
+    """Forward many messages to another chat, 100 per Telegram request.
+
+    Chunks are sent one after another so the messages arrive in order. `forwarded`
+    maps each original id to the new message id (None if Telegram skipped it).
+    """
+    chunks = message_id_chunks(request.message_ids)
+    try:
+        from_entity = await resolve_entity(chat_id)
+        
+        to_entity = await resolve_entity(request.to_chat_id)
+        
+        forwarded = []
+        errors = []
+        for chunk in chunks:
+            try:
+                result = await rpc(
+                    "forward_messages", lambda chunk=chunk: client.forward_messages(to_entity, chunk, from_entity),
+                    peer=to_entity, priority=PRIORITY_INTERACTIVE
+                )
+            except Exception as e:
+                errors.append({"message_ids": chunk, "error": str(e)})
+                continue
+            record_sent(to_entity, result)
+            for message_id, message in zip(chunk, result):
+                forwarded.append({"message_id": message_id, "new_message_id": message.id if message else None})
+        
+        return {
+            "success": not errors,
+            "requested": sum(map(len, chunks)),
+            "forwarded": forwarded,
+            "requests": len(chunks),
+            "errors": errors,
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/chats/{chat_id}/messages/react")
+async def send_reactions(chat_id: Union[int, str], request: BulkReactionRequest):
+    """React to many messages with the same emoji.
+
+    Telegram has no multi-message reaction call, so this is one request per message,
+    paced by the scheduler's per-chat limits.
+    """
+    message_ids = unique_message_ids(request.message_ids)
+    try:
+        entity = await resolve_entity(chat_id)
+        
+        reaction = [types.ReactionEmoji(emoticon=request.emoji)]
+        results = await asyncio.gather(*(
+            rpc(
+                "send_reaction",
+                lambda message_id=message_id: client(functions.messages.SendReactionRequest(
+                    peer=entity, msg_id=message_id, big=request.big, reaction=reaction
+                )),
+                peer=entity
+            )
+            for message_id in message_ids
+        ), return_exceptions=True)
+        
+        errors = [
+            {"message_ids": [message_id], "error": str(result)}
+            for message_id, result in zip(message_ids, results) if isinstance(result, Exception)
+        ]
+        
+        return {
+            "success": not errors,
+            "requested": len(message_ids),
+            "reacted": len(message_ids) - len(errors),
+            "emoji": request.emoji,
+            "errors": errors,
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# ============= BATCH ENDPOINT =============
+
+class BatchOperation(BaseModel):
+    op: str
+    params: Dict[str, Any] = {}
+    id: Optional[str] = None
+    depends_on: List[str] = []
+
+
+class BatchRequest(BaseModel):
+    operations: List[BatchOperation]
+    concurrency: Optional[int] = None
+
+
+# Route handlers a batch may call, by function name. Streaming endpoints are left out:
+# their results don't fit in a single JSON response.
+BATCH_HANDLERS = {
+    handler.__name__: handler
+    for handler in (
+        get_me, get_chats, get_chat, get_messages, send_message, schedule_message,
+        get_contacts, search_contacts, get_history, send_reaction, reply_to_message,
+        edit_message, delete_message, forward_message, mark_as_read, pin_message,
+        search_messages, get_user_status, get_user_statuses, get_user_photos, search_gifs,
+        delete_messages, forward_messages, send_reactions,
+    )
+}
+
+
+BATCH_PARAMS = {name: handler_params_model(handler) for name, handler in BATCH_HANDLERS.items()}
+
+
+async def run_batch_operation(operation: BatchOperation) -> Dict[str, Any]:
+    """Call one handler, reporting failures in the result instead of raising."""
+    started = time.monotonic()
+    result: Dict[str, Any] = {"id": operation.id, "op": operation.op}
+    try:
+        handler = BATCH_HANDLERS.get(operation.op)
+        if handler is None:
+            raise HTTPException(status_code=404, detail=f"Unknown operation: {operation.op}")
+        try:
+            validated = BATCH_PARAMS[operation.op].model_validate(operation.params)
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail=e.errors(include_url=False, include_context=False))
+        await bind_account(getattr(validated, "chat_id", getattr(validated, "user_id", None)), account_hint.get())
+        value = await handler(**{name: getattr(validated, name) for name in type(validated).model_fields})
+        result["status"] = 200
+        result["result"] = value
+    except HTTPException as e:
+        result["status"] = e.status_code
+        result["error"] = e.detail
+    except Exception as e:
+        result["status"] = 500
+        result["error"] = str(e)
+    result["elapsed_ms"] = round((time.monotonic() - started) * 1000, 1)
+    return result
+
+
+@app.post("/batch")
+async def run_batch(request: BatchRequest):
+    """Run many bridge operations in one round trip.
+
+    Each operation names a route handler (e.g. "get_user_status") and its parameters,
+    path, query and body alike. Operations run concurrently, except that one listing
+    `depends_on` waits for those (earlier) operations and is skipped with status 424 if
+    any of them failed. Results come back in request order, with per-operation errors.
+    """
+    if len(request.operations) > BATCH_MAX_OPERATIONS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_OPERATIONS} operations per batch")
+    concurrency = min(request.concurrency or BATCH_CONCURRENCY, BATCH_CONCURRENCY)
+    if concurrency < 1:
+        raise HTTPException(status_code=400, detail="concurrency must be at least 1")
+
+    operations = request.operations
+    positions: Dict[str, int] = {}
+    for index, operation in enumerate(operations):
+        if operation.id is None:
+            operation.id = str(index)
+        if operation.id in positions:
+            raise HTTPException(status_code=400, detail=f"Duplicate operation id: {operation.id}")
+        # Only earlier operations may be depended on, which rules out cycles
+        for dependency in operation.depends_on:
+            if dependency not in positions:
+                raise HTTPException(
+                    status_code=400, detail=f"Operation {operation.id} depends on unknown or later operation {dependency}"
+                )
+        positions[operation.id] = index
+
+    started = time.monotonic()
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks: List[asyncio.Task] = []
+
+    async def run(operation: BatchOperation) -> Dict[str, Any]:
+        if operation.depends_on:
+            dependencies = await asyncio.gather(*(tasks[positions[d]] for d in operation.depends_on))
+            failed = [d["id"] for d in dependencies if d["status"] >= 400]
+            if failed:
+                return {"id": operation.id, "op": operation.op, "status": 424,
+                        "error": f"Skipped: dependencies failed: {', '.join(failed)}", "elapsed_ms": 0.0}
+        async with semaphore:
+            return await run_batch_operation(operation)
+
+    for operation in operations:
+        tasks.append(asyncio.create_task(run(operation)))
+    try:
+        results = await asyncio.gather(*tasks)
+    finally:
+        # Client went away: stop the rest
+        for task in tasks:
+            task.cancel()
+
+    failed = sum(1 for result in results if result["status"] >= 400)
+    return {
+        "results": results,
+        "count": len(results),
+        "succeeded": len(results) - failed,
+        "failed": failed,
+        "elapsed_ms": round((time.monotonic() - started) * 1000, 1),
+    }
+
+
+# ============= WATCH CHAT ENDPOINTS =============
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+
+@app.get("/chats/{chat_id}/watch")
+async def watch_chat(
+    chat_id: Union[int, str],
+    request: Request,
+    buffer_size: int = Query(default=WATCH_BUFFER_SIZE, ge=1, le=10000, description="Per-subscriber buffer size"),
+    policy: str = Query(default=WATCH_SLOW_CONSUMER_POLICY, description="Slow consumer policy: drop_oldest, disconnect"),
+    last_event_id: Optional[int] = Query(default=None, description="Replay events after this id (same as the Last-Event-ID header)")
+):
+    """Watch a chat for new messages in real-time using Server-Sent Events.
+
+    Every frame carries an `id:`; reconnecting with `Last-Event-ID` replays missed messages first.
+    """
+    try:
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise HTTPException(status_code=400, detail=f"policy must be one of: {', '.join(SLOW_CONSUMER_POLICIES)}")
+
+        header_event_id = request.headers.get("last-event-id", "").strip()
+        if last_event_id is None and header_event_id.isdigit():
+            last_event_id = int(header_event_id)
+
+        # Resolve the chat, then subscribe to its topic (created on first use)
+        chat_id_str = await watch_key(chat_id)
         
-        # Create queue for this chat if not exists
-        if chat_id_str not in watched_chats:
-            watched_chats[chat_id_str] = asyncio.Queue()
+        subscriber = Subscriber(buffer_size, policy)
+        topic = await watch_topic(chat_id_str, subscriber, last_event_id)
         
         async def event_stream():
             """Stream new messages as Server-Sent Events."""
             try:
+                # Ask clients to reconnect quickly so the replay window covers the gap
+                yield "retry: 2000\n\n"
                 while True:
                     # Check if client disconnected
                     if await request.is_disconnected():
                         break
                     
-                    # Wait for new message with timeout
-                    try:
-                        message = await asyncio.wait_for(
-                            watched_chats[chat_id_str].get(),
-                            timeout=30.0
-                        )
-                        # Send message as SSE
-                        print(f"   📤 Sending message via SSE: {message.get('text', '')[:50]}...")
-                        yield f"data: {json.dumps(message, default=json_serializer)}\n\n"
-                    except asyncio.TimeoutError:
+                    # Wait for new messages with timeout
+                    batch = await subscriber.next_batch(timeout=30.0)
+                    if batch:
+                        # Send pending messages as SSE
+                        yield "".join(f"id: {event_id}\ndata: {payload}\n\n" for _, event_id, payload in batch)
+                        event_log.debug("SSE batch sent", extra={"chat_id": chat_id_str, "events": len(batch)})
+                    elif subscriber.closed:
+                        yield f": closed ({subscriber.close_reason})\n\n"
+                        break
+                    else:
                         # Send keep-alive ping
                         yield ": keep-alive\n\n"
             finally:
-                # Cleanup when client disconnects
-                if chat_id_str in watched_chats:
-                    del watched_chats[chat_id_str]
-                    print(f"📴 Stopped watching chat {chat_id_str}")
+                # Cleanup when client disconnects; the topic keeps recording for
+                # WATCH_RETENTION_SECONDS so a reconnect can replay what it missed
+                topic.unsubscribe(subscriber)
         
-        print(f"👀 Started watching chat {chat_id_str}")
+        log.info("Started watching chat", extra={"chat_id": chat_id_str})
         return StreamingResponse(
             event_stream(),
             media_type="text/event-stream",
@@ -755,6 +5360,8 @@ async def watch_chat(chat_id: Union[int, str], request: Request):
                 "Connection": "keep-alive",
             }
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -764,16 +5371,17 @@ async def unwatch_chat(chat_id: Union[int, str]):
     """Stop watching a chat."""
     try:
         # Resolve entity and get chat ID
-        if isinstance(chat_id, str) and not chat_id.lstrip('-').isdigit():
-            entity = await client.get_entity(chat_id)
-        else:
-            entity = await client.get_entity(int(chat_id))
+        entity = await resolve_entity(chat_id)
         
-        chat_id_str = str(entity.id)
+        chat_id_str = chat_key(entity)
         
-        # Remove from watched chats
+        # Remove from watched chats and disconnect its subscribers
         if chat_id_str in watched_chats:
-            del watched_chats[chat_id_str]
+            watched_chats.pop(chat_id_str).close()
+            if message_store is not None:
+                message_store.forget_live(int(chat_id_str))
+            if bridge_server is not None:
+                bridge_server.topic_closed(chat_id_str)
             return {"success": True, "message": f"Stopped watching chat {chat_id_str}"}
         else:
             return {"success": False, "message": f"Chat {chat_id_str} was not being watched"}
@@ -781,6 +5389,145 @@ async def unwatch_chat(chat_id: Union[int, str]):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.websocket("/ws")
+async def watch_many(
+    websocket: WebSocket,
+    buffer_size: int = Query(default=WATCH_BUFFER_SIZE * 4, ge=1, le=100000),
+    policy: str = Query(default=WATCH_SLOW_CONSUMER_POLICY),
+    batch_size: int = Query(default=WS_BATCH_SIZE, ge=1, le=1000),
+    linger_ms: int = Query(default=WS_BATCH_LINGER_MS, ge=0, le=1000)
+):
+    """Watch many chats over one WebSocket connection.
+
+    Client actions (JSON):
+      {"action": "subscribe", "chats": [...], "last_event_id": 123}
+      {"action": "unsubscribe", "chats": [...]}
+      {"action": "pause"} / {"action": "resume"}
+    Server frames: {"type": "messages", "items": [{"chat_id", "event_id", "message"}, ...]},
+    plus "subscribed", "unsubscribed" and "error" acknowledgements, and
+    {"type": "unwatched", "chat_id"} when a chat stops being watched (e.g. /unwatch).
+    """
+    if policy not in SLOW_CONSUMER_POLICIES:
+        await websocket.close(code=1008, reason=f"policy must be one of: {', '.join(SLOW_CONSUMER_POLICIES)}")
+        return
+    await websocket.accept()
+
+    # One subscriber (and one buffer) per connection, attached to every chat it follows
+    subscriber = Subscriber(buffer_size, policy, multiplexed=True)
+    topics: Dict[str, ChatTopic] = {}
+    resumed = asyncio.Event()
+    resumed.set()
+    hint = websocket.headers.get("x-telegram-account")
+
+    async def subscribe(chats: List[Union[int, str]], last_event_id: Optional[int]):
+        resolved, errors = {}, {}
+        for chat in chats:
+            try:
+                await bind_account(chat, hint)
+                chat_id_str = await watch_key(chat)
+                if chat_id_str not in topics:
+                    topics[chat_id_str] = await watch_topic(chat_id_str, subscriber, last_event_id)
+            except Exception as e:
+                errors[str(chat)] = e.detail if isinstance(e, HTTPException) else str(e)
+                continue
+            resolved[str(chat)] = chat_id_str
+        await websocket.send_json({"type": "subscribed", "chats": resolved, "errors": errors})
+
+    async def unsubscribe(chats: List[Union[int, str]]):
+        removed = []
+        for chat in chats:
+            try:
+                await bind_account(chat, hint)
+                chat_id_str = await watch_key(chat)
+            except Exception:
+                continue
+            topic = topics.pop(chat_id_str, None)
+            if topic is not None:
+                topic.unsubscribe(subscriber)
+                removed.append(chat_id_str)
+        await websocket.send_json({"type": "unsubscribed", "chats": removed})
+
+    async def receive_commands():
+        while True:
+            try:
+                command = await websocket.receive_json()
+            except (WebSocketDisconnect, ValueError):
+                return
+            action = command.get("action") if isinstance(command, dict) else None
+            if action == "subscribe":
+                await subscribe(command.get("chats", []), command.get("last_event_id"))
+            elif action == "unsubscribe":
+                await unsubscribe(command.get("chats", []))
+            elif action == "pause":
+                resumed.clear()
+            elif action == "resume":
+                resumed.set()
+            else:
+                await websocket.send_json({"type": "error", "detail": f"Unknown action: {action}"})
+
+    async def send_batches():
+        while not subscriber.closed or subscriber.buffer:
+            await resumed.wait()
+            batch = await subscriber.next_batch(timeout=30.0, max_items=batch_size)
+            if batch and len(batch) < batch_size and linger_ms:
+                # Give bursts a moment to coalesce into one frame
+                await asyncio.sleep(linger_ms / 1000)
+                batch.extend(subscriber.drain(batch_size - len(batch)))
+            items = []
+            for chat_id, event_id, payload in batch:
+                # Skip leftovers from chats unsubscribed while they were buffered
+                if chat_id not in topics:
+                    continue
+                if event_id is not None:
+                    items.append(f'{{"chat_id":{json.dumps(chat_id)},"event_id":{event_id},"message":{payload}}}')
+                    continue
+                if watched_chats.get(chat_id) is topics[chat_id]:
+                    # Subscribed again since
+                    continue
+                # The chat was unwatched: send what came before, then say so
+                if items:
+                    await websocket.send_text(f'{{"type":"messages","items":[{",".join(items)}]}}')
+                    items = []
+                del topics[chat_id]
+                await websocket.send_json({"type": payload, "chat_id": chat_id})
+            if items:
+                await websocket.send_text(f'{{"type":"messages","items":[{",".join(items)}]}}')
+        await websocket.close(code=1013, reason=subscriber.close_reason or "closed")
+
+    async def run_sender():
+        try:
+            await send_batches()
+        except (WebSocketDisconnect, RuntimeError):
+            pass
+
+    receiver = asyncio.create_task(receive_commands())
+    sender = asyncio.create_task(run_sender())
+    try:
+        await asyncio.wait({receiver, sender}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        receiver.cancel()
+        sender.cancel()
+        subscriber.close("disconnected")
+        for topic in topics.values():
+            topic.unsubscribe(subscriber)
+
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8765)
+    if BRIDGE_ROLE == "owner":
+        asyncio.run(run_owner())
+    elif BRIDGE_WORKERS > 1:
+        owner = launch_owner()
+        try:
+            # Workers import this module afresh and link to the owner instead of logging in
+            os.environ["BRIDGE_ROLE"] = "worker"
+            uvicorn.run(
+                f"{os.path.splitext(os.path.basename(__file__))[0]}:app",
+                app_dir=os.path.dirname(os.path.abspath(__file__)),
+                host="0.0.0.0", port=8765, workers=BRIDGE_WORKERS
+            )
+        finally:
+            owner.terminate()
+            owner.wait()
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8765)